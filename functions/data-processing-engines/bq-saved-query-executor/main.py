@@ -22,14 +22,33 @@ import os
 from google.cloud import bigquery, dataform_v1beta1, resourcemanager_v3
 from google.api_core.exceptions import BadRequest
 from google.auth.transport.requests import Request
+from structured_log import bind, get_logger, poll_sample_key
+from tracing import setup_tracing, span, traced, traced_request
+from profiling import phase, profiled
+from rate_limit import acquire, throttled_retry_after
 
 # --- Authentication Setup ---
 credentials, project = google.auth.default()
 
 BIGQUERY_PROJECT = os.environ.get('BIGQUERY_PROJECT')
+logger = get_logger('bq-saved-query-executor')
+
+setup_tracing(os.environ.get('K_SERVICE', 'bq-saved-query-executor'))
+
+
+class ScriptStatementFailed(Exception):
+    """
+    Raised for a finished script job whose statement failed, carrying the outcome of that statement
+    """
+
+    def __init__(self, message, failed_statement):
+        super().__init__(message)
+        self.failed_statement = failed_statement
 
 
 @functions_framework.http
+@profiled("bq-saved-query-executor")
+@traced_request("bq-saved-query-executor")
 def main(request):
     """
     Main function, likely triggered by an HTTP request. Extracts parameters, reads a BigQuery saved query
@@ -43,9 +62,13 @@ def main(request):
     """
 
     request_json = request.get_json(silent=True)
-    print("event:" + str(request_json))
+    bind(request_json)
+    logger.debug("event: %s", request_json)
 
     try:
+        if request_json.get('action') == 'cancel':
+            return cancel_job(request_json['job_id'])
+
         dataform_location = request_json['workflow_properties']['dataform_location']
         dataform_project_id = request_json['workflow_properties']['dataform_project_id']
         repository_name = request_json['workflow_properties']['repository_name']
@@ -55,25 +78,42 @@ def main(request):
 
         job_id = request_json.get('job_id', None)
         query_variables = request_json.get('query_variables', None)
+        composite_jobs = request_json['workflow_properties'].get('composite_jobs', None)
 
-        query_file = read_file(dataform_project_id, dataform_location, repository_name, file_path, query_variables)
-        status_or_job_id = execute_query_or_get_status(query_file, file_path, job_id)
+        if composite_jobs:
+            status_or_job_id = execute_script_or_get_status(dataform_project_id, dataform_location, repository_name,
+                                                            workflow_name, job_name, composite_jobs,
+                                                            query_variables, job_id)
+        else:
+            query_file = read_file(dataform_project_id, dataform_location, repository_name, file_path,
+                                   query_variables)
+            status_or_job_id = execute_query_or_get_status(query_file, file_path, job_id)
 
         if status_or_job_id.startswith('aef_'):
-            print(f"Running Query, track it with Job ID: {status_or_job_id}")
+            logger.info("Running Query, track it with Job ID: %s", status_or_job_id)
         else:
-            print(f"Query finished with status: {status_or_job_id}")
+            logger.info("Query finished with status: %s", status_or_job_id,
+                        extra={"sample_key": poll_sample_key(job_id, status_or_job_id)})
 
         return status_or_job_id
     except Exception as error:
         err_message = "Exception: " + repr(error)
+        logger.error(err_message, exc_info=True)
         response = {
             "error": error.__class__.__name__,
             "message": repr(error)
         }
+        if isinstance(error, ScriptStatementFailed):
+            response["failed_statement"] = error.failed_statement
+        retry_after = throttled_retry_after(error)
+        if retry_after is not None:
+            # throttled calls are retried by the intermediate function after Retry-After
+            return response, 429, {"Retry-After": str(retry_after)}
         return response
 
 
+@traced("dataform.read_file", "file_path")
+@phase("dataform_read_file")
 def read_file(project_id, location, repository_name, file_path, query_variables):
     """
     Reads a file from a Google Dataform repository and optionally replaces variables.
@@ -88,12 +128,14 @@ def read_file(project_id, location, repository_name, file_path, query_variables)
     Returns:
         str: The file's contents if successful, otherwise None.
     """
-    credentials.refresh(Request())
+    with span("auth.refresh_token"):
+        credentials.refresh(Request())
     headers = {"Authorization": f"Bearer {credentials.token}"}
 
     url = (f"https://dataform.googleapis.com/v1beta1/projects/{project_id}/"
            f"locations/{location}/repositories/{repository_name}:"
            f"readFile?path={file_path}")
+    acquire("dataform.repositories.readFile", project_id, location)
     response = requests.get(url, headers=headers)
 
     if response.status_code == 200:
@@ -105,11 +147,12 @@ def read_file(project_id, location, repository_name, file_path, query_variables)
         return file_contents
     else:
         error_message = f"Dataform API request failed. Status code:{response.status_code}"
-        print(error_message)
-        print(response.text)
+        logger.error("%s: %s", error_message, response.text)
         raise Exception(error_message)
 
 
+@traced("bigquery.execute_query_or_get_status", "file_path", "job_id")
+@phase("bigquery_job")
 def execute_query_or_get_status(query_file, file_path, job_id=None):
     """Executes a BigQuery query (if job ID not provided) or gets the status of an existing query.
     Args:
@@ -120,25 +163,137 @@ def execute_query_or_get_status(query_file, file_path, job_id=None):
     """
     client = bigquery.Client(project=BIGQUERY_PROJECT)
     if job_id:
+        acquire("bigquery.jobs.get", client.project)
         query_job = client.get_job(job_id)
-        print(f"Checking status of existing job: {job_id}")
+        logger.debug("Checking status of existing job: %s", job_id)
         if query_job.done():
             if query_job.error_result:
                 raise BadRequest(query_job.error_result)
             return query_job.state
         else:
-            print(f"Query still running in state:{str(query_job.state)}")
+            logger.debug("Query still running in state: %s", query_job.state)
             return query_job.state
     else:
         job_id = f"aef_{transform_string(file_path)}_{uuid.uuid4()}"
         job_config = bigquery.QueryJobConfig(
             priority=bigquery.QueryPriority.BATCH
         )
+        acquire("bigquery.jobs.insert", client.project)
         query_job = client.query(query=query_file, job_config=job_config, job_id=job_id)
-        print(f"New query started. Job ID: {query_job.job_id}")
+        logger.info("New query started. Job ID: %s", query_job.job_id)
         return query_job.job_id
 
 
+@traced("bigquery.execute_script_or_get_status", "job_name", "job_id")
+@phase("bigquery_job")
+def execute_script_or_get_status(project_id, location, repository_name, workflow_name, job_name, composite_jobs,
+                                 query_variables, job_id=None):
+    """Executes several saved queries as one BigQuery multi-statement script, or gets the status of that script.
+
+    Fusing the saved queries of a thread into a single script job pays the job submission, polling and
+    control table overhead once instead of once per query. The statements run in the given order and the
+    script stops at the first failing statement.
+
+    Args:
+        project_id (str): The Google Cloud project ID of the Dataform repository.
+        location (str): The Dataform repository's location.
+        repository_name (str): The name of the Dataform repository.
+        workflow_name (str): The name of the workflow, used to build the saved query paths.
+        job_name (str): The name of the composite step, used to build the script job ID.
+        composite_jobs (list): Ordered list of saved query job names (or full ".sqlx" paths) to fuse.
+        query_variables (dict): A dictionary for variable replacement (optional).
+        job_id (str, optional): The ID of an existing script job. Defaults to None.
+
+    Returns:
+        str: The final state of the script job or the script job ID if it was just submitted.
+    """
+    client = bigquery.Client(project=BIGQUERY_PROJECT)
+    if job_id:
+        acquire("bigquery.jobs.get", client.project)
+        script_job = client.get_job(job_id)
+        logger.debug("Checking status of existing script job: %s", job_id)
+        if script_job.done():
+            outcomes = report_child_jobs(client, script_job)
+            if script_job.error_result:
+                failed_statement = next((outcome for outcome in outcomes if outcome["error"]), None)
+                if failed_statement:
+                    raise ScriptStatementFailed(
+                        f"Statement {failed_statement['statement']} of script {job_id} failed: "
+                        f"{failed_statement['error']}", failed_statement)
+                raise BadRequest(script_job.error_result)
+        else:
+            logger.debug("Script still running in state: %s", script_job.state)
+        return script_job.state
+
+    statements = []
+    for composite_job in composite_jobs:
+        file_path = composite_job if composite_job.endswith(".sqlx") else \
+            f"definitions/{workflow_name}/{composite_job}.sqlx"
+        query_file = read_file(project_id, location, repository_name, file_path, query_variables)
+        statements.append(f"-- {file_path}\n{query_file.strip().rstrip(';')};")
+    script = "\n\n".join(statements)
+
+    job_id = f"aef_{transform_string(workflow_name + '_' + job_name)}_script_{uuid.uuid4()}"
+    job_config = bigquery.QueryJobConfig(
+        priority=bigquery.QueryPriority.BATCH
+    )
+    acquire("bigquery.jobs.insert", client.project)
+    script_job = client.query(query=script, job_config=job_config, job_id=job_id)
+    logger.info("New script with %d statements started. Job ID: %s", len(statements), script_job.job_id)
+    return script_job.job_id
+
+
+@traced("bigquery.cancel_job", "job_id")
+@phase("bigquery_cancel")
+def cancel_job(job_id):
+    """Requests the cancellation of a query or script job, the child jobs of a script are cancelled with it.
+
+    Args:
+        job_id (str): The ID of the BigQuery job.
+
+    Returns:
+        str: 'CANCELLED', 'DONE' if the job had already finished successfully, or 'FAILED' if it had already
+            failed.
+    """
+    client = bigquery.Client(project=BIGQUERY_PROJECT)
+    acquire("bigquery.jobs.cancel", client.project)
+    job = client.cancel_job(job_id)
+    if job.state == "DONE" and job.error_result:
+        logger.info("Job %s already failed: %s", job_id, job.error_result)
+        return "FAILED"
+    if job.state == "DONE":
+        logger.info("Job %s already finished", job_id)
+        return job.state
+    logger.info("Cancellation of job %s requested", job_id)
+    return "CANCELLED"
+
+
+def report_child_jobs(client, script_job):
+    """Logs the outcome of every statement of a finished script job, as reported by its child jobs.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+        script_job (bigquery.QueryJob): The finished parent script job.
+
+    Returns:
+        list: One dictionary per executed statement, in execution order.
+    """
+    outcomes = []
+    child_jobs = sorted(client.list_jobs(parent_job=script_job.job_id), key=lambda child: child.created)
+    for statement_number, child_job in enumerate(child_jobs, start=1):
+        outcome = {
+            "statement": statement_number,
+            "job_id": child_job.job_id,
+            "state": child_job.state,
+            "error": child_job.error_result,
+            "statement_type": getattr(child_job, "statement_type", None),
+            "total_bytes_processed": getattr(child_job, "total_bytes_processed", None),
+        }
+        logger.info("Script %s statement outcome", script_job.job_id, extra={"fields": outcome})
+        outcomes.append(outcome)
+    return outcomes
+
+
 def transform_string(text):
     """
     Transforms a string by removing non-alphanumeric characters (except spaces and hyphens)
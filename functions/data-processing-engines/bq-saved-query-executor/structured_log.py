@@ -0,0 +1,154 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+
+# DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# string values and serialized large fields are cut to this many characters
+LOG_MAX_VALUE_CHARS = int(os.environ.get('LOG_MAX_VALUE_CHARS', 1000))
+# one of every LOG_SAMPLE_EVERY records with the same sample key is written (the first one included)
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', 10))
+# configuration payloads summarized by their keys
+LARGE_FIELDS = ('workflow_properties', 'step_properties', 'job_params', 'extracted_params')
+# request fields attached to every record of the invocation
+CORRELATION_FIELDS = ('execution_id', 'workflow_name', 'job_name', 'async_job_id', 'job_id')
+MAX_SAMPLE_KEYS = 10000
+# job states of a poll that will be repeated, as known by the intermediate function
+RUNNING_STATES = ("running", "PENDING", "RUNNING", "JOB_STATE_QUEUED", "JOB_STATE_RUNNING", "JOB_STATE_PENDING")
+
+log_context = contextvars.ContextVar('log_context', default={})
+sample_counts = {}
+sample_lock = threading.Lock()
+
+
+def get_logger(name):
+    """
+    Logger writing one JSON object per line on stdout, parsed by Cloud Logging into severity, message and fields.
+    Records are formatted only when their level is enabled: pass values as arguments of the message
+    (logger.info("launched %s", job_id)) rather than formatting them in place.
+
+    Extra keys understood by the logger:
+        fields: dictionary of additional fields, large values truncated
+        sample_key: records sharing this key (eg. a running job poll) are sampled, see LOG_SAMPLE_EVERY
+
+    Args:
+        name: logger name, usually the function name
+
+    Returns:
+        logging.Logger
+    """
+    logger = logging.getLogger(f"aef.{name}")
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(StructuredFilter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        # cloud logging handlers installed on the root logger would write every record twice
+        logger.propagate = False
+    return logger
+
+
+def bind(request_json):
+    """
+    Attaches the correlation fields of a request to the records of the current invocation
+
+    Args:
+        request_json: request payload, fields missing from it are left out
+    """
+    request_json = request_json if isinstance(request_json, dict) else {}
+    log_context.set({field: request_json[field] for field in CORRELATION_FIELDS if request_json.get(field)})
+
+
+def bind_fields(**fields):
+    """
+    Adds correlation fields known after the request is parsed, eg. the job id returned by a launch
+    """
+    log_context.set({**log_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+
+
+def redact(value):
+    """
+    Copy of a logged value with the configuration payloads summarized and long strings truncated
+    """
+    if isinstance(value, dict):
+        return {key: summarize(item) if key in LARGE_FIELDS else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value[:50]]
+    if isinstance(value, str) and len(value) > LOG_MAX_VALUE_CHARS:
+        return f"{value[:LOG_MAX_VALUE_CHARS]}...[{len(value) - LOG_MAX_VALUE_CHARS} chars truncated]"
+    return value
+
+
+def summarize(value):
+    if isinstance(value, dict):
+        return {"keys": sorted(value)[:50]}
+    return redact(str(value))
+
+
+def poll_sample_key(key, status):
+    """
+    Sample key of a status poll record: polls of a running job are sampled, a final state is always logged
+    """
+    return key if status in RUNNING_STATES else None
+
+
+def sampled(sample_key):
+    """
+    True for the first record of a sample key and every LOG_SAMPLE_EVERY-th after it, per instance
+    """
+    with sample_lock:
+        if len(sample_counts) > MAX_SAMPLE_KEYS:
+            sample_counts.clear()
+        count = sample_counts.get(sample_key, 0)
+        sample_counts[sample_key] = count + 1
+    return count % LOG_SAMPLE_EVERY == 0
+
+
+class StructuredFilter(logging.Filter):
+    """
+    Drops sampled out records, then redacts the message arguments. Runs only for enabled levels.
+    """
+
+    def filter(self, record):
+        sample_key = getattr(record, "sample_key", None)
+        if sample_key is not None and not sampled(sample_key):
+            return False
+        if isinstance(record.args, dict):
+            record.args = redact(record.args)
+        elif record.args:
+            record.args = tuple(redact(arg) if isinstance(arg, (dict, list, tuple, str)) else arg
+                                for arg in record.args)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            **log_context.get(),
+            **redact(getattr(record, "fields", None) or {})
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -18,6 +18,10 @@ import json
 from google.cloud import storage
 import re
 import os
+from structured_log import bind, get_logger, poll_sample_key
+from tracing import setup_tracing, traced, traced_request
+from profiling import phase, profiled
+from rate_limit import acquire, throttled_retry_after
 
 # --- Authentication Setup ---
 credentials, project = google.auth.default()
@@ -25,12 +29,19 @@ credentials, project = google.auth.default()
 service = build('dataflow', 'v1b3', credentials=credentials)
 storage_client = storage.Client()
 function_name = os.environ.get('K_SERVICE')
+setup_tracing(function_name or 'dataflow-flextemplate-job-executor')
+logger = get_logger('dataflow-flextemplate-job-executor')
+# jobs in these states can no longer be cancelled
+TERMINAL_JOB_STATES = ("JOB_STATE_DONE", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_UPDATED",
+                       "JOB_STATE_DRAINED")
 
 
 # df_client = dataflow.FlexTemplatesServiceClient()
 
 
 @functions_framework.http
+@profiled("dataflow-flextemplate-job-executor")
+@traced_request("dataflow-flextemplate-job-executor")
 def main(request):
     """
     Cloud Function entry point for handling Dataflow job requests.
@@ -57,7 +68,8 @@ def main(request):
             - If an error occurs: A JSON object with error details.
     """
     request_json = request.get_json(silent=True)
-    print("event:" + str(request_json))
+    bind(request_json)
+    logger.debug("event: %s", request_json)
 
     try:
         location = request_json.get('workflow_properties').get('location', None)
@@ -70,26 +82,37 @@ def main(request):
         job_id = request_json.get('job_id', None)
         workflow_name = request_json.get('workflow_name', None)
 
+        if request_json.get('action') == 'cancel':
+            return cancel_dataflow_job(job_id, job_name, request_json)
+
         status_or_job_id = run_dataflow_job_or_get_status(job_id,
                                                           dataflow_job_name=dataflow_job_name,
                                                           job_name=job_name,
                                                           request_json=request_json)
 
         if status_or_job_id.startswith('aef_'):
-            print(f"Running Dataflow Job, track it with Job ID: {status_or_job_id}")
+            logger.info("Running Dataflow Job, track it with Job ID: %s", status_or_job_id)
         else:
-            print(f"Dataflow Job with status: {status_or_job_id}")
+            logger.info("Dataflow Job with status: %s", status_or_job_id,
+                        extra={"sample_key": poll_sample_key(job_id, status_or_job_id)})
 
         return status_or_job_id
     except Exception as error:
         err_message = "Exception: " + repr(error)
+        logger.error(err_message, exc_info=True)
         response = {
             "error": error.__class__.__name__,
             "message": repr(err_message)
         }
+        retry_after = throttled_retry_after(error)
+        if retry_after is not None:
+            # throttled calls are retried by the intermediate function after Retry-After
+            return response, 429, {"Retry-After": str(retry_after)}
         return response
 
 
+@traced("gcs.extract_params", "bucket_name", "job_name")
+@phase("gcs_params")
 def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
     """Extracts parameters from a JSON file.
 
@@ -113,7 +136,7 @@ def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
         params = json.loads(json_data.decode(encoding))
         return params
     except (google.cloud.exceptions.NotFound, json.JSONDecodeError, UnicodeDecodeError) as e:
-        print(f"Error reading JSON file: {e}")
+        logger.error("Error reading JSON file: %s", e)
         return None
 
 
@@ -125,6 +148,8 @@ def run_dataflow_job_or_get_status(job_id: str, dataflow_job_name: str, job_name
         return run_dataflow_job(dataflow_job_name, job_name, request_json)
 
 
+@traced("dataflow.launch_job", "dataflow_job_name", "job_name")
+@phase("dataflow_launch")
 def run_dataflow_job(dataflow_job_name, job_name, request_json):
     extracted_params = extract_params(
         bucket_name=request_json.get("workflow_properties").get("jobs_definitions_bucket"),
@@ -162,10 +187,13 @@ def run_dataflow_job(dataflow_job_name, job_name, request_json):
         location=dataflow_location,
         body=body
     )
+    acquire("dataflow.flexTemplates.launch", dataflow_project, dataflow_location)
     response = request.execute()
     return "aef_" + response.get("job").get("id")
 
 
+@traced("dataflow.get_job_state", "job_id", "job_name")
+@phase("dataflow_status")
 def get_dataflow_state(job_id, job_name, request_json):
     extracted_params = extract_params(
         bucket_name=request_json.get("workflow_properties").get("jobs_definitions_bucket"),
@@ -179,9 +207,44 @@ def get_dataflow_state(job_id, job_name, request_json):
     get_job_request = service.projects().locations().jobs().get(location=dataflow_location, projectId=dataflow_project,
                                                                 jobId=re.sub(r"^aef_", "", job_id))
 
-    print("Getting status execute ")
+    acquire("dataflow.jobs.get", dataflow_project, dataflow_location)
     job_status = get_job_request.execute()
-
-    print(f"Job status: {str(job_status)}")
+    logger.debug("Job status: %s", job_status)
 
     return job_status['currentState']
+
+
+@traced("dataflow.cancel_job", "job_id", "job_name")
+@phase("dataflow_cancel")
+def cancel_dataflow_job(job_id, job_name, request_json):
+    """Requests the cancellation of a Dataflow job by updating its requested state to JOB_STATE_CANCELLED.
+
+    Returns:
+        str: The state of the job after the request (e.g., "JOB_STATE_CANCELLING"), or its final state if the
+            job had already finished.
+    """
+    extracted_params = extract_params(
+        bucket_name=request_json.get("workflow_properties").get("jobs_definitions_bucket"),
+        job_name=job_name,
+        function_name=function_name
+    )
+
+    dataflow_location = extracted_params.get("dataflow_location")
+    dataflow_project = extracted_params.get("project_id")
+    dataflow_job_id = re.sub(r"^aef_", "", job_id)
+
+    current_state = get_dataflow_state(job_id, job_name, request_json)
+    if current_state in TERMINAL_JOB_STATES:
+        logger.info("Dataflow job %s already finished in state %s", dataflow_job_id, current_state)
+        return current_state
+
+    update_job_request = service.projects().locations().jobs().update(
+        projectId=dataflow_project,
+        location=dataflow_location,
+        jobId=dataflow_job_id,
+        body={"requestedState": "JOB_STATE_CANCELLED"}
+    )
+    acquire("dataflow.jobs.update", dataflow_project, dataflow_location)
+    job = update_job_request.execute()
+    logger.info("Cancellation of Dataflow job %s requested", dataflow_job_id)
+    return job.get("currentState") if job.get("currentState") in TERMINAL_JOB_STATES else "JOB_STATE_CANCELLING"
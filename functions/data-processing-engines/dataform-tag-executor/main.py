@@ -12,24 +12,70 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import google.auth
+import google.api_core.exceptions
 import logging
 import functions_framework
+from google.cloud import bigquery
 from google.cloud import dataform_v1beta1
+from google.cloud import firestore
 from google.cloud import secretmanager_v1
 from google.cloud import storage
 import requests
+import datetime
+import hashlib
 import json
 import os
+import time
+import uuid
+from structured_log import bind, get_logger, poll_sample_key, sampled
+from tracing import setup_tracing, traced, traced_request
+from profiling import phase, profiled
+from rate_limit import acquire, resource_scope, throttled_retry_after
 
 # --- Dataform Client ---
 df_client = dataform_v1beta1.DataformClient()
+# --- Secret Manager Client ---
+secret_client = secretmanager_v1.SecretManagerServiceClient()
 # --- Authentication Setup ---
 credentials, project = google.auth.default()
 # --- GCS Client ---
 storage_client = storage.Client()
+# --- BigQuery Client ---
+bq_client = bigquery.Client()
 function_name = os.environ.get('K_SERVICE')
+setup_tracing(function_name or 'dataform-tag-executor')
+logger = get_logger('dataform-tag-executor')
+# --- Compilation Cache ---
+# compilation results are reused while younger than this many seconds, 0 disables the cache
+COMPILATION_CACHE_TTL_SECONDS = int(os.environ.get('COMPILATION_CACHE_TTL_SECONDS', 86400))
+compilation_cache = {}
+# --- Metadata Cache ---
+# secrets, repository git remote settings and dataform.json are kept per instance for this many seconds
+METADATA_CACHE_TTL_SECONDS = int(os.environ.get('METADATA_CACHE_TTL_SECONDS', 600))
+metadata_cache = {}
+cache_stats = {kind: {"hits": 0, "misses": 0, "revalidated": 0}
+               for kind in ("secret", "repository", "dataform_json", "compilation")}
+# --- Progress ---
+PROGRESS_SLOWEST_ACTIONS = 5
+PROGRESS_HISTORY_INVOCATIONS = 10
+PROGRESS_HISTORY_SCAN_LIMIT = 100
+# --- Coalescing ---
+DATAFORM_COALESCING_FIRESTORE_COLLECTION = os.environ.get('DATAFORM_COALESCING_FIRESTORE_COLLECTION',
+                                                          'dataform_coalescing')
+# a group whose invocation was claimed but never recorded after this many seconds is considered lost
+COALESCING_FLUSH_TIMEOUT_SECONDS = 900
+COALESCED_JOB_PREFIX = "aef-coalesced-"
+# --- Selective Invocation ---
+# returned instead of an invocation when no source changed since the last successful invocation
+NOOP_JOB_PREFIX = "aef-noop-"
+# selective invocations run explicit targets without tags, the tags they stand for are recorded here
+DATAFORM_SELECTIVE_FIRESTORE_COLLECTION = os.environ.get('DATAFORM_SELECTIVE_FIRESTORE_COLLECTION',
+                                                         'dataform_selective_invocations')
+firestore_client = firestore.Client()
 
 @functions_framework.http
+@profiled("dataform-tag-executor")
+@traced_request("dataform-tag-executor")
 def main(request):
     """
     Main function, likely triggered by an HTTP request. Extracts parameters, reads a repository from
@@ -43,9 +89,17 @@ def main(request):
     """
 
     request_json = request.get_json(silent=True)
-    print("event:" + str(request_json))
+    bind(request_json)
+    logger.debug("event: %s", request_json)
 
     try:
+        if request_json.get('action') == 'cache_stats':
+            return get_cache_stats()
+        if request_json.get('action') == 'progress':
+            return get_workflow_progress(request_json['job_id'])
+        if request_json.get('action') == 'cancel':
+            return cancel_workflow(request_json['job_id'])
+
         job_name = request_json.get('job_name', None)
         workflow_name = request_json.get('workflow_name', None)
 
@@ -55,6 +109,8 @@ def main(request):
         branch = None
         dataform_location = None
         dataform_project_id = None
+        coalesce_window_seconds = 0
+        selective = False
 
         if jobs_definitions_bucket:
             extracted_params = extract_params(
@@ -67,28 +123,40 @@ def main(request):
             branch = extracted_params.get("branch")
             dataform_location = extracted_params.get("dataform_location")
             dataform_project_id = extracted_params.get("dataform_project_id")
+            coalesce_window_seconds = int(extracted_params.get("coalesce_window_seconds", 0))
+            selective = bool(extracted_params.get("selective", False))
 
         job_id = request_json.get('job_id', None)
         query_variables = request_json.get('query_variables', None)
 
         status_or_job_id = run_repo_or_get_status(job_id, gcp_project=dataform_project_id, location=dataform_location,
                                                   repo_name=repository_name, tags=tags, branch=branch,
-                                                  query_variables=query_variables)
+                                                  query_variables=query_variables,
+                                                  coalesce_window_seconds=coalesce_window_seconds,
+                                                  selective=selective)
 
         if status_or_job_id.startswith('aef_'):
-            print(f"Running Query, track it with Job ID: {status_or_job_id}")
+            logger.info("Running Query, track it with Job ID: %s", status_or_job_id)
         else:
-            print(f"Query finished with status: {status_or_job_id}")
+            logger.info("Query finished with status: %s", status_or_job_id,
+                        extra={"sample_key": poll_sample_key(job_id, status_or_job_id)})
 
         return status_or_job_id
     except Exception as error:
         err_message = "Exception: " + repr(error)
+        logger.error(err_message, exc_info=True)
         response = {
             "error": error.__class__.__name__,
             "message": repr(err_message)
         }
+        retry_after = throttled_retry_after(error)
+        if retry_after is not None:
+            # throttled calls are retried by the intermediate function after Retry-After
+            return response, 429, {"Retry-After": str(retry_after)}
         return response
 
+@traced("gcs.extract_params", "bucket_name", "job_name")
+@phase("gcs_params")
 def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
     """Extracts parameters from a JSON file.
 
@@ -112,31 +180,47 @@ def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
         params = json.loads(json_data.decode(encoding))
         return params
     except (google.cloud.exceptions.NotFound, json.JSONDecodeError, UnicodeDecodeError) as e:
-        print(f"Error reading JSON file: {e}")
+        logger.error("Error reading JSON file: %s", e)
         return None
 
 
 def run_repo_or_get_status(job_id: str, gcp_project: str, location: str, repo_name: str, tags: list, branch: str,
-                           query_variables: dict):
-    if job_id:
+                           query_variables: dict, coalesce_window_seconds: int = 0, selective: bool = False):
+    if job_id and job_id.startswith(NOOP_JOB_PREFIX):
+        return "SUCCEEDED"
+    elif job_id and job_id.startswith(COALESCED_JOB_PREFIX):
+        return get_coalesced_workflow_state(job_id)
+    elif job_id:
         return get_workflow_state(job_id)
+    elif coalesce_window_seconds > 0:
+        return join_coalescing_group(gcp_project, location, repo_name, tags, branch, query_variables,
+                                     coalesce_window_seconds)
     else:
-        return run_workflow(gcp_project, location, repo_name, tags, True, branch, query_variables)
+        return run_workflow(gcp_project, location, repo_name, tags, True, branch, query_variables, selective)
 
 
-def execute_workflow(repo_uri: str, compilation_result: str, tags: list):
+@traced("dataform.invoke_workflow", "compilation_result")
+@phase("dataform_invoke")
+def execute_workflow(repo_uri: str, compilation_result: str, tags: list, included_targets: list = None):
     """Triggers a Dataform workflow execution based on a provided compilation result.
 
     Args:
         repo_uri (str): The URI of the Dataform repository.
         compilation_result (str): The name of the compilation result to use.
+        tags (list): The tags of the actions to execute, ignored when included_targets is given.
+        included_targets (list): The explicit targets to execute (optional).
 
     Returns:
         str: The name of the created workflow invocation.
     """
-    invocation_config = dataform_v1beta1.types.InvocationConfig(
-        included_tags=tags
-    )
+    if included_targets is not None:
+        invocation_config = dataform_v1beta1.types.InvocationConfig(
+            included_targets=included_targets
+        )
+    else:
+        invocation_config = dataform_v1beta1.types.InvocationConfig(
+            included_tags=tags
+        )
     request = dataform_v1beta1.CreateWorkflowInvocationRequest(
         parent=repo_uri,
         workflow_invocation=dataform_v1beta1.types.WorkflowInvocation(
@@ -144,30 +228,105 @@ def execute_workflow(repo_uri: str, compilation_result: str, tags: list):
             invocation_config=invocation_config
         )
     )
+    acquire("dataform.workflowInvocations.create", *resource_scope(repo_uri))
     response = df_client.create_workflow_invocation(request=request)
     name = response.name
-    logging.info(f'created workflow invocation {name}')
+    logger.info("created workflow invocation %s", name)
     return name
 
 
-def access_secret_version(project_id: str, secret_id: str, version_id: str = "1") -> str:
+def get_cached_metadata(kind: str, key: str):
+    """Returns a cached metadata entry of the given kind, counting the hit or miss.
+
+    Args:
+        kind (str): The kind of cached metadata ("secret", "repository" or "dataform_json").
+        key (str): The key of the entry inside its kind.
+
+    Returns:
+        tuple: (value, etag, expired) for a cached entry, or None if nothing was cached for the key.
+            Expired entries are still returned so that their ETag can be used to revalidate them.
     """
-    Accesses the value of the specified Secret Version.
+    entry = metadata_cache.get((kind, key))
+    if entry and time.time() < entry["expires_at"]:
+        cache_stats[kind]["hits"] += 1
+        return entry["value"], entry["etag"], False
+    cache_stats[kind]["misses"] += 1
+    if entry:
+        return entry["value"], entry["etag"], True
+    return None
+
+
+def put_cached_metadata(kind: str, key: str, value, etag: str = None):
+    """Stores a metadata entry of the given kind for METADATA_CACHE_TTL_SECONDS."""
+    metadata_cache[(kind, key)] = {
+        "value": value,
+        "etag": etag,
+        "expires_at": time.time() + METADATA_CACHE_TTL_SECONDS
+    }
+
+
+def get_cache_stats():
+    """Reports how many upstream calls the caches of this instance avoided.
+
+    Returns:
+        dict: Hits, misses and ETag revalidations per cache kind, plus the total of avoided upstream calls.
     """
+    stats = {kind: dict(counters) for kind, counters in cache_stats.items()}
+    stats["upstream_calls_avoided"] = sum(counters["hits"] for counters in cache_stats.values())
+    stats["cached_entries"] = len(metadata_cache) + len(compilation_cache)
+    return stats
 
-    client = secretmanager_v1.SecretManagerServiceClient()
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
 
+@traced("secretmanager.access_secret", "secret_id")
+def access_secret_version(project_id: str, secret_id: str, version_id: str = "1") -> str:
+    """
+    Accesses the value of the specified Secret Version, reusing values read by this instance within the TTL.
+    """
 
+    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
+    cached = get_cached_metadata("secret", name)
+    if cached and not cached[2]:
+        return cached[0]
+    response = secret_client.access_secret_version(request={"name": name})
+    secret_value = response.payload.data.decode("UTF-8")
+    put_cached_metadata("secret", name, secret_value)
+    return secret_value
+
+
+def get_repository_url(repo_uri: str) -> str:
+    """Gets the git remote URL of a Dataform repository, without the ".git" suffix."""
+    cached = get_cached_metadata("repository", repo_uri)
+    if cached and not cached[2]:
+        return cached[0]
+    repo_url = df_client.get_repository(name=repo_uri).git_remote_settings.url.replace(".git", "")
+    put_cached_metadata("repository", repo_uri, repo_url)
+    return repo_url
+
+
+@traced("github.get_dataform_json", "branch")
 def get_dataform_json_from_github(repo_url, github_token, branch="main", path="dataform.json"):
-    """Fetches dataform.json from a GitHub repository."""
+    """Fetches dataform.json from a GitHub repository.
+
+    Parsed content is cached per instance. Once an entry expires it is revalidated with an ETag
+    conditional request, so an unchanged file costs a 304 response instead of a full download.
+    """
     url = f"{repo_url}/raw/{branch}/{path}"
+    cached = get_cached_metadata("dataform_json", url)
+    if cached and not cached[2]:
+        return cached[0]
+
     headers = {"Authorization": f"token {github_token}"}
+    if cached and cached[1]:
+        headers["If-None-Match"] = cached[1]
     response = requests.get(url, headers=headers)
+    if response.status_code == 304 and cached:
+        cache_stats["dataform_json"]["revalidated"] += 1
+        put_cached_metadata("dataform_json", url, cached[0], cached[1])
+        return cached[0]
     response.raise_for_status()
-    return response.json()
+    dataform_json_content = response.json()
+    put_cached_metadata("dataform_json", url, dataform_json_content, response.headers.get("ETag"))
+    return dataform_json_content
 
 
 def merge_compilation_config(
@@ -206,42 +365,129 @@ def merge_compilation_config(
     compilation_config.vars.update(merged_vars)
 
 
+@traced("github.resolve_commit_sha", "branch")
+def resolve_commit_sha(repo_url, github_token, branch="main"):
+    """Resolves a branch of a GitHub repository to the SHA of its head commit.
+
+    Args:
+        repo_url (str): The GitHub repository URL, without the ".git" suffix.
+        github_token (str): The token used to authenticate against GitHub.
+        branch (str): The branch (or any commitish) to resolve.
+
+    Returns:
+        str: The commit SHA, or None if it could not be resolved.
+    """
+    repo_path = repo_url.split("github.com/", 1)[-1].strip("/")
+    url = f"https://api.github.com/repos/{repo_path}/commits/{branch}"
+    headers = {"Authorization": f"token {github_token}", "Accept": "application/vnd.github.sha"}
+    try:
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()
+        return response.text.strip()
+    except requests.exceptions.RequestException as e:
+        logger.warning("Could not resolve commit SHA for %s, compilation cache disabled: %s", branch, e)
+        return None
+
+
+def compilation_cache_key(repo_uri: str, commit_sha: str, compilation_vars: dict):
+    """Builds the compilation cache key from the repository, the commit SHA and a hash of the merged variables.
+
+    Returns:
+        tuple: (repository URI, commit SHA, merged variables hash)
+    """
+    vars_hash = hashlib.sha256(json.dumps(compilation_vars, sort_keys=True).encode("utf-8")).hexdigest()
+    return repo_uri, commit_sha, vars_hash
+
+
+def get_cached_compilation_result(cache_key: tuple):
+    """Looks for a reusable compilation result, first in this instance's memory and then in the Dataform
+    repository itself, so that results compiled by other instances within the cache TTL are also reused.
+
+    Args:
+        cache_key (tuple): The key built by compilation_cache_key.
+
+    Returns:
+        str: The name of an existing, error free compilation result, or None if there is no cache hit.
+    """
+    if COMPILATION_CACHE_TTL_SECONDS <= 0:
+        return None
+    cached = compilation_cache.get(cache_key)
+    if cached and time.time() - cached[1] < COMPILATION_CACHE_TTL_SECONDS:
+        cache_stats["compilation"]["hits"] += 1
+        return cached[0]
+    cache_stats["compilation"]["misses"] += 1
+
+    repo_uri, commit_sha, vars_hash = cache_key
+    oldest_create_time = (datetime.datetime.now(datetime.timezone.utc)
+                          - datetime.timedelta(seconds=COMPILATION_CACHE_TTL_SECONDS))
+    request = dataform_v1beta1.ListCompilationResultsRequest(
+        parent=repo_uri,
+        order_by="create_time desc"
+    )
+    for compilation_result in df_client.list_compilation_results(request=request):
+        if compilation_result.create_time and compilation_result.create_time < oldest_create_time:
+            break
+        if compilation_result.resolved_git_commit_sha != commit_sha or compilation_result.compilation_errors:
+            continue
+        result_vars = dict(compilation_result.code_compilation_config.vars)
+        if compilation_cache_key(repo_uri, commit_sha, result_vars)[2] == vars_hash:
+            compilation_cache[cache_key] = (compilation_result.name, time.time())
+            cache_stats["compilation"]["revalidated"] += 1
+            return compilation_result.name
+    return None
+
+
+@traced("dataform.compile", "repo_name", "branch")
+@phase("dataform_compile")
 def compile_workflow(gcp_project: str, repo_name: str, repo_uri: str, branch: str, query_variables: dict):
     """Compiles a Dataform workflow using a specified Git branch.
 
+    The branch is resolved to its head commit SHA first. If a compilation result for the same repository,
+    commit and merged variables already exists it is reused instead of compiling again.
+
     Returns:
-        str: The name of the created compilation result.
+        str: The name of the created (or reused) compilation result.
     """
 
     github_token = access_secret_version(gcp_project, repo_name + "_secret")
 
-    dataform_json_content = get_dataform_json_from_github(
-        df_client
-            .get_repository(name=repo_uri)
-            .git_remote_settings.url
-            .replace(".git", ""),
-        github_token)
+    repo_url = get_repository_url(repo_uri)
+    dataform_json_content = get_dataform_json_from_github(repo_url, github_token)
+
+    commit_sha = resolve_commit_sha(repo_url, github_token, branch or "main")
 
     compilation_result = dataform_v1beta1.CompilationResult(
-        git_commitish=branch,
+        git_commitish=commit_sha or branch,
     )
 
     merge_compilation_config(compilation_result.code_compilation_config, query_variables, dataform_json_content)
 
-    print("compilation_result.code_compilation_config.vars::::::   " + str(
-        compilation_result.code_compilation_config.vars))
+    logger.debug("compilation vars: %s", compilation_result.code_compilation_config.vars)
+
+    cache_key = None
+    if commit_sha:
+        cache_key = compilation_cache_key(repo_uri, commit_sha, dict(compilation_result.code_compilation_config.vars))
+        cached_name = get_cached_compilation_result(cache_key)
+        if cached_name:
+            logger.info("Reusing compilation result %s for commit %s", cached_name, commit_sha)
+            return cached_name
 
     request = dataform_v1beta1.CreateCompilationResultRequest(
         parent=repo_uri,
         compilation_result=compilation_result
     )
 
+    acquire("dataform.compilationResults.create", *resource_scope(repo_uri))
     response = df_client.create_compilation_result(request=request)
     name = response.name
-    logging.info(f'compiled workflow {name}')
+    if cache_key and not response.compilation_errors:
+        compilation_cache[cache_key] = (name, time.time())
+    logger.info("compiled workflow %s", name)
     return name
 
 
+@traced("dataform.get_invocation_state", "job_id")
+@phase("dataform_status")
 def get_workflow_state(job_id: str):
     """Monitors the status of a Dataform workflow invocation.
 
@@ -252,14 +498,157 @@ def get_workflow_state(job_id: str):
     request = dataform_v1beta1.GetWorkflowInvocationRequest(
         name=workflow_invocation_id
     )
+    acquire("dataform.workflowInvocations.get", *resource_scope(workflow_invocation_id))
     response = df_client.get_workflow_invocation(request)
     state = response.state.name
-    logging.info(f'workflow state: {state}')
+    logger.debug("workflow state: %s", state)
+    # the progress summary costs API calls, it is only computed for the sampled polls
+    if state == "RUNNING" and logger.isEnabledFor(logging.INFO) and sampled(("progress", job_id)):
+        # the summary is informational, failing to compute it must not fail the poll
+        try:
+            logger.info("workflow progress", extra={"fields": get_workflow_progress(job_id, response)})
+        except Exception as e:
+            logger.warning("Could not compute the progress of %s: %r", job_id, e)
     return state
 
 
+@traced("dataform.cancel_invocation", "job_id")
+@phase("dataform_cancel")
+def cancel_workflow(job_id: str):
+    """Cancels a Dataform workflow invocation.
+
+    A coalescing group handle detaches its step from the group. The shared invocation of the group is only
+    cancelled once every member asked for it, the steps of other executions coalesced into the group keep
+    running otherwise.
+
+    Args:
+        job_id (str): The ID of the workflow invocation (an "aef-" or coalescing group handle).
+
+    Returns:
+        str: "CANCELING", or the state of an invocation that already finished.
+    """
+    if job_id.startswith(NOOP_JOB_PREFIX):
+        return "SUCCEEDED"
+    if job_id.startswith(COALESCED_JOB_PREFIX):
+        group_id, member_id = parse_coalesced_job_id(job_id)
+        group, cancel_invocation = detach_coalescing_member(group_id, member_id)
+        if not cancel_invocation or not group.get("invocation_id"):
+            # a group still being launched is cancelled by its claimer once the invocation is recorded
+            logger.info("Step detached from coalescing group %s", group_id)
+            return "CANCELLED"
+        job_id = group["invocation_id"]
+    state = get_workflow_state(job_id)
+    if state in ("SUCCEEDED", "FAILED", "CANCELLED", "CANCELING"):
+        logger.info("Workflow invocation %s already in state %s", job_id, state)
+        return state
+    workflow_invocation_id = job_id.split("aef-", 1)[1]
+    acquire("dataform.workflowInvocations.cancel", *resource_scope(workflow_invocation_id))
+    df_client.cancel_workflow_invocation(
+        request=dataform_v1beta1.CancelWorkflowInvocationRequest(name=workflow_invocation_id))
+    logger.info("Cancellation of workflow invocation %s requested", workflow_invocation_id)
+    return "CANCELING"
+
+
+def get_workflow_progress(job_id: str, workflow_invocation=None):
+    """Summarizes the progress of a Dataform workflow invocation from the state of its actions.
+
+    Args:
+        job_id (str): The ID of the workflow invocation (an "aef-" or coalescing group handle).
+        workflow_invocation: The already fetched workflow invocation, fetched from job_id if not given.
+
+    Returns:
+        dict: The invocation state, the number of actions per state, the slowest running actions, the
+            elapsed seconds and an ETA in seconds (None when it cannot be estimated yet).
+    """
+    if job_id.startswith(NOOP_JOB_PREFIX):
+        return {"state": "SUCCEEDED", "action_counts": {}, "slowest_running_actions": [],
+                "elapsed_seconds": 0, "eta_seconds": 0}
+    if job_id.startswith(COALESCED_JOB_PREFIX):
+        # read only, the group is only launched by the status polls of its members
+        group = read_coalescing_group(parse_coalesced_job_id(job_id)[0])
+        if group and group["state"] == "CANCELLED":
+            return {"state": "CANCELLED", "action_counts": {}, "slowest_running_actions": [],
+                    "elapsed_seconds": 0, "eta_seconds": 0}
+        if group and group.get("error"):
+            return {"state": "FAILED", "action_counts": {}, "slowest_running_actions": [],
+                    "elapsed_seconds": 0, "eta_seconds": 0}
+        if not group or not group.get("invocation_id"):
+            return {"state": "PENDING", "action_counts": {}, "slowest_running_actions": [],
+                    "elapsed_seconds": 0, "eta_seconds": None}
+        job_id = group["invocation_id"]
+    workflow_invocation_id = job_id.split("aef-", 1)[1]
+    if workflow_invocation is None:
+        acquire("dataform.workflowInvocations.get", *resource_scope(workflow_invocation_id))
+        workflow_invocation = df_client.get_workflow_invocation(
+            dataform_v1beta1.GetWorkflowInvocationRequest(name=workflow_invocation_id))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    action_counts = {}
+    running_actions = []
+    request = dataform_v1beta1.QueryWorkflowInvocationActionsRequest(name=workflow_invocation_id)
+    for action in df_client.query_workflow_invocation_actions(request=request):
+        action_state = action.state.name
+        action_counts[action_state] = action_counts.get(action_state, 0) + 1
+        if action_state == "RUNNING" and action.invocation_timing.start_time:
+            running_actions.append({
+                "target": f"{action.target.database}.{action.target.schema}.{action.target.name}",
+                "running_seconds": int((now - action.invocation_timing.start_time).total_seconds())
+            })
+    running_actions.sort(key=lambda running_action: running_action["running_seconds"], reverse=True)
+
+    start_time = workflow_invocation.invocation_timing.start_time
+    elapsed_seconds = int((now - start_time).total_seconds()) if start_time else 0
+    total_actions = sum(action_counts.values())
+    finished_actions = total_actions - action_counts.get("PENDING", 0) - action_counts.get("RUNNING", 0)
+
+    eta_seconds = None
+    expected_seconds = get_expected_invocation_seconds(workflow_invocation)
+    if expected_seconds is not None:
+        eta_seconds = max(0, expected_seconds - elapsed_seconds)
+    elif finished_actions:
+        eta_seconds = int(elapsed_seconds * (total_actions - finished_actions) / finished_actions)
+
+    return {
+        "state": workflow_invocation.state.name,
+        "action_counts": action_counts,
+        "slowest_running_actions": running_actions[:PROGRESS_SLOWEST_ACTIONS],
+        "elapsed_seconds": elapsed_seconds,
+        "eta_seconds": eta_seconds
+    }
+
+
+def get_expected_invocation_seconds(workflow_invocation):
+    """Estimates how long a workflow invocation takes from the median duration of the last succeeded
+    invocations of the same repository with the same included tags.
+
+    Returns:
+        int: The expected duration in seconds, or None if there is no comparable past invocation.
+    """
+    repo_uri = workflow_invocation.name.split("/workflowInvocations/", 1)[0]
+    included_tags = sorted(workflow_invocation.invocation_config.included_tags)
+    request = dataform_v1beta1.ListWorkflowInvocationsRequest(
+        parent=repo_uri,
+        order_by="create_time desc"
+    )
+    durations = []
+    for scanned, past_invocation in enumerate(df_client.list_workflow_invocations(request=request)):
+        if scanned == PROGRESS_HISTORY_SCAN_LIMIT:
+            break
+        timing = past_invocation.invocation_timing
+        if (past_invocation.state.name != "SUCCEEDED" or not timing.end_time
+                or sorted(past_invocation.invocation_config.included_tags) != included_tags):
+            continue
+        durations.append((timing.end_time - timing.start_time).total_seconds())
+        if len(durations) == PROGRESS_HISTORY_INVOCATIONS:
+            break
+    if not durations:
+        return None
+    durations.sort()
+    return int(durations[len(durations) // 2])
+
+
 def run_workflow(gcp_project: str, location: str, repo_name: str, tags: list, execute: str, branch: str,
-                 query_variables: dict):
+                 query_variables: dict, selective: bool = False):
     """Orchestrates the complete Dataform workflow process: compilation and execution.
 
     Args:
@@ -269,9 +658,332 @@ def run_workflow(gcp_project: str, location: str, repo_name: str, tags: list, ex
         tags (str): The target tags to compile and execute.
         branch (str): The Git branch to use.
         query_variables (dict): Step specific variables like end or start date i.e. {'${start_date}': "'2024-05-21'", '${end_date}': "'2024-05-21'"}
+        selective (bool): Only execute the tagged actions depending on sources changed since the last
+            successful invocation.
     """
     repo_uri = f'projects/{gcp_project}/locations/{location}/repositories/{repo_name}'
     compilation_result = compile_workflow(gcp_project, repo_name, repo_uri, branch, query_variables)
     if execute:
-        workflow_invocation_name = execute_workflow(repo_uri, compilation_result, tags)
+        included_targets = None
+        if selective:
+            included_targets = get_selective_targets(repo_uri, compilation_result, tags)
+            if included_targets == []:
+                logger.info("No source of tags %s changed since the last successful invocation, skipping", tags)
+                return f"{NOOP_JOB_PREFIX}{repo_name}"
+        workflow_invocation_name = execute_workflow(repo_uri, compilation_result, tags, included_targets)
+        if included_targets is not None:
+            record_selective_invocation(repo_uri, tags, workflow_invocation_name)
         return f"aef-{workflow_invocation_name}"
+
+
+def target_key(target):
+    """Returns a hashable (database, schema, name) key for a Dataform target."""
+    return target.database, target.schema, target.name
+
+
+def selective_invocations_ref(repo_uri: str, tags: list):
+    """Returns the document recording the selective invocations of a repository and set of tags."""
+    key_source = json.dumps([repo_uri, sorted(tags or [])])
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:32]
+    return firestore_client.collection(DATAFORM_SELECTIVE_FIRESTORE_COLLECTION).document(key)
+
+
+def record_selective_invocation(repo_uri: str, tags: list, workflow_invocation_name: str):
+    """Records a selective invocation as an invocation of its tags, keeping the most recent ones only."""
+    invocations_ref = selective_invocations_ref(repo_uri, tags)
+
+    @firestore.transactional
+    def record(transaction):
+        recorded = (invocations_ref.get(transaction=transaction).to_dict() or {}).get("invocations", [])
+        transaction.set(invocations_ref, {
+            "repo_uri": repo_uri,
+            "tags": sorted(tags or []),
+            "invocations": (recorded + [workflow_invocation_name])[-PROGRESS_HISTORY_SCAN_LIMIT:]
+        })
+
+    record(firestore_client.transaction())
+
+
+def get_last_successful_invocation_time(repo_uri: str, tags: list):
+    """Gets the start time of the last succeeded workflow invocation of the repository with the same tags,
+    either a full invocation of these tags or a recorded selective invocation of them.
+
+    Returns:
+        datetime: The start time, or None if no such invocation is found.
+    """
+    selective_invocations = set((selective_invocations_ref(repo_uri, tags).get().to_dict() or {})
+                                .get("invocations", []))
+    request = dataform_v1beta1.ListWorkflowInvocationsRequest(
+        parent=repo_uri,
+        order_by="create_time desc"
+    )
+    for scanned, past_invocation in enumerate(df_client.list_workflow_invocations(request=request)):
+        if scanned == PROGRESS_HISTORY_SCAN_LIMIT:
+            break
+        if past_invocation.state.name == "SUCCEEDED" and (
+                past_invocation.name in selective_invocations
+                or sorted(past_invocation.invocation_config.included_tags) == sorted(tags or [])):
+            return past_invocation.invocation_timing.start_time
+    return None
+
+
+def source_changed_since(target, since):
+    """Checks with BigQuery table metadata whether a declared source was modified after a point in time.
+
+    Sources whose metadata cannot be read are considered changed.
+    """
+    try:
+        table = bq_client.get_table(f"{target.database}.{target.schema}.{target.name}")
+    except google.api_core.exceptions.GoogleAPIError as e:
+        logger.warning("Could not read metadata of source %s, considering it changed: %s", target.name, e)
+        return True
+    return table.modified is None or table.modified > since
+
+
+@traced("dataform.get_selective_targets", "compilation_result")
+def get_selective_targets(repo_uri: str, compilation_result: str, tags: list):
+    """Selects the tagged actions that depend, directly or transitively, on a source declaration whose
+    BigQuery table changed since the last successful invocation with the same tags.
+
+    Args:
+        repo_uri (str): The URI of the Dataform repository.
+        compilation_result (str): The name of the compilation result to inspect.
+        tags (list): The tags of the actions that would be executed in a full invocation.
+
+    Returns:
+        list: The targets to execute, or None to execute every tagged action (no previous successful
+            invocation to compare against).
+    """
+    since = get_last_successful_invocation_time(repo_uri, tags)
+    if since is None:
+        logger.info("No previous successful invocation found, executing all tagged actions")
+        return None
+
+    request = dataform_v1beta1.QueryCompilationResultActionsRequest(name=compilation_result)
+    dependents = {}
+    tagged_targets = {}
+    changed_sources = []
+    for action in df_client.query_compilation_result_actions(request=request):
+        key = target_key(action.target)
+        if "declaration" in action:
+            if source_changed_since(action.target, since):
+                changed_sources.append(key)
+            continue
+        for action_type in ("relation", "operations", "assertion"):
+            if action_type not in action:
+                continue
+            definition = getattr(action, action_type)
+            for dependency in definition.dependency_targets:
+                dependents.setdefault(target_key(dependency), []).append(key)
+            if set(definition.tags) & set(tags or []):
+                tagged_targets[key] = action.target
+
+    affected = set()
+    pending = list(changed_sources)
+    while pending:
+        for dependent in dependents.get(pending.pop(), []):
+            if dependent not in affected:
+                affected.add(dependent)
+                pending.append(dependent)
+
+    logger.info("Changed sources since %s: %s, executing %d of %d tagged actions", since, changed_sources,
+                len(affected & tagged_targets.keys()), len(tagged_targets))
+    return [tagged_targets[key] for key in tagged_targets if key in affected]
+
+
+def coalescing_group_key(gcp_project: str, location: str, repo_name: str, branch: str, query_variables: dict):
+    """Builds the key shared by all launch requests that can run in the same workflow invocation."""
+    key_source = json.dumps([gcp_project, location, repo_name, branch, query_variables], sort_keys=True)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:32]
+
+
+@traced("coalescing.join_group", "repo_name", "branch")
+def join_coalescing_group(gcp_project: str, location: str, repo_name: str, tags: list, branch: str,
+                          query_variables: dict, coalesce_window_seconds: int):
+    """Registers a launch request in the open coalescing group for its repository, branch and variables.
+
+    Requests arriving within coalesce_window_seconds of the first one share a group. Their tags are merged,
+    and the group is launched as a single workflow invocation by the first status poll after the window closes.
+
+    Returns:
+        str: A job ID handle of the request in the group, resolved to the shared invocation's state by
+            get_coalesced_workflow_state.
+    """
+    key = coalescing_group_key(gcp_project, location, repo_name, branch, query_variables)
+    member_id = uuid.uuid4().hex[:12]
+    collection = firestore_client.collection(DATAFORM_COALESCING_FIRESTORE_COLLECTION)
+    pointer_ref = collection.document(key)
+
+    @firestore.transactional
+    def join(transaction):
+        now = time.time()
+        pointer = pointer_ref.get(transaction=transaction).to_dict()
+        if pointer and now < pointer["closes_at"]:
+            group_ref = collection.document(pointer["group_id"])
+            group = group_ref.get(transaction=transaction).to_dict()
+            if group and group["state"] == "OPEN":
+                transaction.update(group_ref, {"tags": sorted(set(group["tags"]) | set(tags or [])),
+                                               f"members.{member_id}": sorted(set(tags or []))})
+                return pointer["group_id"]
+        group_id = f"{key}_{int(now * 1000)}"
+        closes_at = now + coalesce_window_seconds
+        transaction.set(collection.document(group_id), {
+            "state": "OPEN",
+            "closes_at": closes_at,
+            "tags": sorted(set(tags or [])),
+            "members": {member_id: sorted(set(tags or []))},
+            "gcp_project": gcp_project,
+            "location": location,
+            "repo_name": repo_name,
+            "branch": branch,
+            "query_variables": query_variables
+        })
+        transaction.set(pointer_ref, {"group_id": group_id, "closes_at": closes_at})
+        return group_id
+
+    group_id = join(firestore_client.transaction())
+    logger.info("Joined coalescing group %s with tags %s", group_id, tags)
+    return f"{COALESCED_JOB_PREFIX}{group_id}.{member_id}"
+
+
+def parse_coalesced_job_id(job_id: str):
+    """Splits a coalescing group handle into its group ID and member ID (None for handles without a member).
+
+    Returns:
+        tuple: (group ID, member ID)
+    """
+    group_id, _, member_id = job_id[len(COALESCED_JOB_PREFIX):].partition(".")
+    return group_id, member_id or None
+
+
+@traced("coalescing.detach_member", "group_id")
+def detach_coalescing_member(group_id: str, member_id: str):
+    """Removes a cancelled request from its coalescing group.
+
+    A group still open drops the member and its tags, and is cancelled without launching once empty. The
+    invocation of a closed group is shared, the member is recorded as cancelled and the invocation is only
+    to be cancelled when every member was.
+
+    Returns:
+        tuple: (group document, whether the shared invocation must be cancelled)
+    """
+    group_ref = firestore_client.collection(DATAFORM_COALESCING_FIRESTORE_COLLECTION).document(group_id)
+
+    @firestore.transactional
+    def detach(transaction):
+        group = group_ref.get(transaction=transaction).to_dict()
+        if not group:
+            raise Exception(f"Coalescing group {group_id} not found")
+        members = group.get("members", {})
+        if group["state"] == "OPEN":
+            members.pop(member_id, None)
+            group["members"] = members
+            group["tags"] = sorted({tag for member_tags in members.values() for tag in member_tags})
+            group["state"] = "OPEN" if members else "CANCELLED"
+            transaction.update(group_ref, {"members": members, "tags": group["tags"], "state": group["state"]})
+            return group, False
+        if group["state"] == "CANCELLED":
+            return group, False
+        cancelled_members = set(group.get("cancelled_members", [])) | ({member_id} if member_id else set())
+        transaction.update(group_ref, {"cancelled_members": sorted(cancelled_members)})
+        return group, bool(members) and cancelled_members >= set(members)
+
+    return detach(firestore_client.transaction())
+
+
+def read_coalescing_group(group_id: str):
+    """Reads a coalescing group document without closing nor launching it.
+
+    Returns:
+        dict: The group document, or None if it does not exist.
+    """
+    group = firestore_client.collection(DATAFORM_COALESCING_FIRESTORE_COLLECTION).document(group_id).get()
+    return group.to_dict() if group.exists else None
+
+
+@traced("coalescing.flush_group", "group_id")
+def flush_coalescing_group(group_id: str):
+    """Closes a coalescing group once its window has elapsed and launches its single workflow invocation.
+
+    Only the caller that wins the transaction closing the group compiles and invokes the workflow, every
+    other caller keeps polling until the invocation name is recorded. A failed launch is recorded as the
+    error of the group instead, failing every member at its next poll.
+
+    Returns:
+        dict: The group document, or None while its window is still open.
+    """
+    group_ref = firestore_client.collection(DATAFORM_COALESCING_FIRESTORE_COLLECTION).document(group_id)
+
+    @firestore.transactional
+    def claim(transaction):
+        group = group_ref.get(transaction=transaction).to_dict()
+        if not group:
+            raise Exception(f"Coalescing group {group_id} not found")
+        if group["state"] != "OPEN":
+            return group, False
+        if time.time() < group["closes_at"]:
+            return None, False
+        group["state"] = "CLOSED"
+        group["claimed_at"] = time.time()
+        transaction.update(group_ref, {"state": group["state"], "claimed_at": group["claimed_at"]})
+        return group, True
+
+    group, claimed = claim(firestore_client.transaction())
+    if claimed:
+        try:
+            group["invocation_id"] = run_workflow(group["gcp_project"], group["location"], group["repo_name"],
+                                                  group["tags"], True, group["branch"], group["query_variables"])
+        except Exception as e:
+            group_ref.update({"error": repr(e)})
+            logger.error("Coalescing group %s could not be launched: %r", group_id, e)
+            raise
+        logger.info("Coalescing group %s launched as %s with tags %s", group_id, group['invocation_id'], group['tags'])
+        if record_coalescing_invocation(group_ref, group["invocation_id"]):
+            # every member was cancelled while the group was being launched, nobody owns the invocation
+            logger.info("Every member of coalescing group %s was cancelled during its launch", group_id)
+            cancel_workflow(group["invocation_id"])
+    return group
+
+
+def record_coalescing_invocation(group_ref, invocation_id: str):
+    """Records the workflow invocation of a launched coalescing group.
+
+    The cancelled members are read in the same transaction, a member cancelled during the launch found no
+    invocation to cancel and left it to the claimer.
+
+    Returns:
+        bool: Whether every member of the group was cancelled, the invocation must then be cancelled.
+    """
+    @firestore.transactional
+    def record(transaction):
+        group = group_ref.get(transaction=transaction).to_dict() or {}
+        transaction.update(group_ref, {"invocation_id": invocation_id})
+        members = group.get("members", {})
+        return bool(members) and set(group.get("cancelled_members", [])) >= set(members)
+
+    return record(firestore_client.transaction())
+
+
+def get_coalesced_workflow_state(job_id: str):
+    """Resolves a coalescing group handle to the state of its shared workflow invocation.
+
+    Args:
+        job_id (str): The handle returned by join_coalescing_group.
+
+    Returns:
+        str: "PENDING" while the group is still collecting requests or being launched, otherwise the
+            state of the shared workflow invocation. Raises the launch error of a group that failed to launch.
+    """
+    group_id = parse_coalesced_job_id(job_id)[0]
+    group = flush_coalescing_group(group_id)
+    if group is None:
+        return "PENDING"
+    if group["state"] == "CANCELLED":
+        return "CANCELLED"
+    if group.get("invocation_id"):
+        return get_workflow_state(group["invocation_id"])
+    if group.get("error"):
+        raise Exception(f"Coalescing group {group_id} could not be launched: {group['error']}")
+    if time.time() - group["claimed_at"] > COALESCING_FLUSH_TIMEOUT_SECONDS:
+        raise Exception(f"Coalescing group {group_id} was closed but its workflow invocation was never created")
+    return "PENDING"
@@ -19,17 +19,25 @@ import os
 import json
 from google.cloud import storage
 from google.auth.transport.requests import Request
+from structured_log import bind, get_logger, poll_sample_key
+from tracing import setup_tracing, span, traced, traced_request
+from profiling import phase, profiled
+from rate_limit import RateLimitExceeded, acquire, throttled_retry_after
 
 # --- Authentication Setup ---
 credentials, project = google.auth.default()
 
 function_name = os.environ.get('K_SERVICE')
 BIGQUERY_PROJECT = os.environ.get('BIGQUERY_PROJECT')
+setup_tracing(function_name or 'dataproc-serverless-job-executor')
+logger = get_logger('dataproc-serverless-job-executor')
 # --- GCS Client ---
 storage_client = storage.Client()
 
 
 @functions_framework.http
+@profiled("dataproc-serverless-job-executor")
+@traced_request("dataproc-serverless-job-executor")
 def main(request):
     """
     Main function, likely triggered by an HTTP request. Extracts parameters, executes a dataproc serverless job
@@ -43,7 +51,8 @@ def main(request):
     """
 
     request_json = request.get_json(silent=True)
-    print("event:" + str(request_json))
+    bind(request_json)
+    logger.debug("event: %s", request_json)
 
     try:
         workflow_properties = request_json.get('workflow_properties', None)
@@ -62,31 +71,42 @@ def main(request):
             )
 
         status_or_job_id = execute_job_or_get_status(job_id, workflow_name, job_name, query_variables,
-                                                     workflow_properties, extracted_params)
+                                                     workflow_properties, extracted_params,
+                                                     request_json.get('action'))
 
         if status_or_job_id.startswith('aef-'):
-            print(f"Running Job, track it with Job ID: {status_or_job_id}")
+            logger.info("Running Job, track it with Job ID: %s", status_or_job_id)
         else:
-            print(f"Call finished with status: {status_or_job_id}")
+            logger.info("Call finished with status: %s", status_or_job_id,
+                        extra={"sample_key": poll_sample_key(job_id, status_or_job_id)})
 
         return status_or_job_id
     except Exception as error:
         err_message = "Exception: " + repr(error)
-        print(err_message)
+        logger.error(err_message, exc_info=True)
         response = {
             "error": error.__class__.__name__,
             "message": repr(error)
         }
+        retry_after = throttled_retry_after(error)
+        if retry_after is not None:
+            # throttled calls are retried by the intermediate function after Retry-After
+            return response, 429, {"Retry-After": str(retry_after)}
         return response
 
 
-def execute_job_or_get_status(job_id, workflow_name, job_name, query_variables, workflow_properties, extracted_params):
-    if job_id:
+def execute_job_or_get_status(job_id, workflow_name, job_name, query_variables, workflow_properties, extracted_params,
+                              action=None):
+    if job_id and action == 'cancel':
+        return cancel_batch_job(job_id, extracted_params)
+    elif job_id:
         return get_job_status(job_id, extracted_params)
     else:
         return create_batch_job(workflow_name, job_name, query_variables, workflow_properties, extracted_params)
 
 
+@traced("gcs.extract_params", "bucket_name", "job_name")
+@phase("gcs_params")
 def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
     """Extracts parameters from a JSON file.
 
@@ -110,10 +130,12 @@ def extract_params(bucket_name, job_name, function_name, encoding='utf-8'):
         params = json.loads(json_data.decode(encoding))
         return params
     except (google.cloud.exceptions.NotFound, json.JSONDecodeError, UnicodeDecodeError) as e:
-        print(f"Error reading JSON file: {e}")
+        logger.error("Error reading JSON file: %s", e)
         return None
 
 
+@traced("dataproc.create_batch", "workflow_name", "job_name")
+@phase("dataproc_launch")
 def create_batch_job(workflow_name, job_name, query_variables, workflow_properties, extracted_params):
     """
     calls a dataproc serverless job.
@@ -138,7 +160,8 @@ def create_batch_job(workflow_name, job_name, query_variables, workflow_properti
     if isinstance(spark_app_properties, str):
         spark_app_properties = json.loads(spark_app_properties)
 
-    credentials.refresh(Request())
+    with span("auth.refresh_token"):
+        credentials.refresh(Request())
     headers = {"Authorization": f"Bearer {credentials.token}"}
 
     curr_dt = datetime.datetime.now()
@@ -171,25 +194,29 @@ def create_batch_job(workflow_name, job_name, query_variables, workflow_properti
             },
         }
 
-    print(params)
+    logger.debug("Dataproc batch params: %s", params)
 
     batch_id = f"aef-{timestamp}"
 
     url = (f"https://dataproc.googleapis.com/v1/projects/{dataproc_serverless_project_id}/"
            f"locations/{dataproc_serverless_region}/batches?batchId={batch_id}")
 
+    acquire("dataproc.batches.create", dataproc_serverless_project_id, dataproc_serverless_region)
     response = requests.post(url, json=params, headers=headers)
 
     if response.status_code == 200:
-        print("response::" + str(response))
+        logger.debug("response: %s", response)
         return batch_id
+    elif response.status_code == 429:
+        raise_quota_exceeded(response, "CREATE")
     else:
         error_message = f"Dataproc API CREATE request failed. Status code:{response.status_code}"
-        print(error_message)
-        print(response.text)
+        logger.error("%s: %s", error_message, response.text)
         raise Exception(error_message)
 
 
+@traced("dataproc.get_batch_state", "job_id")
+@phase("dataproc_status")
 def get_job_status(job_id, extracted_params):
     """
     gets the status of a dataproc serverless job
@@ -203,20 +230,83 @@ def get_job_status(job_id, extracted_params):
     dataproc_serverless_project_id = extracted_params.get('dataproc_serverless_project_id')
     dataproc_serverless_region = extracted_params.get('dataproc_serverless_region')
 
-    credentials.refresh(Request())
+    with span("auth.refresh_token"):
+        credentials.refresh(Request())
     headers = {"Authorization": f"Bearer {credentials.token}"}
 
     url = (f"https://dataproc.googleapis.com/v1/projects/{dataproc_serverless_project_id}/"
            f"locations/{dataproc_serverless_region}/batches/{job_id}")
-    print("Url::::" + url)
+    logger.debug("Url: %s", url)
 
+    acquire("dataproc.batches.get", dataproc_serverless_project_id, dataproc_serverless_region)
     response = requests.get(url, headers=headers)
 
     if response.status_code == 200:
-        print("response::" + str(response))
+        logger.debug("response: %s", response)
         return response.json().get("state")
+    elif response.status_code == 429:
+        raise_quota_exceeded(response, "GET")
     else:
         error_message = f"Dataproc API GET request failed. Status code:{response.status_code}"
-        print(error_message)
-        print(response.text)
+        logger.error("%s: %s", error_message, response.text)
         raise Exception(error_message)
+
+
+@traced("dataproc.cancel_batch", "job_id")
+@phase("dataproc_cancel")
+def cancel_batch_job(job_id, extracted_params):
+    """
+    cancels a dataproc serverless job through the long running operation of its batch
+
+    Args:
+        job_id (str) : id of the batch
+        extracted_params (dict) : job parameters, with the project and region of the batch
+    Returns:
+        str: CANCELLING, or the state of a batch that already finished
+    """
+
+    dataproc_serverless_project_id = extracted_params.get('dataproc_serverless_project_id')
+    dataproc_serverless_region = extracted_params.get('dataproc_serverless_region')
+
+    with span("auth.refresh_token"):
+        credentials.refresh(Request())
+    headers = {"Authorization": f"Bearer {credentials.token}"}
+
+    url = (f"https://dataproc.googleapis.com/v1/projects/{dataproc_serverless_project_id}/"
+           f"locations/{dataproc_serverless_region}/batches/{job_id}")
+    acquire("dataproc.batches.get", dataproc_serverless_project_id, dataproc_serverless_region)
+    response = requests.get(url, headers=headers)
+    if response.status_code == 429:
+        raise_quota_exceeded(response, "GET")
+    elif response.status_code != 200:
+        error_message = f"Dataproc API GET request failed. Status code:{response.status_code}"
+        logger.error("%s: %s", error_message, response.text)
+        raise Exception(error_message)
+
+    batch = response.json()
+    if batch.get("state") in ("SUCCEEDED", "FAILED", "CANCELLING", "CANCELLED"):
+        logger.info("Batch %s already in state %s", job_id, batch.get("state"))
+        return batch.get("state")
+
+    acquire("dataproc.operations.cancel", dataproc_serverless_project_id, dataproc_serverless_region)
+    response = requests.post(f"https://dataproc.googleapis.com/v1/{batch['operation']}:cancel", headers=headers)
+
+    if response.status_code == 200:
+        logger.info("Cancellation of batch %s requested", job_id)
+        return "CANCELLING"
+    elif response.status_code == 429:
+        raise_quota_exceeded(response, "CANCEL")
+    else:
+        error_message = f"Dataproc API CANCEL request failed. Status code:{response.status_code}"
+        logger.error("%s: %s", error_message, response.text)
+        raise Exception(error_message)
+
+
+def raise_quota_exceeded(response, method):
+    """
+    raises RateLimitExceeded for a throttled Dataproc API call, with the Retry-After of the response (1s if absent)
+    """
+    retry_after = response.headers.get("Retry-After", "1")
+    error_message = f"Dataproc API {method} request throttled. Status code:{response.status_code}"
+    logger.warning("%s: %s", error_message, response.text)
+    raise RateLimitExceeded(error_message, int(retry_after) if retry_after.isdigit() else 1)
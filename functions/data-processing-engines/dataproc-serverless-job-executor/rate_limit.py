@@ -0,0 +1,274 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from structured_log import get_logger
+from tracing import set_span_attributes, span
+
+# token buckets of the upstream APIs, one bucket per (api, project, region). Launches are kept well below the
+# per project quotas, status polls and cancellations are cheap and only smoothed. APIs not listed are not limited.
+DEFAULT_RATE_LIMITS = {
+    'bigquery.jobs.insert': {'rate_per_second': 5, 'burst': 20},
+    'bigquery.jobs.cancel': {'rate_per_second': 5, 'burst': 20},
+    'bigquery.jobs.get': {'rate_per_second': 20, 'burst': 50},
+    'dataflow.flexTemplates.launch': {'rate_per_second': 1, 'burst': 5},
+    'dataflow.jobs.get': {'rate_per_second': 10, 'burst': 20},
+    'dataflow.jobs.update': {'rate_per_second': 5, 'burst': 20},
+    'dataform.compilationResults.create': {'rate_per_second': 1, 'burst': 5},
+    'dataform.repositories.readFile': {'rate_per_second': 10, 'burst': 20},
+    'dataform.workflowInvocations.cancel': {'rate_per_second': 5, 'burst': 20},
+    'dataform.workflowInvocations.create': {'rate_per_second': 1, 'burst': 5},
+    'dataform.workflowInvocations.get': {'rate_per_second': 10, 'burst': 20},
+    'dataproc.batches.create': {'rate_per_second': 1, 'burst': 5},
+    'dataproc.batches.get': {'rate_per_second': 10, 'burst': 20},
+    'dataproc.operations.cancel': {'rate_per_second': 5, 'burst': 20},
+}
+# per api overrides of the default limits, as JSON: {"dataproc.batches.create": {"rate_per_second": 0.5}}
+RATE_LIMITS = os.environ.get('RATE_LIMITS', '{}')
+# local (per instance buckets), firestore or redis (buckets shared by every executor instance)
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'local')
+RATE_LIMIT_FIRESTORE_COLLECTION = os.environ.get('RATE_LIMIT_FIRESTORE_COLLECTION', 'workflows_rate_limits')
+# writes per second a firestore bucket document takes, faster buckets are split in shards each refilled at this rate
+RATE_LIMIT_FIRESTORE_SHARD_RATE = float(os.environ.get('RATE_LIMIT_FIRESTORE_SHARD_RATE', 1))
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+# a call waiting longer than this for a token is not made, RateLimitExceeded is raised instead
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', 30))
+
+logger = get_logger('rate_limit')
+rate_limiter = None
+rate_limiter_lock = threading.Lock()
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised instead of calling an upstream API whose bucket would make the call wait too long
+    """
+
+    def __init__(self, message, retry_after_seconds):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+def reserve_token(tokens, updated_at, rate, burst, now, max_wait):
+    """
+    Token bucket with reservations: the bucket refills at rate tokens per second up to burst tokens and every
+    call takes a token, going below zero when the bucket is empty. A negative balance is the queue of the calls
+    already waiting, the new call waits for its own token to be refilled.
+
+    Args:
+        tokens: tokens of the bucket at updated_at, None for a new bucket (full)
+        updated_at: epoch seconds of the last reservation
+        rate: tokens refilled per second
+        burst: capacity of the bucket
+        now: epoch seconds of the reservation
+        max_wait: maximum seconds the call may wait
+
+    Returns:
+        tuple (tokens, seconds to wait), tokens is None when the call would wait more than max_wait and the
+        bucket is left unchanged
+    """
+    if tokens is None:
+        tokens, updated_at = burst, now
+    tokens = min(burst, tokens + max(0.0, now - updated_at) * rate) - 1
+    wait = max(0.0, -tokens / rate)
+    if wait > max_wait:
+        return None, wait
+    return tokens, wait
+
+
+class LocalBucketStore:
+    """
+    Buckets kept in process memory, limiting each instance on its own. Used for tests, single instance
+    deployments and as a local fake of the shared stores.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def reserve(self, key, rate, burst, max_wait):
+        with self.lock:
+            now = time.time()
+            tokens, updated_at = self.buckets.get(key, (None, now))
+            tokens, wait = reserve_token(tokens, updated_at, rate, burst, now, max_wait)
+            if tokens is not None:
+                self.buckets[key] = (tokens, now)
+            return tokens is not None, wait
+
+
+class FirestoreBucketStore:
+    """
+    Buckets shared by every executor instance, updated in transactions. A firestore document only sustains about
+    one write per second, a bucket refilled faster is split in shards of shard_rate tokens per second and its
+    burst, each call reserving in a random shard.
+    """
+
+    def __init__(self, firestore_client, collection, shard_rate=RATE_LIMIT_FIRESTORE_SHARD_RATE):
+        from google.cloud import firestore
+        self.firestore = firestore
+        self.client = firestore_client
+        self.collection = firestore_client.collection(collection)
+        self.shard_rate = shard_rate
+
+    def reserve(self, key, rate, burst, max_wait):
+        shards = max(1, math.ceil(rate / self.shard_rate))
+        if shards > 1:
+            key = f"{key}:{random.randrange(shards)}"
+            rate, burst = rate / shards, max(1.0, burst / shards)
+        bucket_ref = self.collection.document(key)
+
+        @self.firestore.transactional
+        def reserve(transaction):
+            snapshot = bucket_ref.get(transaction=transaction)
+            bucket = snapshot.to_dict() if snapshot.exists else {}
+            now = time.time()
+            tokens, wait = reserve_token(bucket.get("tokens"), bucket.get("updated_at", now), rate, burst, now,
+                                         max_wait)
+            if tokens is not None:
+                transaction.set(bucket_ref, {"tokens": tokens, "updated_at": now})
+            return tokens is not None, wait
+        return reserve(self.client.transaction())
+
+
+class RedisBucketStore:
+    """
+    Buckets shared by every executor instance in a Redis hash per bucket, reserved by a Lua script.
+    Idle buckets expire once refilled.
+    """
+
+    # same arithmetic as reserve_token, numbers are returned as strings as redis truncates Lua numbers
+    RESERVE_SCRIPT = """
+        local rate, burst, now, max_wait = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate) - 1
+        local wait = math.max(0, -tokens / rate)
+        if wait > max_wait then
+            return {'0', tostring(wait)}
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+        return {'1', tostring(wait)}
+    """
+
+    def __init__(self, redis_client):
+        self.script = redis_client.register_script(self.RESERVE_SCRIPT)
+
+    def reserve(self, key, rate, burst, max_wait):
+        reserved, wait = self.script(keys=[f"aef_rate_limit:{key}"], args=[rate, burst, time.time(), max_wait])
+        return int(reserved) == 1, float(wait)
+
+
+class RateLimiter:
+    """
+    Per (api, project, region) token buckets in front of the upstream API calls of the executors, smoothing
+    bursts of launches (eg. a whole workflow level starting at once) instead of failing them on quota errors
+    """
+
+    def __init__(self, store, limits, max_wait_seconds):
+        self.store = store
+        self.limits = limits
+        self.max_wait_seconds = max_wait_seconds
+
+    def acquire(self, api, project, region=None):
+        """
+        Waits for a token of the bucket of the call, before calling the upstream API
+
+        Args:
+            api: upstream API method, eg. dataproc.batches.create
+            project: project the call is made in, the scope of the quota
+            region: region of the call, None for global APIs
+        """
+        limit = self.limits.get(api)
+        if not limit:
+            return
+        key = f"{api}:{project}:{region or 'global'}"
+        reserved, wait = self.store.reserve(key, limit['rate_per_second'], limit['burst'], self.max_wait_seconds)
+        if not reserved:
+            raise RateLimitExceeded(f"Rate limit of {key} exceeded, a token would be available in {wait:.1f}s",
+                                    math.ceil(wait))
+        if wait > 0:
+            logger.info("Waiting %.2fs for a %s token", wait, key)
+            with span("rate_limit.wait", api=api, wait_seconds=wait):
+                time.sleep(wait)
+            set_span_attributes(rate_limit_wait_seconds=wait)
+
+
+def load_rate_limits(overrides=RATE_LIMITS):
+    """
+    Returns:
+        dict of limits by api, the defaults updated with the RATE_LIMITS overrides
+    """
+    overrides = json.loads(overrides) if isinstance(overrides, str) else overrides
+    # null values (eg. unset optional attributes of the terraform variable) keep the default
+    return {api: {**DEFAULT_RATE_LIMITS.get(api, {}),
+                  **{key: value for key, value in limit.items() if value is not None}}
+            for api, limit in {**DEFAULT_RATE_LIMITS, **overrides}.items()}
+
+
+def create_bucket_store(kind=RATE_LIMIT_STORE):
+    if kind == 'firestore':
+        from google.cloud import firestore
+        return FirestoreBucketStore(firestore.Client(), RATE_LIMIT_FIRESTORE_COLLECTION)
+    if kind == 'redis':
+        import redis
+        return RedisBucketStore(redis.Redis.from_url(RATE_LIMIT_REDIS_URL))
+    return LocalBucketStore()
+
+
+def get_rate_limiter():
+    """
+    Rate limiter of the instance, its store created on first use
+    """
+    global rate_limiter
+    with rate_limiter_lock:
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(create_bucket_store(), load_rate_limits(), RATE_LIMIT_MAX_WAIT_SECONDS)
+    return rate_limiter
+
+
+def acquire(api, project, region=None):
+    """
+    Waits for a token of the (api, project, region) bucket, see RateLimiter.acquire
+    """
+    get_rate_limiter().acquire(api, project, region)
+
+
+def resource_scope(name):
+    """
+    Returns:
+        tuple (project, location) of a resource name like projects/{project}/locations/{location}/...
+    """
+    match = re.match(r"projects/([^/]+)/locations/([^/]+)", name or "")
+    return match.groups() if match else (None, None)
+
+
+def throttled_retry_after(error):
+    """
+    Seconds after which a throttled call can be retried, for RateLimitExceeded and upstream quota errors
+    (HTTP 429 of the API clients), None for any other error
+    """
+    if isinstance(error, RateLimitExceeded):
+        return error.retry_after_seconds
+    status = getattr(error, 'code', None) or getattr(getattr(error, 'resp', None), 'status', None)
+    if status == 429:
+        return 1
+    return None
@@ -0,0 +1,135 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+from zoneinfo import ZoneInfo
+
+MONTH_NAMES = {name: number for number, name in enumerate(
+    ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"], start=1)}
+DAY_NAMES = {name: number for number, name in enumerate(["SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT"])}
+# (lowest value, highest value, names) of each of the five crond fields
+FIELD_RANGES = [(0, 59, {}), (0, 23, {}), (1, 31, {}), (1, 12, MONTH_NAMES), (0, 7, DAY_NAMES)]
+# a schedule not firing within this many days (e.g. "0 0 30 2 *") never fires
+MAX_SEARCH_DAYS = 366 * 8
+UTC = datetime.timezone.utc
+
+
+def parse_field(expression, low, high, names):
+    """
+    parses one crond field into the set of values it matches
+
+    Args:
+        expression: crond field, supporting "*", lists, ranges, steps and month or day names (e.g. "1-5,10/15")
+        low: lowest value allowed in the field
+        high: highest value allowed in the field
+        names: dictionary of upper case names to values
+
+    Returns:
+        set of matched values
+    """
+    values = set()
+    for part in expression.upper().split(","):
+        range_part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if range_part == "*":
+            start, end = low, high
+        else:
+            start_part, _, end_part = range_part.partition("-")
+            start = int(names.get(start_part, start_part))
+            end = int(names.get(end_part, end_part)) if end_part else (high if step > 1 else start)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid crond field: {expression}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    A crond expression evaluated in a time zone, following Cloud Scheduler semantics:
+    day of month and day of week match with OR when both are restricted, local times skipped by a
+    daylight saving time change fire at the change, and repeated local times fire only once.
+    """
+
+    def __init__(self, crond_expression, time_zone="UTC"):
+        fields = crond_expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid crond expression: {crond_expression}")
+        self.minutes, self.hours, self.days, self.months, days_of_week = [
+            parse_field(field, *field_range) for field, field_range in zip(fields, FIELD_RANGES)]
+        self.days_of_week = {day % 7 for day in days_of_week}
+        self.days_restricted = fields[2] != "*"
+        self.days_of_week_restricted = fields[4] != "*"
+        self.sorted_hours = sorted(self.hours)
+        self.sorted_minutes = sorted(self.minutes)
+        self.time_zone = ZoneInfo(time_zone or "UTC")
+
+    def matches_day(self, day):
+        """
+        checks if a local date matches the day of month, month and day of week fields
+        """
+        if day.month not in self.months:
+            return False
+        day_matches = day.day in self.days
+        day_of_week_matches = (day.isoweekday() % 7) in self.days_of_week
+        if self.days_restricted and self.days_of_week_restricted:
+            return day_matches or day_of_week_matches
+        return day_matches and day_of_week_matches
+
+    def to_utc(self, wall_time):
+        """
+        converts a naive local wall time into the UTC instant it fires at
+
+        Ambiguous wall times resolve to their first occurrence, nonexistent ones to the daylight saving
+        time change that skipped them.
+        """
+        local_time = wall_time.replace(tzinfo=self.time_zone)
+        instant = local_time.astimezone(UTC)
+        if instant.astimezone(self.time_zone).replace(tzinfo=None) == wall_time:
+            return instant
+        # nonexistent wall time: the change happened between both possible offsets
+        low = min(instant, local_time.replace(fold=1).astimezone(UTC))
+        high = max(instant, local_time.replace(fold=1).astimezone(UTC))
+        while high - low > datetime.timedelta(minutes=1):
+            middle = low + (high - low) / 2
+            if middle.astimezone(self.time_zone).replace(tzinfo=None) > wall_time:
+                high = middle
+            else:
+                low = middle
+        return high.replace(second=0, microsecond=0)
+
+    def next_fire_time(self, after):
+        """
+        computes the first fire time strictly after a given instant
+
+        Args:
+            after: timezone aware datetime
+
+        Returns:
+            timezone aware UTC datetime of the next fire time, or None if the schedule never fires
+        """
+        after = after.astimezone(UTC)
+        start_wall = (after.astimezone(self.time_zone).replace(tzinfo=None, second=0, microsecond=0)
+                      + datetime.timedelta(minutes=1))
+        day = start_wall.date()
+        for _ in range(MAX_SEARCH_DAYS):
+            if self.matches_day(day):
+                for hour in self.sorted_hours:
+                    for minute in self.sorted_minutes:
+                        wall_time = datetime.datetime(day.year, day.month, day.day, hour, minute)
+                        if wall_time < start_wall:
+                            continue
+                        instant = self.to_utc(wall_time)
+                        if instant > after:
+                            return instant
+            day += datetime.timedelta(days=1)
+        return None
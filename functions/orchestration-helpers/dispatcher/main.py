@@ -0,0 +1,222 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import heapq
+import logging
+import datetime
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import google.auth.transport.requests
+import google.cloud.logging
+import functions_framework
+import google.oauth2.id_token
+from google.cloud import error_reporting
+from google.cloud import firestore
+from cron import CronSchedule, UTC
+from profiling import profiled
+
+# Access environment variables
+WORKFLOW_SCHEDULING_PROJECT_ID = os.environ.get('WORKFLOW_SCHEDULING_PROJECT_ID')
+WORKFLOW_SCHEDULING_PROJECT_REGION = os.environ.get('WORKFLOW_SCHEDULING_PROJECT_REGION')
+WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION = os.environ.get('WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION')
+PIPELINE_EXECUTION_FUNCTION_NAME = os.environ.get('PIPELINE_EXECUTION_FUNCTION_NAME')
+# schedules are re-read from firestore after this many seconds
+INDEX_REFRESH_SECONDS = int(os.environ.get('INDEX_REFRESH_SECONDS', 300))
+DISPATCH_MAX_WORKERS = int(os.environ.get('DISPATCH_MAX_WORKERS', 32))
+# fire times missed by late or skipped ticks are still fired if not older than this many minutes
+DISPATCH_CATCH_UP_MINUTES = int(os.environ.get('DISPATCH_CATCH_UP_MINUTES', 60))
+
+# define clients
+error_client = error_reporting.Client()
+client = google.cloud.logging.Client()
+client.setup_logging()
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+firestore_client = firestore.Client()
+
+# in memory schedule index, kept between ticks served by the same instance
+schedule_index = {
+    "loaded_at": 0,
+    "schedules": {},
+    "heap": [],
+    "evaluated_until": None
+}
+
+
+@functions_framework.http
+@profiled("dispatcher")
+def main(request):
+    """
+    Main function, triggered every minute by a single cloud scheduler tick.
+    Alternative to one cloud scheduler rule per workflow: evaluates the crond expression and time zone of
+    every firestore schedule and triggers the pipeline executor function for every workflow due in the
+    last minute, in concurrent batches.
+
+    Args:
+        request: The incoming HTTP request object.
+
+    Returns:
+        names of the triggered workflows and their execution ids
+    """
+    try:
+        window_end = datetime.datetime.now(UTC).replace(second=0, microsecond=0)
+        due_workflows = get_due_workflows(window_end)
+        logger.info(f"Tick {window_end.isoformat()}: {len(due_workflows)} workflows due")
+        return dispatch(due_workflows)
+    except Exception as ex:
+        exception_message = "Exception : " + repr(ex)
+        error_client.report_exception()
+        logger.error(exception_message)
+        return exception_message, 500
+
+
+def load_schedules(firestore_db):
+    """
+    reads every firestore schedule and parses its crond expression
+
+    Args:
+        firestore_db: firestore client (or a fake exposing collection(name).stream())
+
+    Returns:
+        dictionary of workflow name to (CronSchedule, workflow parameters sent to the pipeline executor)
+    """
+    schedules = {}
+    for doc in firestore_db.collection(WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION).stream():
+        document = doc.to_dict()
+        try:
+            cron_schedule = CronSchedule(document.get("crond_expression", ""), document.get("time_zone"))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Skipping schedule {doc.id}: {e}")
+            continue
+        workflow_properties = document.get("workflow_properties", "")
+        if not isinstance(workflow_properties, str):
+            workflow_properties = json.dumps(workflow_properties)
+        workflow_parameters = {
+            "workflows_name": doc.id,
+            "validation_date_pattern": document.get("date_format"),
+            "same_day_execution": "YESTERDAY",
+            "workflow_status": document.get("workflow_status"),
+            "workflow_properties": workflow_properties
+        }
+        for field in ("granularity", "range_safe"):
+            if field in document:
+                workflow_parameters[field] = document[field]
+        schedules[doc.id] = (cron_schedule, workflow_parameters)
+    return schedules
+
+
+def build_index(schedules, after):
+    """
+    builds a heap of (next fire time, workflow name) ordered by next fire time
+
+    Args:
+        schedules: dictionary returned by load_schedules
+        after: instant after which fire times are computed
+
+    Returns:
+        heap list
+    """
+    heap = []
+    for workflow_name, (cron_schedule, _) in schedules.items():
+        next_fire_time = cron_schedule.next_fire_time(after)
+        if next_fire_time:
+            heap.append((next_fire_time, workflow_name))
+    heapq.heapify(heap)
+    return heap
+
+
+def get_due_workflows(window_end, firestore_db=None, index=None):
+    """
+    pops every schedule firing in (evaluated_until, window_end] from the index, and pushes them back with
+    their following fire time. Fire times missed by late or skipped ticks are fired by the next tick, once per
+    schedule, up to DISPATCH_CATCH_UP_MINUTES back. Older ones (and those before the first tick of the
+    instance) are rescheduled without firing.
+
+    Args:
+        window_end: end of the evaluated minute, timezone aware
+        firestore_db: firestore client, defaults to the module client
+        index: schedule index, defaults to the module index
+
+    Returns:
+        list of workflow parameters of the due workflows
+    """
+    firestore_db = firestore_db or firestore_client
+    index = index if index is not None else schedule_index
+    if index["evaluated_until"] is not None and index["evaluated_until"] >= window_end:
+        return []
+    window_start = window_end - datetime.timedelta(minutes=1)
+    if index["evaluated_until"] is not None:
+        window_start = max(index["evaluated_until"],
+                           window_end - datetime.timedelta(minutes=DISPATCH_CATCH_UP_MINUTES))
+        if window_start > index["evaluated_until"]:
+            logger.warning(f"Fire times from {index['evaluated_until'].isoformat()} to {window_start.isoformat()} "
+                           f"are older than {DISPATCH_CATCH_UP_MINUTES} minutes, skipped")
+    if time.time() - index["loaded_at"] > INDEX_REFRESH_SECONDS or index["evaluated_until"] is None:
+        index["schedules"] = load_schedules(firestore_db)
+        index["heap"] = build_index(index["schedules"], window_start)
+        index["loaded_at"] = time.time()
+        logger.info(f"Schedule index rebuilt with {len(index['heap'])} schedules")
+
+    due_workflows = []
+    heap = index["heap"]
+    while heap and heap[0][0] <= window_end:
+        fire_time, workflow_name = heapq.heappop(heap)
+        cron_schedule, workflow_parameters = index["schedules"][workflow_name]
+        if fire_time > window_start and workflow_parameters["workflow_status"] == 'ENABLED':
+            due_workflows.append(workflow_parameters)
+        next_fire_time = cron_schedule.next_fire_time(window_end)
+        if next_fire_time:
+            heapq.heappush(heap, (next_fire_time, workflow_name))
+    index["evaluated_until"] = window_end
+    return due_workflows
+
+
+def dispatch(due_workflows):
+    """
+    triggers the pipeline executor function for every due workflow, concurrently
+
+    Args:
+        due_workflows: list of workflow parameters, as sent by cloud scheduler rules
+
+    Returns:
+        dictionary of workflow name to execution id, or to the error raised while triggering it
+    """
+    if not due_workflows:
+        return {}
+    target_function_url = (f"https://{WORKFLOW_SCHEDULING_PROJECT_REGION}-{WORKFLOW_SCHEDULING_PROJECT_ID}"
+                           f".cloudfunctions.net/{PIPELINE_EXECUTION_FUNCTION_NAME}")
+    auth_req = google.auth.transport.requests.Request()
+    id_token = google.oauth2.id_token.fetch_id_token(auth_req, target_function_url)
+
+    def trigger(workflow_parameters):
+        req = urllib.request.Request(target_function_url, data=json.dumps(workflow_parameters).encode("utf-8"))
+        req.add_header("Authorization", f"Bearer {id_token}")
+        req.add_header("Content-Type", "application/json")
+        return urllib.request.urlopen(req).read().decode("utf-8")
+
+    results = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=DISPATCH_MAX_WORKERS) as executor:
+        futures = {workflow["workflows_name"]: executor.submit(trigger, workflow) for workflow in due_workflows}
+    for workflow_name, future in futures.items():
+        if future.exception():
+            results[workflow_name] = failures[workflow_name] = repr(future.exception())
+        else:
+            results[workflow_name] = future.result()
+    logger.info(f"Dispatched {len(results) - len(failures)} workflows")
+    if failures:
+        logger.error(f"{len(failures)} workflows could not be dispatched: {failures}")
+    return results
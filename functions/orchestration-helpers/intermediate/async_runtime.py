@@ -0,0 +1,206 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import base64
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import google.auth.transport.requests
+import google.oauth2.id_token
+
+# total timeout of an executor call, executor functions time out after 60 minutes
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', 3600))
+# open connections to the executors shared by the concurrent requests of the instance
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 500))
+# ID tokens are valid one hour, they are fetched again this many seconds before expiring
+ID_TOKEN_REFRESH_MARGIN_SECONDS = 300
+# rows inserted in the same table within this window are sent in one streaming insert
+INSERT_BATCH_WINDOW_MS = float(os.environ.get('INSERT_BATCH_WINDOW_MS', 20))
+INSERT_BATCH_MAX_ROWS = 500
+# worker threads of the co-located executor calls, one per request thread so that executors waiting for a rate
+# limit token never queue the calls of other requests
+EXECUTOR_THREADS = int(os.environ.get('THREADS', 250))
+
+event_loop = None
+event_loop_lock = threading.Lock()
+executor_pool = None
+http_session = None
+# audience -> (id token, expiry epoch seconds)
+id_tokens = {}
+id_token_locks = {}
+
+
+def get_event_loop():
+    """
+    Event loop of the instance, running in a daemon thread. Created on first use, shared by all the request
+    threads so that their I/O is multiplexed on one loop, with one connection pool and one token cache.
+    """
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, name="aef-event-loop", daemon=True).start()
+    return event_loop
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on the event loop of the instance and waits for its result from a request thread.
+    The coroutine sees the context variables (trace, log and profiling context) of the calling thread.
+
+    Args:
+        coroutine: coroutine object to run
+
+    Returns:
+        the coroutine result, its exception is raised in the calling thread
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+async def run_blocking_executor(call, *args):
+    """
+    Runs a blocking executor call in the worker threads dedicated to the executors, sized by THREADS. The asyncio
+    default executor, min(32, cpu + 4) threads, is left to the short blocking calls (control table inserts,
+    context store reads and ID token fetches), which executor calls sleeping on a rate limit would otherwise starve.
+    Like asyncio.to_thread, the call sees the context variables of the caller.
+
+    Args:
+        call: blocking callable
+        args: positional arguments of the call
+
+    Returns:
+        the call result
+    """
+    global executor_pool
+    if executor_pool is None:
+        executor_pool = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="aef-executor")
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor_pool, functools.partial(context.run, call, *args))
+
+
+async def get_http_session():
+    """
+    aiohttp session of the event loop, keeping connections to the executors alive between requests
+    """
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+            connector=aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS))
+    return http_session
+
+
+async def fetch_id_token(audience):
+    """
+    ID token of the function service account for an audience, cached until shortly before it expires.
+    Concurrent requests for the same audience wait for a single fetch.
+
+    Args:
+        audience: URL of the called function
+
+    Returns:
+        str: ID token
+    """
+    cached = id_tokens.get(audience)
+    if cached and cached[1] - ID_TOKEN_REFRESH_MARGIN_SECONDS > time.time():
+        return cached[0]
+    lock = id_token_locks.setdefault(audience, asyncio.Lock())
+    async with lock:
+        cached = id_tokens.get(audience)
+        if cached and cached[1] - ID_TOKEN_REFRESH_MARGIN_SECONDS > time.time():
+            return cached[0]
+        id_token = await asyncio.to_thread(fetch_id_token_blocking, audience)
+        id_tokens[audience] = (id_token, token_expiry(id_token))
+    return id_token
+
+
+def fetch_id_token_blocking(audience):
+    auth_req = google.auth.transport.requests.Request()
+    return google.oauth2.id_token.fetch_id_token(auth_req, audience)
+
+
+def token_expiry(id_token):
+    """
+    Expiry of a JWT read from its unverified payload, the token is only cached, never trusted
+    """
+    try:
+        payload = id_token.split('.')[1]
+        return float(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except Exception:
+        return time.time() + ID_TOKEN_REFRESH_MARGIN_SECONDS
+
+
+class BatchedInserter:
+    """
+    Streaming inserts into a BigQuery table that do not block the event loop. Rows inserted concurrently are
+    grouped in one insert_rows_json call run in a worker thread, each caller waiting for its own row only.
+    """
+
+    def __init__(self, bq_client, table):
+        self.bq_client = bq_client
+        self.table = table
+        self.pending = []
+        self.flush_task = None
+
+    async def insert(self, row, row_id=None):
+        """
+        Inserts a row, raising an exception if BigQuery rejects it
+
+        Args:
+            row: JSON row
+            row_id: insert id deduplicating retried inserts, a random one if not given
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((row, row_id or uuid.uuid4().hex, future))
+        if len(self.pending) >= INSERT_BATCH_MAX_ROWS:
+            self.flush_now()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+        await future
+
+    async def flush_later(self):
+        await asyncio.sleep(INSERT_BATCH_WINDOW_MS / 1000)
+        self.flush_task = None
+        self.flush_now()
+
+    def flush_now(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self.insert_batch(batch))
+
+    async def insert_batch(self, batch):
+        try:
+            errors = await asyncio.to_thread(self.bq_client.insert_rows_json, self.table,
+                                             [row for row, _, _ in batch], row_ids=[row_id for _, row_id, _ in batch])
+        except Exception as ex:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        errors_by_index = {error['index']: error['errors'] for error in errors or []}
+        for index, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors_by_index:
+                future.set_exception(Exception(f"Encountered errors while inserting row: {errors_by_index[index]}"))
+            else:
+                future.set_result(None)
@@ -0,0 +1,124 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# handles are returned in place of the job id, the prefix keeps them valid step ids for cloud workflows
+CONTEXT_HANDLE_PREFIX = 'aef_ctx_'
+
+
+def new_handle():
+    return CONTEXT_HANDLE_PREFIX + uuid.uuid4().hex
+
+
+def is_context_handle(value):
+    return isinstance(value, str) and value.startswith(CONTEXT_HANDLE_PREFIX)
+
+
+class InMemoryContextStore:
+    """
+    Context store kept in process memory. Used for tests and single instance deployments.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contexts = {}
+
+    def put(self, handle, context, expire_at):
+        with self.lock:
+            self.contexts[handle] = (context, expire_at)
+
+    def get(self, handle):
+        with self.lock:
+            context, expire_at = self.contexts.get(handle, (None, 0))
+        return (context, expire_at) if expire_at > time.time() else None
+
+
+class FirestoreContextStore:
+    """
+    Context store shared by every intermediate function instance, one document per handle. Documents carry an
+    expire_at timestamp, deleted by the firestore TTL policy of the collection.
+    """
+
+    def __init__(self, firestore_client, collection):
+        self.collection = firestore_client.collection(collection)
+
+    def put(self, handle, context, expire_at):
+        self.collection.document(handle).set(
+            {"context": context, "expire_at": datetime.fromtimestamp(expire_at, timezone.utc)})
+
+    def get(self, handle):
+        snapshot = self.collection.document(handle).get()
+        if not snapshot.exists:
+            return None
+        document = snapshot.to_dict()
+        expire_at = document["expire_at"].timestamp()
+        # the TTL policy deletes expired documents within a day, not on time
+        return (document["context"], expire_at) if expire_at > time.time() else None
+
+
+class ContextCache:
+    """
+    Async front of a context store for the event loop of the instance. Store calls run in worker threads and
+    loaded contexts are kept in a bounded LRU cache, with the values derived from them (eg. the executor payload).
+    """
+
+    def __init__(self, store, ttl_seconds, max_entries):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    async def save(self, context):
+        """
+        Persists a step context
+
+        Args:
+            context: JSON serializable dictionary
+
+        Returns:
+            str: handle of the context, valid ttl_seconds
+        """
+        handle = new_handle()
+        expire_at = time.time() + self.ttl_seconds
+        await asyncio.to_thread(self.store.put, handle, context, expire_at)
+        self.remember(handle, {"context": context, "expire_at": expire_at})
+        return handle
+
+    async def load(self, handle):
+        """
+        Returns:
+            the cache entry of a handle, a dictionary holding the context and the values derived from it.
+            Raises an exception for an unknown or expired handle.
+        """
+        entry = self.entries.get(handle)
+        if entry is not None and entry["expire_at"] > time.time():
+            self.entries.move_to_end(handle)
+            return entry
+        stored = await asyncio.to_thread(self.store.get, handle)
+        if stored is None:
+            raise Exception(f"Unknown or expired context handle {handle}")
+        entry = {"context": stored[0], "expire_at": stored[1]}
+        self.remember(handle, entry)
+        return entry
+
+    def remember(self, handle, entry):
+        self.entries[handle] = entry
+        self.entries.move_to_end(handle)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
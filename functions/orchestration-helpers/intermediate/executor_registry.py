@@ -0,0 +1,120 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextvars
+import importlib
+import json
+import os
+
+from resilience import ExecutorResponseError
+from structured_log import get_logger
+
+# co-located executors loaded at startup: "<function name>=<module>[:<entry point>],..."
+# eg. "orch-framework-bq-saved-query-executor=executors.bq_saved_query_executor.main"
+CO_LOCATED_EXECUTORS = os.environ.get('CO_LOCATED_EXECUTORS', '')
+
+executors = {}
+logger = get_logger('intermediate')
+
+
+def register_executor(function_name, executor):
+    """
+    Registers an in-process executor. Calls to a function_url_to_call ending with function_name are served by it
+    instead of an HTTP call.
+
+    Args:
+        function_name: deployed name of the executor function, last path segment of its URL
+        executor: callable receiving the executor request payload (dict) and returning the response text: a job
+                  id when launching, the job state when called with a job_id
+    """
+    executors[function_name] = executor
+
+
+def register_http_entry_point(function_name, entry_point):
+    """
+    Registers an executor function entry point, written for HTTP calls, as an in-process executor
+    """
+    register_executor(function_name, HttpEntryPointExecutor(entry_point))
+
+
+def get_executor(function_url):
+    """
+    Returns:
+        the in-process executor registered for a function URL, or None when it has to be called over HTTP
+    """
+    return executors.get(function_name_of(function_url)) if executors else None
+
+
+def function_name_of(function_url):
+    return function_url.rstrip('/').split('/')[-1]
+
+
+def load_co_located_executors(spec=CO_LOCATED_EXECUTORS):
+    """
+    Imports and registers the entry points listed in CO_LOCATED_EXECUTORS. An executor failing to import is left
+    out and keeps being called over HTTP.
+    """
+    for entry in filter(None, (item.strip() for item in spec.split(','))):
+        function_name, _, target = entry.partition('=')
+        module_name, _, attribute = target.partition(':')
+        function_name = function_name.strip()
+        try:
+            module = importlib.import_module(module_name)
+            entry_point = getattr(module, attribute or 'main')
+        except Exception as ex:
+            logger.warning("Could not load co-located executor %s from %s, calling it over HTTP: %r",
+                           function_name, target, ex)
+            continue
+        if hasattr(module, 'function_name'):
+            # executors read their job parameters under their own function name, K_SERVICE is the intermediate's
+            module.function_name = function_name
+        register_http_entry_point(function_name, entry_point)
+        logger.info("Co-located executor %s loaded from %s", function_name, target)
+
+
+class HttpEntryPointExecutor:
+    """
+    Adapts an HTTP entry point of an executor (request -> str, dict, (body, status) or (body, status, headers)) to
+    the in-process contract. Error statuses are raised as ExecutorResponseError, keeping the Retry-After header of
+    the throttled calls.
+    """
+
+    def __init__(self, entry_point):
+        self.entry_point = entry_point
+
+    def __call__(self, payload, headers=None):
+        # own context, so that the executor logging, profiling and tracing state does not leak into the caller's
+        response = contextvars.copy_context().run(self.entry_point, InProcessRequest(payload, headers or {}))
+        status, response_headers = 200, {}
+        if isinstance(response, tuple):
+            response, status, response_headers = (*response, {})[:3]
+        if isinstance(response, (dict, list)):
+            response = json.dumps(response)
+        elif isinstance(response, bytes):
+            response = response.decode("utf-8")
+        if status >= 400:
+            raise ExecutorResponseError(status, response, dict(response_headers or {}))
+        return response
+
+
+class InProcessRequest:
+    """
+    Minimal stand-in of the flask request received by the executor entry points
+    """
+
+    def __init__(self, payload, headers):
+        self.payload = payload
+        self.headers = headers
+
+    def get_json(self, silent=False, force=False):
+        return self.payload
@@ -11,41 +11,75 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import os
 import re
-import google.auth
-import urllib
-import urllib.error
-import urllib.request
+import hashlib
 import json
-import logging
-import google.auth.transport.requests
+import uuid
 import functions_framework
-import google.oauth2.id_token
 from google.cloud import bigquery
-from datetime import datetime, timedelta
+from google.cloud import firestore
+from datetime import datetime, timedelta, timezone
 from google.cloud import error_reporting
 from enum import Enum
 from urllib import parse
+from async_runtime import BatchedInserter, fetch_id_token, get_http_session, run, run_blocking_executor
+from context_store import ContextCache, FirestoreContextStore, is_context_handle
+from executor_registry import get_executor, load_co_located_executors
+from resilience import RESPONSE_ERRORS, CircuitOpenError, call_with_retry, describe_error, retry_count
+from structured_log import bind, bind_fields, get_logger, poll_sample_key
+from tracing import inject_trace_context, set_span_attributes, setup_tracing, span, traced, traced_request
+from profiling import phase, profiled
 
 # Access environment variables
 WORKFLOW_CONTROL_PROJECT_ID = os.environ.get('WORKFLOW_CONTROL_PROJECT_ID')
 WORKFLOW_CONTROL_DATASET_ID = os.environ.get('WORKFLOW_CONTROL_DATASET_ID')
 WORKFLOW_CONTROL_TABLE_ID = os.environ.get('WORKFLOW_CONTROL_TABLE_ID')
+WORKFLOW_JOB_PARAMS_TABLE_ID = os.environ.get('WORKFLOW_JOB_PARAMS_TABLE_ID', 'workflows_job_params')
+CONTROL_SCHEMA_VERSION = 2
+# request fields changing between calls of the same step, left out of the stored job params
+VOLATILE_REQUEST_FIELDS = ('call_type', 'async_job_id', 'context_handle')
+# request fields changing between executions of the same step, kept in their own control table columns instead
+EXECUTION_REQUEST_FIELDS = ('execution_id', 'query_variables')
+# get_id returns a context handle instead of the job id, status polls then only need to send the handle.
+# Overridden per step by a context_handle request field.
+CONTEXT_HANDLES = os.environ.get('CONTEXT_HANDLES', 'false').lower() == 'true'
+CONTEXT_FIRESTORE_COLLECTION = os.environ.get('CONTEXT_FIRESTORE_COLLECTION', 'workflows_step_contexts')
+# step contexts are kept a week, longer than any step polling
+CONTEXT_TTL_SECONDS = int(os.environ.get('CONTEXT_TTL_SECONDS', 7 * 24 * 3600))
+CONTEXT_CACHE_SIZE = int(os.environ.get('CONTEXT_CACHE_SIZE', 10000))
+
+# traces
+setup_tracing(os.environ.get('K_SERVICE', 'intermediate'))
 
 # define clients
 bq_client = bigquery.Client(project=WORKFLOW_CONTROL_PROJECT_ID)
 error_client = error_reporting.Client()
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger = get_logger('intermediate')
+control_table_inserter = BatchedInserter(
+    bq_client, bq_client.dataset(WORKFLOW_CONTROL_DATASET_ID).table(WORKFLOW_CONTROL_TABLE_ID))
+job_params_inserter = BatchedInserter(
+    bq_client, bq_client.dataset(WORKFLOW_CONTROL_DATASET_ID).table(WORKFLOW_JOB_PARAMS_TABLE_ID))
+step_contexts = ContextCache(FirestoreContextStore(firestore.Client(), CONTEXT_FIRESTORE_COLLECTION),
+                             CONTEXT_TTL_SECONDS, CONTEXT_CACHE_SIZE)
+# job params hashes already stored by this instance
+stored_params_hashes = set()
+# sent with every response, lets load tests count the instances serving them
+INSTANCE_HEADERS = {'X-Instance-Id': uuid.uuid4().hex[:16]}
+# executors bundled with this function, called without the HTTP round trip
+load_co_located_executors()
 
 
 class JobStatus(Enum):
     SUCCESS = ("DONE", "SUCCESS", "SUCCEEDED", "JOB_STATE_DONE")
     RUNNING = ("PENDING", "RUNNING", "JOB_STATE_QUEUED", "JOB_STATE_RUNNING", "JOB_STATE_PENDING")
+    CANCELLED = ("CANCELLED", "CANCELLING", "CANCELING", "JOB_STATE_CANCELLED", "JOB_STATE_CANCELLING")
 
 
 @functions_framework.http
+@profiled("intermediate")
+@traced_request("intermediate")
 def main(request):
     """
     Main function, likely triggered by an HTTP request from cloud workflows.
@@ -59,33 +93,83 @@ def main(request):
     Returns:
         str: The status of the query execution or the job ID (if asynchronous).
     """
-    request_json = request.get_json()
-    print("event: " + str(request_json))
+    with phase("parse_request"):
+        request_json = request.get_json()
+    bind(request_json)
+    logger.debug("event: %s", request_json)
     try:
-        if request_json and 'call_type' in request_json:
-            call_type = request_json['call_type']
-        else:
-            Exception("No call type!")
-        if call_type == "get_id":
-            get_id_result = evaluate_error(call_custom_function(request_json, None))
-            status = 'started' if is_valid_step_id(get_id_result) else 'failed_start'
-            log_step_bigquery(request_json, status)
-            return get_id_result
-        elif call_type == "get_status":
-            if request_json and 'async_job_id' in request_json:
-                status = evaluate_error(call_custom_function(request_json, request_json['async_job_id']))
-            else:
-                Exception("Job Id not received!")
-            return status
-        else:
-            raise Exception("Invalid call type!")
+        # the I/O of every concurrent request of the instance is multiplexed on one event loop
+        return run(handle_request(request_json)), 200, INSTANCE_HEADERS
     except Exception as ex:
         exception_message = "Exception : " + repr(ex)
         # TODO register error in checkpoint table
         error_client.report_exception()
-        logger.error(exception_message)
-        print(RuntimeError(repr(ex)))
-        return exception_message, 500
+        logger.error(exception_message, exc_info=True)
+        return exception_message, 500, INSTANCE_HEADERS
+
+
+async def handle_request(request_json):
+    """
+    Serves a call of cloud workflows on the event loop of the instance
+
+    Args:
+        request_json: request payload
+
+    Returns:
+        str: The status of the query execution or the job ID (if asynchronous).
+    """
+    if request_json and 'call_type' in request_json:
+        call_type = request_json['call_type']
+    else:
+        Exception("No call type!")
+    set_span_attributes(call_type=call_type, workflow_execution_id=request_json.get('execution_id'),
+                        workflow_name=request_json.get('workflow_name'), job_name=request_json.get('job_name'),
+                        async_job_id=request_json.get('async_job_id'))
+    if call_type == "get_id":
+        get_id_result = evaluate_error(await call_custom_function(request_json, None))
+        status = 'started' if is_valid_step_id(get_id_result) else 'failed_start'
+        await log_step_bigquery(request_json, status, get_id_result)
+        if status == 'started' and request_json.get('context_handle', CONTEXT_HANDLES):
+            return await step_contexts.save({'request': job_params_of(request_json), 'async_job_id': get_id_result})
+        return get_id_result
+    elif call_type == "get_status":
+        if request_json and is_context_handle(request_json.get('async_job_id')):
+            status = evaluate_error(await poll_step_context(request_json['async_job_id']))
+        elif request_json and 'async_job_id' in request_json:
+            status = evaluate_error(await call_custom_function(request_json, request_json['async_job_id']))
+        else:
+            Exception("Job Id not received!")
+        return status
+    elif call_type == "cancel":
+        return await cancel_step(request_json)
+    elif call_type == "cancel_group":
+        return json.dumps(await cancel_group(request_json['execution_id']))
+    else:
+        raise Exception("Invalid call type!")
+
+
+async def poll_step_context(handle):
+    """
+    Polls the job of a step from its stored context, the request only carries the context handle.
+    The executor payload is built once per instance and kept with the cached context.
+
+    Args:
+        handle: context handle returned by get_id
+
+    Returns:
+        str: status of the job
+    """
+    entry = await step_contexts.load(handle)
+    context = entry['context']
+    request_json = {**context['request'], 'call_type': 'get_status', 'async_job_id': context['async_job_id']}
+    bind_fields(**{field: request_json.get(field) for field in ('execution_id', 'workflow_name', 'job_name',
+                                                                 'async_job_id')})
+    set_span_attributes(workflow_execution_id=request_json.get('execution_id'),
+                        workflow_name=request_json.get('workflow_name'), job_name=request_json.get('job_name'),
+                        async_job_id=context['async_job_id'])
+    if 'params' not in entry:
+        entry['params'] = executor_params(request_json, context['async_job_id'])
+    return await call_custom_function(request_json, context['async_job_id'], entry['params'])
 
 
 def is_valid_step_id(step_id):
@@ -119,22 +203,29 @@ def evaluate_error(message):
     return message
 
 
-def log_step_bigquery(request_json, status):
+@traced("bigquery.log_step", "status")
+@phase("bigquery_log")
+async def log_step_bigquery(request_json, status, async_job_id=None):
     """
-    Logs a new entry in workflows bigquery table on finished or started step, ether it failed of succeed
+    Logs a new entry in workflows bigquery table on finished or started step, ether it failed of succeed.
+    The step parameters are stored once per hash in the job params table, the control row only references them.
 
     Args:
         status: status of the execution
         request_json: event object containing info to log
+        async_job_id: id of the executor job, read from request_json if not given
 
     """
     target_function_url = request_json['function_url_to_call']
-    current_datetime = datetime.now().isoformat()
+    current_datetime = datetime.now(timezone.utc).isoformat()
+    params_hash = await store_job_params(
+        {key: value for key, value in job_params_of(request_json).items() if key not in EXECUTION_REQUEST_FIELDS})
     status_to_error_code = {
         'success': '0',
         'started': '0',
         'failed_start': '1',
-        'failed': '2'
+        'failed': '2',
+        'cancelled': '3'
     }
     data = {
         'workflow_execution_id': request_json['execution_id'],
@@ -143,17 +234,49 @@ def log_step_bigquery(request_json, status):
         'job_status': status,
         'timestamp': current_datetime,
         'error_code': status_to_error_code.get(status, '2'),
-        'job_params': str(request_json),
+        'params_hash': params_hash,
+        'query_variables': json.dumps(request_json.get('query_variables')),
+        'async_job_id': async_job_id or request_json.get('async_job_id'),
         'log_path': get_cloud_logging_url(target_function_url),
-        'retry_count': 0  # TODO
+        'retry_count': retry_count.get(),
+        'schema_version': CONTROL_SCHEMA_VERSION
     }
 
-    workflows_control_table = bq_client.dataset(WORKFLOW_CONTROL_DATASET_ID).table(WORKFLOW_CONTROL_TABLE_ID)
-    errors = bq_client.insert_rows_json(workflows_control_table, [data])
-    if not errors:
-        print("New row has been added.")
-    else:
-        raise Exception("Encountered errors while inserting row: {}".format(errors))
+    await control_table_inserter.insert(data)
+    logger.debug("New row has been added with status %s.", status)
+
+
+def job_params_of(request_json):
+    """
+    Returns:
+        the step parameters of a request, without the fields changing between calls of the step
+    """
+    return {key: value for key, value in request_json.items() if key not in VOLATILE_REQUEST_FIELDS}
+
+
+async def store_job_params(job_params):
+    """
+    Stores step parameters in the job params dimension table, once per distinct content
+
+    Args:
+        job_params: dictionary of step parameters
+
+    Returns:
+        str: sha256 hash of the canonical JSON of the parameters, referenced by the control table rows
+    """
+    canonical_params = json.dumps(job_params, sort_keys=True, default=str)
+    params_hash = hashlib.sha256(canonical_params.encode("utf-8")).hexdigest()
+    if params_hash in stored_params_hashes:
+        return params_hash
+    row = {
+        'params_hash': params_hash,
+        'job_params': canonical_params,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+    # the hash as insert id lets bigquery drop the same params inserted concurrently by other requests
+    await job_params_inserter.insert(row, row_id=params_hash)
+    stored_params_hashes.add(params_hash)
+    return params_hash
 
 
 def get_cloud_logging_url(target_function_url):
@@ -194,22 +317,180 @@ def get_cloud_logging_url(target_function_url):
     base_url = "https://console.cloud.google.com/logs/query"
     query_params = f";query={encoded_filter}"
     log_url = f"{base_url}{query_params}"
-    print("Cloud Logging URL query:", log_url)
+    logger.debug("Cloud Logging URL query: %s", log_url)
     return log_url
 
 
-def call_custom_function(request_json, async_job_id):
+async def call_custom_function(request_json, async_job_id, params=None):
     """
     calls an executor function passed by parameter
 
     Args:
         request_json: json input object with parameters
         async_job_id: if filled, function ask by the execution status. if not, launches the execution for the first time
+        params: executor payload already built from request_json, built here if not given
 
     Returns:
         raise Exception if the word "exception" is found in message
         str: original message coming from executor functions
     """
+    params = params or executor_params(request_json, async_job_id)
+    target_function_url = request_json['function_url_to_call']
+    decoded_response = await call_executor(target_function_url, params, async_job_id)
+
+    final_response = ''
+    # Handle the response
+    if async_job_id is None and is_valid_step_id(decoded_response):
+        final_response = decoded_response
+    elif decoded_response in JobStatus.SUCCESS.value:
+        final_response = "success"
+        await log_step_bigquery(request_json, final_response)
+    elif decoded_response in JobStatus.RUNNING.value:
+        final_response = "running"
+    elif decoded_response in JobStatus.CANCELLED.value:
+        final_response = f"Exception calling target function {target_function_url.split('/')[-1]}:{decoded_response}"
+        await log_step_bigquery(request_json, "cancelled")
+    else:  # FAILURE
+        final_response = f"Exception calling target function {target_function_url.split('/')[-1]}:{decoded_response}"
+        await log_step_bigquery(request_json, "failed")
+    # running polls repeat every few seconds for the whole job, only a sample of them is logged
+    logger.info("final response: %s", final_response, extra={
+        "sample_key": poll_sample_key((request_json['execution_id'], request_json['job_name']), final_response)})
+    return final_response
+
+
+async def call_executor(target_function_url, params, async_job_id):
+    """
+    calls an executor in-process when it is co-located in this function, over HTTP otherwise
+
+    Args:
+        target_function_url: executor function URL
+        params: executor request payload
+        async_job_id: job id of the status and cancel calls, None for a launch
+
+    Returns:
+        str: executor response text
+    """
+    in_process_executor = get_executor(target_function_url)
+    try:
+        if in_process_executor:
+            return await call_executor_in_process(in_process_executor, target_function_url, params, async_job_id)
+        return await call_executor_http(target_function_url, params, async_job_id)
+    except (*RESPONSE_ERRORS, CircuitOpenError) as e:
+        logger.warning("Exception: %s", describe_error(e))
+        raise Exception(
+            "Unexpected error in custom function: " + target_function_url.split('/')[-1] + ":" + describe_error(e))
+
+
+async def cancel_step(request_json):
+    """
+    cancels the running job of a step through the cancel action of its executor, and records the step as
+    cancelled in the control table. A job that already finished is recorded with its final status instead.
+
+    Args:
+        request_json: step request with the async_job_id (or context handle) returned by get_id
+
+    Returns:
+        str: cancelled, success or failed
+    """
+    async_job_id = request_json.get('async_job_id')
+    if not async_job_id:
+        raise Exception("Job Id not received!")
+    if is_context_handle(async_job_id):
+        context = (await step_contexts.load(async_job_id))['context']
+        request_json = {**context['request'], 'async_job_id': context['async_job_id']}
+        async_job_id = context['async_job_id']
+    bind_fields(**{field: request_json.get(field) for field in ('execution_id', 'workflow_name', 'job_name',
+                                                                 'async_job_id')})
+    params = {**executor_params(request_json, async_job_id), 'action': 'cancel'}
+    response = evaluate_error(await call_executor(request_json['function_url_to_call'], params, async_job_id))
+    if response in JobStatus.SUCCESS.value:
+        status = 'success'
+    elif response in JobStatus.CANCELLED.value or response in JobStatus.RUNNING.value:
+        status = 'cancelled'
+    else:
+        status = 'failed'
+    await log_step_bigquery(request_json, status, async_job_id)
+    logger.info("cancel response: %s, step recorded as %s", response, status)
+    return status
+
+
+async def cancel_group(workflow_execution_id):
+    """
+    cancels in parallel every active step of a workflow execution, the steps started and not finished
+    according to the control table
+
+    Args:
+        workflow_execution_id: cloud workflows execution id
+
+    Returns:
+        dict: status of each cancelled step by job name, or the error that prevented its cancellation
+    """
+    steps = await asyncio.to_thread(get_active_steps, workflow_execution_id)
+    results = await asyncio.gather(
+        *(cancel_step({**step['job_params'], 'call_type': 'cancel', 'async_job_id': step['async_job_id']})
+          for step in steps),
+        return_exceptions=True)
+    cancelled = {}
+    for step, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.warning("Step %s could not be cancelled: %r", step['job_name'], result)
+            result = f"Error: {result}"
+        cancelled[step['job_name']] = result
+    logger.info("Cancelled %s active steps of execution %s", len(steps), workflow_execution_id,
+                extra={"fields": {"steps": cancelled}})
+    return cancelled
+
+
+@traced("bigquery.get_active_steps", "workflow_execution_id")
+@phase("bigquery_active_steps")
+def get_active_steps(workflow_execution_id):
+    """
+    reads the steps of a workflow execution whose last control table row is 'started', with their job params
+
+    Args:
+        workflow_execution_id: cloud workflows execution id
+
+    Returns:
+        list of dict with the job_name, async_job_id and job_params of each active step, the job params completed
+        with the execution id and query variables of the control row
+    """
+    query = f"""
+        SELECT step.job_name, step.async_job_id, TO_JSON_STRING(step.query_variables) AS query_variables,
+          TO_JSON_STRING(params.job_params) AS job_params
+        FROM (
+          SELECT job_name, job_status, async_job_id, params_hash, query_variables
+          FROM `{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_CONTROL_TABLE_ID}`
+          WHERE workflow_execution_id = @workflow_execution_id
+          QUALIFY ROW_NUMBER() OVER (PARTITION BY job_name ORDER BY timestamp DESC) = 1
+        ) AS step
+        JOIN (
+          SELECT params_hash, ANY_VALUE(job_params) AS job_params
+          FROM `{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_JOB_PARAMS_TABLE_ID}`
+          GROUP BY params_hash
+        ) AS params USING (params_hash)
+        WHERE step.job_status = 'started'
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("workflow_execution_id", "STRING", workflow_execution_id)
+    ])
+    return [{'job_name': row.job_name, 'async_job_id': row.async_job_id,
+             'job_params': {**json.loads(row.job_params), 'execution_id': workflow_execution_id,
+                            'query_variables': json.loads(row.query_variables or 'null')}}
+            for row in bq_client.query(query, job_config=job_config).result()]
+
+
+def executor_params(request_json, async_job_id):
+    """
+    builds the executor payload of a step, with its workflow and step properties merged
+
+    Args:
+        request_json: json input object with parameters
+        async_job_id: job id of the status calls, None for a launch
+
+    Returns:
+        dict: executor request payload
+    """
     workflow_name = request_json['workflow_name']
     job_name = request_json['job_name']
     workflow_properties = request_json.get('workflow_properties')
@@ -228,39 +509,81 @@ def call_custom_function(request_json, async_job_id):
 
     if async_job_id:
         params['job_id'] = async_job_id
+    return params
+
+
+async def call_executor_http(target_function_url, params, async_job_id):
+    """
+    calls a remote executor function with an ID token, over the connections kept by the instance.
+    Transient errors are retried with the policy of the call type, behind the circuit breaker of the executor.
+
+    Args:
+        target_function_url: executor function URL
+        params: executor request payload
+        async_job_id: job id of the status and cancel calls, None for a launch
+
+    Returns:
+        str: executor response text
+    """
+    with span("auth.fetch_id_token"), phase("auth"):
+        id_token = await fetch_id_token(target_function_url)
+
+    headers = {"Authorization": f"Bearer {id_token}", "Content-Type": "application/json"}
+    span_name = executor_span_name(params, async_job_id)
+
+    async def post():
+        with span(span_name, executor=target_function_url.split('/')[-1], async_job_id=async_job_id,
+                  dispatch="http"), phase("executor_http"):
+            session = await get_http_session()
+            async with session.post(target_function_url, data=json.dumps(params),
+                                    headers=inject_trace_context(dict(headers))) as response:
+                response.raise_for_status()
+                return await response.text()
+
+    response_text = await call_with_retry(post, "get_status" if async_job_id else "get_id", target_function_url)
+
+    logger.debug("response: %s", response_text)
+    return response_text
+
+
+async def call_executor_in_process(executor, target_function_url, params, async_job_id):
+    """
+    calls an executor co-located in this function, skipping the ID token fetch and the HTTP round trip.
+    Error statuses are retried with the policy of the call type, as over HTTP.
+
+    Args:
+        executor: in-process executor registered for target_function_url
+        target_function_url: executor function URL, used to name the executor in spans and errors
+        params: executor request payload
+        async_job_id: job id of the status and cancel calls, None for a launch
+
+    Returns:
+        str: executor response text
+    """
+    span_name = executor_span_name(params, async_job_id)
+    function_name = target_function_url.split('/')[-1]
+
+    async def call():
+        with span(span_name, executor=function_name, async_job_id=async_job_id, dispatch="in_process"), \
+                phase("executor_in_process"):
+            # executors are blocking code, run in a worker thread to keep the event loop serving other requests
+            return await run_blocking_executor(executor, params, inject_trace_context())
 
-    target_function_url = request_json['function_url_to_call']
     try:
-        req = urllib.request.Request(target_function_url, data=json.dumps(params).encode("utf-8"))
-
-        auth_req = google.auth.transport.requests.Request()
-        id_token = google.oauth2.id_token.fetch_id_token(auth_req, target_function_url)
-
-        req.add_header("Authorization", f"Bearer {id_token}")
-        req.add_header("Content-Type", "application/json")
-        response = urllib.request.urlopen(req)
-        response = response.read()
-
-        print('response: ' + str(response))
-        final_response = ''
-        # Handle the response
-        decoded_response = response.decode("utf-8")
-        if async_job_id is None and is_valid_step_id(decoded_response):
-            final_response = decoded_response
-        elif decoded_response in JobStatus.SUCCESS.value:
-            final_response = "success"
-            log_step_bigquery(request_json, final_response)
-        elif decoded_response in JobStatus.RUNNING.value:
-            final_response = "running"
-        else:  # FAILURE
-            final_response = f"Exception calling target function {target_function_url.split('/')[-1]}:{decoded_response}"
-            log_step_bigquery(request_json, "failed")
-        print("final response: " + final_response)
-        return final_response
-    except (urllib.error.HTTPError) as e:
-        print('Exception: ' + repr(e))
-        raise Exception(
-            "Unexpected error in custom function: " + target_function_url.split('/')[-1] + ":" + repr(e))
+        response = await call_with_retry(call, "get_status" if async_job_id else "get_id", target_function_url)
+    except (*RESPONSE_ERRORS, CircuitOpenError):
+        raise
+    except Exception as e:
+        logger.warning("Exception: %r", e)
+        raise Exception("Unexpected error in custom function: " + function_name + ":" + repr(e))
+    logger.debug("response: %s", response)
+    return response
+
+
+def executor_span_name(params, async_job_id):
+    if params.get('action') == 'cancel':
+        return "executor.cancel"
+    return "executor.get_status" if async_job_id else "executor.launch"
 
 
 def join_properties(workflow_properties, step_properties):
@@ -0,0 +1,231 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+from structured_log import get_logger
+
+# launches are only retried when the request did not reach the executor, a retried status poll is harmless
+DEFAULT_RETRY_POLICIES = {
+    'get_id': {
+        'max_attempts': 3,
+        'initial_backoff_seconds': 1,
+        'max_backoff_seconds': 10,
+        'multiplier': 2,
+        'retryable_statuses': [429, 503],
+        'connection_errors': 'connect'
+    },
+    'get_status': {
+        'max_attempts': 5,
+        'initial_backoff_seconds': 0.5,
+        'max_backoff_seconds': 8,
+        'multiplier': 2,
+        'retryable_statuses': [429, 500, 502, 503, 504],
+        'connection_errors': 'all'
+    }
+}
+# per call type overrides of the default policies, as JSON: {"get_status": {"max_attempts": 8}}
+RETRY_POLICIES = os.environ.get('RETRY_POLICIES', '{}')
+# consecutive failed calls to an executor opening its circuit
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+# seconds an open circuit fails fast before letting a trial call through
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_RESET_SECONDS', 30))
+
+logger = get_logger('intermediate')
+# retries done by the current request, recorded in the control table
+retry_count = contextvars.ContextVar('retry_count', default=0)
+circuit_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling an executor whose circuit is open
+    """
+
+
+class ExecutorResponseError(Exception):
+    """
+    HTTP error status answered by a co-located executor, the in-process counterpart of aiohttp.ClientResponseError
+    """
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+# error statuses answered by an executor, over HTTP or in-process
+RESPONSE_ERRORS = (aiohttp.ClientResponseError, ExecutorResponseError)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time between 0 and
+    min(max_backoff_seconds, initial_backoff_seconds * multiplier ** (n - 1))
+    """
+
+    def __init__(self, max_attempts, initial_backoff_seconds, max_backoff_seconds, multiplier, retryable_statuses,
+                 connection_errors='all'):
+        self.max_attempts = max_attempts
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.multiplier = multiplier
+        self.retryable_statuses = set(retryable_statuses)
+        # 'connect' retries only the connections that could not be established, 'all' any unanswered request
+        self.connection_errors = connection_errors
+
+    def is_retryable(self, error):
+        if isinstance(error, RESPONSE_ERRORS):
+            return error.status in self.retryable_statuses
+        if self.connection_errors == 'connect':
+            # a reset or timed out request may have reached the executor and started a job, retrying it would
+            # start a duplicate
+            return isinstance(error, aiohttp.ClientConnectorError)
+        # the request was not answered, connection refused or reset, or timed out
+        return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+    def backoff_seconds(self, retry, error=None):
+        ceiling = min(self.max_backoff_seconds, self.initial_backoff_seconds * self.multiplier ** (retry - 1))
+        backoff = random.uniform(0, ceiling)
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_backoff_seconds))
+        return backoff
+
+
+def describe_error(error):
+    """
+    Short description of a call error. The repr of aiohttp response errors holds the request headers, including
+    the ID token, it is never logged nor returned.
+    """
+    if isinstance(error, RESPONSE_ERRORS):
+        return f"HTTPError({error.status}, {error.message!r})"
+    return repr(error)
+
+
+def retry_after_seconds(error):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def load_retry_policies(overrides=RETRY_POLICIES):
+    """
+    Returns:
+        dict of RetryPolicy by call type, the defaults updated with the RETRY_POLICIES overrides
+    """
+    overrides = json.loads(overrides) if isinstance(overrides, str) else overrides
+    return {call_type: RetryPolicy(**{**policy, **overrides.get(call_type, {})})
+            for call_type, policy in DEFAULT_RETRY_POLICIES.items()}
+
+
+retry_policies = load_retry_policies()
+
+
+class CircuitBreaker:
+    """
+    Per executor circuit breaker, shared by the requests of the instance. Closed, calls go through; open after
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive failures, calls fail fast for CIRCUIT_BREAKER_RESET_SECONDS;
+    then half open, a single trial call closes it again on success or reopens it on failure.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < CIRCUIT_BREAKER_RESET_SECONDS:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self):
+        state = self.state
+        if state == 'open' or (state == 'half_open' and self.trial_in_flight):
+            raise CircuitOpenError(f"Circuit open for {self.name} after {self.failures} consecutive failures")
+        self.trial_in_flight = state == 'half_open'
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit closed for %s", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        reopen = self.trial_in_flight
+        self.trial_in_flight = False
+        if reopen or (self.opened_at is None and self.failures >= CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+            self.opened_at = time.monotonic()
+            logger.warning("Circuit opened for %s after %s consecutive failures", self.name, self.failures)
+
+
+def get_circuit_breaker(name):
+    circuit_breaker = circuit_breakers.get(name)
+    if circuit_breaker is None:
+        circuit_breaker = circuit_breakers[name] = CircuitBreaker(name)
+    return circuit_breaker
+
+
+async def call_with_retry(call, call_type, circuit_name):
+    """
+    Awaits call() under the retry policy of the call type and the circuit breaker of circuit_name.
+    The retries done are added to the retry_count of the request.
+
+    Args:
+        call: coroutine function doing one attempt
+        call_type: get_id or get_status, selects the retry policy
+        circuit_name: executor URL, one circuit per executor
+
+    Returns:
+        the result of the first successful attempt, the last error is raised once the attempts are exhausted
+    """
+    policy = retry_policies[call_type]
+    circuit_breaker = get_circuit_breaker(circuit_name)
+    attempt = 1
+    while True:
+        circuit_breaker.before_call()
+        try:
+            result = await call()
+        except Exception as ex:
+            # a throttled executor is up, only server and connection errors count as failures
+            if not (isinstance(ex, RESPONSE_ERRORS) and ex.status < 500):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+            if attempt >= policy.max_attempts or not policy.is_retryable(ex):
+                raise
+            backoff = policy.backoff_seconds(attempt, ex)
+            logger.warning("Attempt %s of %s to %s failed, retrying in %.2fs: %s",
+                           attempt, policy.max_attempts, circuit_name, backoff, describe_error(ex))
+            await asyncio.sleep(backoff)
+            attempt += 1
+            retry_count.set(retry_count.get() + 1)
+            continue
+        circuit_breaker.record_success()
+        return result
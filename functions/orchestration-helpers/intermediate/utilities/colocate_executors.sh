@@ -0,0 +1,66 @@
+#!/bin/bash
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds the intermediate function bundle with executors co-located in it, called in-process instead of over HTTP.
+# Each executor main.py is copied under executors/<executor_name with underscores>/ and its requirements merged.
+# The executors share the tracing, profiling and logging helpers of the intermediate function, their other helper
+# modules are copied next to them.
+# Run it before terraform apply with the same executors as the co_located_executors variable.
+
+output_directory=$1
+shift
+executor_names=("$@")
+
+if [ -z "$output_directory" ] || [ ${#executor_names[@]} -eq 0 ]; then
+  echo "Usage: $0 <output_directory> <executor_name> [<executor_name>...]"
+  echo "Example: $0 build/intermediate bq-saved-query-executor dataform-tag-executor"
+  exit 1
+fi
+
+intermediate_directory=$(cd "$(dirname "$0")/.." && pwd)
+engines_directory=$(cd "$intermediate_directory/../../data-processing-engines" && pwd)
+
+rm -rf "$output_directory"
+mkdir -p "$output_directory/executors"
+cp "$intermediate_directory"/*.py "$intermediate_directory/requirements.txt" "$output_directory/"
+sed -i -e '$a\' "$output_directory/requirements.txt"
+touch "$output_directory/executors/__init__.py"
+
+for executor_name in "${executor_names[@]}"; do
+  executor_directory="$engines_directory/$executor_name"
+  if [ ! -f "$executor_directory/main.py" ]; then
+    echo "Executor $executor_name not found in $engines_directory"
+    exit 1
+  fi
+  package_directory="$output_directory/executors/${executor_name//-/_}"
+  mkdir -p "$package_directory"
+  touch "$package_directory/__init__.py"
+  cp "$executor_directory/main.py" "$package_directory/main.py"
+  # helper modules of the executors the intermediate function does not have, eg. rate_limit.py
+  for module in "$executor_directory"/*.py; do
+    if [ ! -f "$output_directory/$(basename "$module")" ]; then
+      cp "$module" "$output_directory/"
+    fi
+  done
+
+  # requirements not already listed by the intermediate function, pinned versions of the intermediate win
+  while read -r requirement || [ -n "$requirement" ]; do
+    package_name=$(echo "$requirement" | sed 's/[<>=!~ ].*//')
+    if [ -n "$package_name" ] && ! grep -qi "^$package_name\([<>=!~ ]\|$\)" "$output_directory/requirements.txt"; then
+      echo "$requirement" >> "$output_directory/requirements.txt"
+    fi
+  done < "$executor_directory/requirements.txt"
+  echo "Co-located $executor_name"
+done
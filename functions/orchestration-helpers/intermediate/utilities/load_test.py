@@ -0,0 +1,128 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse, asyncio, json, logging, subprocess, time
+from collections import Counter
+
+import aiohttp
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def main(args, loglevel):
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=loglevel)
+    token = args.token or subprocess.run(["gcloud", "auth", "print-identity-token"],
+                                         capture_output=True, text=True, check=True).stdout.strip()
+    report = asyncio.run(run_load(args, token))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+async def run_load(args, token):
+    """
+    sends args.requests get_status polls to the intermediate function, args.concurrency at a time
+
+    Returns:
+        dict with the throughput, latency percentiles, errors and the requests served by each instance
+    """
+    payload = {
+        "call_type": "get_status",
+        "workflow_name": args.workflow_name,
+        "job_name": args.job_name,
+        "async_job_id": args.async_job_id,
+        "function_url_to_call": args.function_url_to_call,
+        "query_variables": {"start_date": args.start_date, "end_date": args.end_date},
+        "workflow_properties": json.loads(args.workflow_properties)
+    }
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    latencies, errors, instances = [], Counter(), Counter()
+    next_request = iter(range(args.requests))
+
+    async def worker(session):
+        for index in next_request:
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, json={**payload, "execution_id": f"load-test-{index}"},
+                                        headers=headers) as response:
+                    body = await response.text()
+                    instances[response.headers.get("X-Instance-Id", "unknown")] += 1
+                    if response.status != 200:
+                        errors[f"HTTP {response.status}"] += 1
+                        logging.debug(f"HTTP {response.status}: {body}")
+            except Exception as ex:
+                errors[type(ex).__name__] += 1
+                logging.debug(repr(ex))
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    report = {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": dict(errors),
+        "instances": len(instances),
+        "requests_per_instance": dict(instances.most_common())
+    }
+    for rank in PERCENTILES:
+        report[f"p{rank}_ms"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * rank / 100))] * 1000, 1)
+    return report
+
+
+def print_report(report):
+    print(f"{report['requests']} requests, {report['concurrency']} concurrent, {report['elapsed_seconds']}s, "
+          f"{report['requests_per_second']} requests/s")
+    print("latency ms: " + ", ".join(f"p{rank} {report[f'p{rank}_ms']}" for rank in PERCENTILES))
+    print(f"errors: {report['errors'] or 'none'}")
+    print(f"instances: {report['instances']}")
+    for instance_id, count in report["requests_per_instance"].items():
+        print(f"  {instance_id:<20} {count:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = "Load test of the intermediate function: concurrent get_status polls of a running job. "
+                      "Counts the instances serving them from the X-Instance-Id response header.",
+        fromfile_prefix_chars = '@' )
+    parser.add_argument("--url",help="intermediate function URL", required=True)
+    parser.add_argument("--function_url_to_call",help="executor function URL polled by the intermediate", required=True)
+    parser.add_argument("--async_job_id",help="id of a running job of that executor", required=True)
+    parser.add_argument("--workflow_properties",help="workflow properties of the job, as JSON", default="{}")
+    parser.add_argument("--workflow_name",help="workflow name sent in the polls", default="load_test")
+    parser.add_argument("--job_name",help="job name sent in the polls", default="load_test")
+    parser.add_argument("--start_date",help="start date query variable", default="2025-01-01")
+    parser.add_argument("--end_date",help="end date query variable", default="2025-01-01")
+    parser.add_argument("--requests",help="total number of polls", type=int, default=3000)
+    parser.add_argument("--concurrency",help="polls in flight at any time", type=int, default=300)
+    parser.add_argument("--token",help="identity token, gcloud auth print-identity-token by default")
+    parser.add_argument("--json",help="print the report as json", action="store_true")
+    parser.add_argument("-v","--verbose",help="increase output verbosity", action="store_true")
+    args, unknown = parser.parse_known_args()
+
+    # Setup logging
+    if args.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+
+    main(args, loglevel)
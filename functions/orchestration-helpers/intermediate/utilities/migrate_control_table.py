@@ -0,0 +1,149 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse, ast, hashlib, json, logging
+
+from google.cloud import bigquery
+
+LEGACY_TABLE_DEFAULT_NAME = "workflows_control"
+CONTROL_TABLE_DEFAULT_NAME = "workflows_control_v2"
+JOB_PARAMS_TABLE_DEFAULT_NAME = "workflows_job_params"
+CONTROL_SCHEMA_VERSION = 2
+VOLATILE_REQUEST_FIELDS = ('call_type', 'async_job_id')
+EXECUTION_REQUEST_FIELDS = ('execution_id', 'query_variables')
+INSERT_BATCH_SIZE = 500
+
+
+def main(args, loglevel):
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=loglevel)
+    client = bigquery.Client(project=args.gcp_project)
+    dataset = f"{args.gcp_project}.{args.dataset}"
+    query = f"SELECT * FROM `{dataset}.{args.legacy_table}`"
+    if args.since:
+        query += f" WHERE timestamp >= DATETIME '{args.since}'"
+
+    control_rows, job_params_rows = [], {}
+    for row in client.query(query).result():
+        control_row, params_row = convert_row(dict(row.items()))
+        control_rows.append(control_row)
+        if params_row:
+            job_params_rows[params_row['params_hash']] = params_row
+    logging.info(f"{len(control_rows)} control rows and {len(job_params_rows)} distinct job params to migrate")
+
+    if args.dry_run:
+        for control_row in control_rows[:10]:
+            print(control_row)
+        return
+    insert_rows(client, f"{dataset}.{args.job_params_table}", list(job_params_rows.values()),
+                [row['params_hash'] for row in job_params_rows.values()])
+    insert_rows(client, f"{dataset}.{args.control_table}", control_rows)
+
+
+def convert_row(legacy_row):
+    """
+    converts a legacy control row into a v2 control row and its job params dimension row
+
+    Args:
+        legacy_row: dictionary with the legacy workflows_control columns
+
+    Returns:
+        (v2 control row, job params row or None when the legacy row has no readable params)
+    """
+    job_params = parse_job_params(legacy_row.get('job_params'))
+    params_row, params_hash = None, None
+    if isinstance(job_params, dict) and 'function_url_to_call' in job_params:
+        # step row logged by the intermediate function, same hashing as log_step_bigquery
+        stored_params = {key: value for key, value in job_params.items()
+                         if key not in VOLATILE_REQUEST_FIELDS + EXECUTION_REQUEST_FIELDS}
+        canonical_params = json.dumps(stored_params, sort_keys=True, default=str)
+        params_hash = hashlib.sha256(canonical_params.encode("utf-8")).hexdigest()
+        params_row = {'params_hash': params_hash, 'job_params': canonical_params,
+                      'created_at': to_utc_timestamp(legacy_row.get('timestamp'))}
+        query_variables = job_params.get('query_variables')
+        async_job_id = job_params.get('async_job_id')
+    else:
+        # backfill rows and unreadable params keep their raw content as query variables
+        query_variables = job_params
+        async_job_id = None
+    control_row = {
+        'workflow_execution_id': legacy_row.get('workflow_execution_id'),
+        'workflow_name': legacy_row.get('workflow_name'),
+        'job_name': legacy_row.get('job_name'),
+        'job_status': legacy_row.get('job_status'),
+        'timestamp': to_utc_timestamp(legacy_row.get('timestamp')),
+        'error_code': legacy_row.get('error_code'),
+        'params_hash': params_hash,
+        'query_variables': json.dumps(query_variables, default=str),
+        'async_job_id': async_job_id,
+        'log_path': legacy_row.get('log_path'),
+        'retry_count': legacy_row.get('retry_count'),
+        'schema_version': CONTROL_SCHEMA_VERSION
+    }
+    return control_row, params_row
+
+
+def parse_job_params(raw_job_params):
+    """
+    reads the legacy job_params column, written either as JSON or as a python dict representation
+    """
+    if not raw_job_params:
+        return None
+    try:
+        return json.loads(raw_job_params)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(raw_job_params)
+    except (ValueError, SyntaxError):
+        return raw_job_params
+
+
+def to_utc_timestamp(value):
+    """
+    legacy timestamps are DATETIME values written by the functions in UTC
+    """
+    return f"{value.isoformat()}+00:00" if value is not None and value.tzinfo is None else str(value)
+
+
+def insert_rows(client, table_id, rows, row_ids=None):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch_ids = row_ids[start:start + INSERT_BATCH_SIZE] if row_ids else None
+        errors = client.insert_rows_json(table_id, rows[start:start + INSERT_BATCH_SIZE], row_ids=batch_ids)
+        if errors:
+            raise Exception(f"Encountered errors while inserting rows in {table_id}: {errors}")
+    logging.info(f"{len(rows)} rows inserted in {table_id}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = "Copies the legacy workflows_control table into the compact v2 control table.",
+        fromfile_prefix_chars = '@' )
+    parser.add_argument("--gcp_project",help="gcp project containing the control tables", required=True)
+    parser.add_argument("--dataset",help="dataset containing the control tables", default="aef_orch_framework")
+    parser.add_argument("--legacy_table",help="legacy control table name", default=LEGACY_TABLE_DEFAULT_NAME)
+    parser.add_argument("--control_table",help="v2 control table name", default=CONTROL_TABLE_DEFAULT_NAME)
+    parser.add_argument("--job_params_table",help="job params table name", default=JOB_PARAMS_TABLE_DEFAULT_NAME)
+    parser.add_argument("--since",help="only migrate rows logged from this datetime (eg. '2025-01-01 00:00:00')")
+    parser.add_argument("--dry_run",help="print the converted rows without inserting them", action="store_true")
+    parser.add_argument("-v","--verbose",help="increase output verbosity", action="store_true")
+    args, unknown = parser.parse_known_args()
+
+    # Setup logging
+    if args.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+
+    main(args, loglevel)
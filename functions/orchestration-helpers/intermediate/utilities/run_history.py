@@ -0,0 +1,314 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse, csv, json, logging
+from collections import defaultdict
+from datetime import datetime, timezone
+
+CONTROL_TABLE_DEFAULT_NAME = "workflows_control_v2"
+# rows ending a step run, only 'success' runs are successful. As in the watchdog, a cancelled step is no longer
+# open and is left out of the duration history
+TERMINAL_STATUSES = ("success", "failed", "cancelled")
+PERCENTILES = (50, 90, 95, 99)
+# polling interval of the workflows steps calling get_status, a finished job is seen on average half of it late
+DEFAULT_POLL_INTERVAL_SECONDS = 60
+
+
+def main(args, loglevel):
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=loglevel)
+    if args.input:
+        events = load_events_file(args.input)
+    else:
+        events = load_events_bigquery(args.gcp_project, args.dataset, args.table, args.days)
+    if args.workflow_name:
+        events = [event for event in events if event['workflow_name'] == args.workflow_name]
+    runs = pair_step_runs(events)
+    logging.info(f"{len(events)} control rows, {len(runs)} step runs")
+
+    report = {
+        "jobs": job_duration_stats(runs),
+        "executions": [critical_path(execution_runs, args.poll_interval_seconds)
+                       for execution_runs in group_by_execution(runs).values()]
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+def load_events_file(path):
+    """
+    reads control table rows exported to a local CSV or Parquet file
+
+    Args:
+        path: file path, the format is taken from the extension. Parquet files need pyarrow installed.
+
+    Returns:
+        list of normalized control events
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("pyarrow is needed to read parquet files: pip install pyarrow")
+        rows = pq.read_table(path).to_pylist()
+    else:
+        with open(path, newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+    return [normalize_event(row) for row in rows]
+
+
+def load_events_bigquery(gcp_project, dataset, table, days):
+    """
+    reads the control rows of the last days straight from BigQuery
+    """
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=gcp_project)
+    query = f"""
+        SELECT workflow_execution_id, workflow_name, job_name, job_status, timestamp
+        FROM `{gcp_project}.{dataset}.{table}`
+        WHERE timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(days)} DAY)
+    """
+    return [normalize_event(dict(row.items())) for row in client.query(query).result()]
+
+
+def normalize_event(row):
+    """
+    keeps the columns used by the analytics and parses the timestamp as an aware UTC datetime.
+    Works on v2 TIMESTAMP values and on legacy DATETIME values, written in UTC.
+    """
+    return {
+        "workflow_execution_id": row.get("workflow_execution_id"),
+        "workflow_name": row.get("workflow_name"),
+        "job_name": row.get("job_name"),
+        "job_status": row.get("job_status"),
+        "timestamp": parse_timestamp(row.get("timestamp"))
+    }
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        timestamp = value
+    else:
+        text = str(value).strip().replace(" UTC", "+00:00").replace("Z", "+00:00")
+        timestamp = datetime.fromisoformat(text.replace(" ", "T", 1))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def pair_step_runs(events):
+    """
+    pairs each 'started' row with the next terminal row of the same job in the same workflow execution.
+    A job retried inside one execution gives one run per attempt, 'failed_start' rows give zero length runs.
+    Cancelled runs end at their 'cancelled' row and count as failures.
+
+    Args:
+        events: normalized control events, in any order
+
+    Returns:
+        list of step runs with start, end, final status and duration in seconds. Runs still going on are left out.
+    """
+    events_by_step = defaultdict(list)
+    for event in events:
+        if event["workflow_execution_id"] and event["job_name"]:
+            events_by_step[(event["workflow_execution_id"], event["job_name"])].append(event)
+
+    runs = []
+    for (execution_id, job_name), step_events in events_by_step.items():
+        started = None
+        for event in sorted(step_events, key=lambda step_event: step_event["timestamp"]):
+            if event["job_status"] == "started":
+                started = event
+            elif event["job_status"] == "failed_start":
+                runs.append(build_run(event, event, "failed_start"))
+                started = None
+            elif event["job_status"] in TERMINAL_STATUSES and started:
+                runs.append(build_run(started, event, event["job_status"]))
+                started = None
+    return runs
+
+
+def build_run(start_event, end_event, status):
+    return {
+        "workflow_execution_id": start_event["workflow_execution_id"],
+        "workflow_name": start_event["workflow_name"],
+        "job_name": start_event["job_name"],
+        "started_at": start_event["timestamp"],
+        "ended_at": end_event["timestamp"],
+        "status": status,
+        "duration_seconds": (end_event["timestamp"] - start_event["timestamp"]).total_seconds()
+    }
+
+
+def job_duration_stats(runs):
+    """
+    computes duration percentiles and trend of the successful runs of each job
+
+    Args:
+        runs: step runs as returned by pair_step_runs
+
+    Returns:
+        list of per job statistics, slowest median first. The trend is the least squares slope of the
+        duration over time, in seconds gained (or lost when negative) per day.
+    """
+    runs_by_job = defaultdict(list)
+    for run in runs:
+        runs_by_job[(run["workflow_name"], run["job_name"])].append(run)
+
+    stats = []
+    for (workflow_name, job_name), job_runs in runs_by_job.items():
+        succeeded = sorted((run for run in job_runs if run["status"] == "success"), key=lambda run: run["started_at"])
+        durations = sorted(run["duration_seconds"] for run in succeeded)
+        job_stats = {
+            "workflow_name": workflow_name,
+            "job_name": job_name,
+            "runs": len(job_runs),
+            "failures": len(job_runs) - len(succeeded),
+            "max_seconds": durations[-1] if durations else None,
+            "trend_seconds_per_day": trend_per_day(
+                [(run["started_at"].timestamp() / 86400, run["duration_seconds"]) for run in succeeded])
+        }
+        for percentile_rank in PERCENTILES:
+            job_stats[f"p{percentile_rank}_seconds"] = percentile(durations, percentile_rank)
+        stats.append(job_stats)
+    return sorted(stats, key=lambda job_stats: job_stats["p50_seconds"] or 0, reverse=True)
+
+
+def percentile(sorted_values, rank):
+    """
+    percentile with linear interpolation between the closest ranks, None for no values
+    """
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * rank / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def trend_per_day(points):
+    """
+    least squares slope of (day, duration) points, None when there are less than two distinct days
+    """
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def group_by_execution(runs):
+    runs_by_execution = defaultdict(list)
+    for run in runs:
+        runs_by_execution[run["workflow_execution_id"]].append(run)
+    return runs_by_execution
+
+
+def critical_path(execution_runs, poll_interval_seconds=DEFAULT_POLL_INTERVAL_SECONDS):
+    """
+    reconstructs the chain of steps gating one workflow execution. The control table has no step
+    dependencies, so the path is walked back from the last finished step, taking each time the step that
+    finished last before the current one started as its predecessor.
+
+    Args:
+        execution_runs: step runs of a single workflow execution
+        poll_interval_seconds: polling interval of the workflows steps waiting on asynchronous jobs
+
+    Returns:
+        dict with the steps of the path and the split of its wall time:
+            run_seconds: time spent inside the steps of the path
+            queue_seconds: gaps between the steps of the path, where nothing of the path was running
+            poll_overhead_seconds: estimated part of run_seconds spent waiting for the next status poll
+    """
+    runs = sorted(execution_runs, key=lambda run: run["ended_at"])
+    index = len(runs) - 1
+    path = [runs[index]]
+    while True:
+        # only runs sorted before the current one, so that zero length runs can not chain back to each other
+        predecessors = [position for position in range(index)
+                        if runs[position]["ended_at"] <= runs[index]["started_at"]]
+        if not predecessors:
+            break
+        index = predecessors[-1]
+        path.append(runs[index])
+    path.reverse()
+
+    run_seconds = sum(run["duration_seconds"] for run in path)
+    total_seconds = (path[-1]["ended_at"] - path[0]["started_at"]).total_seconds()
+    polled_steps = sum(1 for run in path if run["status"] in TERMINAL_STATUSES)
+    poll_overhead_seconds = min(run_seconds, polled_steps * poll_interval_seconds / 2)
+    return {
+        "workflow_execution_id": path[0]["workflow_execution_id"],
+        "workflow_name": path[0]["workflow_name"],
+        "started_at": path[0]["started_at"],
+        "total_seconds": total_seconds,
+        "run_seconds": run_seconds - poll_overhead_seconds,
+        "queue_seconds": total_seconds - run_seconds,
+        "poll_overhead_seconds": poll_overhead_seconds,
+        "critical_path": [run["job_name"] for run in path]
+    }
+
+
+def print_report(report):
+    print("Step durations (successful runs, seconds)")
+    print(f"{'workflow':<30} {'job':<30} {'runs':>5} {'fail':>5} {'p50':>9} {'p90':>9} {'p99':>9} {'trend/day':>10}")
+    for job_stats in report["jobs"]:
+        print(f"{job_stats['workflow_name'] or '':<30} {job_stats['job_name']:<30} {job_stats['runs']:>5} "
+              f"{job_stats['failures']:>5} {format_seconds(job_stats['p50_seconds']):>9} "
+              f"{format_seconds(job_stats['p90_seconds']):>9} {format_seconds(job_stats['p99_seconds']):>9} "
+              f"{format_seconds(job_stats['trend_seconds_per_day']):>10}")
+    print()
+    print("Critical paths (seconds)")
+    print(f"{'execution':<40} {'total':>9} {'run':>9} {'queue':>9} {'poll':>9}  path")
+    for execution in sorted(report["executions"], key=lambda execution: execution["started_at"]):
+        print(f"{execution['workflow_execution_id']:<40} {format_seconds(execution['total_seconds']):>9} "
+              f"{format_seconds(execution['run_seconds']):>9} {format_seconds(execution['queue_seconds']):>9} "
+              f"{format_seconds(execution['poll_overhead_seconds']):>9}  {' > '.join(execution['critical_path'])}")
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = "Step duration and critical path analytics over the workflows control table.",
+        fromfile_prefix_chars = '@' )
+    parser.add_argument("--input",help="control table export to analyze offline, .csv or .parquet (needs pyarrow)")
+    parser.add_argument("--gcp_project",help="gcp project containing the control table, when no --input is given")
+    parser.add_argument("--dataset",help="dataset containing the control table", default="aef_orch_framework")
+    parser.add_argument("--table",help="control table name", default=CONTROL_TABLE_DEFAULT_NAME)
+    parser.add_argument("--days",help="days of history read from bigquery", type=int, default=30)
+    parser.add_argument("--workflow_name",help="only analyze this workflow")
+    parser.add_argument("--poll_interval_seconds",help="polling interval of the workflows status steps",
+                        type=float, default=DEFAULT_POLL_INTERVAL_SECONDS)
+    parser.add_argument("--json",help="print the report as json", action="store_true")
+    parser.add_argument("-v","--verbose",help="increase output verbosity", action="store_true")
+    args, unknown = parser.parse_known_args()
+    if not args.input and not args.gcp_project:
+        parser.error("either --input or --gcp_project is required")
+
+    # Setup logging
+    if args.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+
+    main(args, loglevel)
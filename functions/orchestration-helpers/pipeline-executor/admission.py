@@ -0,0 +1,191 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+import uuid
+
+# queued requests are released in this order
+PRIORITY_CLASSES = {"HIGH": 0, "NORMAL": 1, "LOW": 2}
+# a slot never assigned to an execution (e.g. the launch crashed) is released after this many seconds
+UNASSIGNED_SLOT_TIMEOUT_SECONDS = 600
+
+
+class AdmissionContention(Exception):
+    """
+    Raised when a slot could not be acquired because concurrent requests kept conflicting on the store
+    """
+
+
+def has_capacity(slots, workflow_name, global_limit, workflow_limit):
+    """
+    checks if a new execution of a workflow fits within the global and per workflow concurrency limits
+
+    Args:
+        slots: dictionary of slot id to slot, as returned by the stores
+        workflow_name: name of the cloud workflows to launch
+        global_limit: maximum number of concurrent executions, 0 for no limit
+        workflow_limit: maximum number of concurrent executions of the same workflow, 0 for no limit
+
+    Returns:
+        True if a slot can be acquired
+    """
+    if global_limit and len(slots) >= global_limit:
+        return False
+    running = sum(1 for slot in slots.values() if slot["workflow_name"] == workflow_name)
+    return not (workflow_limit and running >= workflow_limit)
+
+
+def new_slot(workflow_name):
+    return str(uuid.uuid4()), {"workflow_name": workflow_name, "execution_name": None, "acquired_at": time.time()}
+
+
+def priority_rank(priority):
+    """returns the rank of a priority class, lower ranks are released first"""
+    return PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES["NORMAL"])
+
+
+def new_queue_entry(event, priority):
+    return str(uuid.uuid4()), {
+        "priority": priority_rank(priority),
+        "enqueued_at": time.time(),
+        "event": event
+    }
+
+
+class InMemoryAdmissionStore:
+    """
+    Admission store kept in process memory. Used for tests and single instance deployments.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slot_map = {}
+        self.queue = {}
+        self.dead_letters = {}
+
+    def try_acquire(self, workflow_name, global_limit, workflow_limit):
+        with self.lock:
+            if not has_capacity(self.slot_map, workflow_name, global_limit, workflow_limit):
+                return None
+            slot_id, slot = new_slot(workflow_name)
+            self.slot_map[slot_id] = slot
+            return slot_id
+
+    def assign(self, slot_id, execution_name):
+        with self.lock:
+            self.slot_map[slot_id]["execution_name"] = execution_name
+
+    def release(self, slot_id):
+        with self.lock:
+            self.slot_map.pop(slot_id, None)
+
+    def slots(self):
+        with self.lock:
+            return {slot_id: dict(slot) for slot_id, slot in self.slot_map.items()}
+
+    def enqueue(self, event, priority):
+        entry_id, entry = new_queue_entry(event, priority)
+        with self.lock:
+            self.queue[entry_id] = entry
+        return entry_id
+
+    def queued(self):
+        with self.lock:
+            return sorted(self.queue.items(), key=lambda item: (item[1]["priority"], item[1]["enqueued_at"]))
+
+    def head(self):
+        queued = self.queued()
+        return queued[0] if queued else None
+
+    def dequeue(self, entry_id):
+        with self.lock:
+            self.queue.pop(entry_id, None)
+
+    def record_failure(self, entry_id, attempts, error):
+        with self.lock:
+            self.queue[entry_id].update({"attempts": attempts, "last_error": error})
+
+    def dead_letter(self, entry_id, entry):
+        with self.lock:
+            self.queue.pop(entry_id, None)
+            self.dead_letters[entry_id] = {**entry, "dead_lettered_at": time.time()}
+
+
+class FirestoreAdmissionStore:
+    """
+    Admission store shared by every pipeline executor instance. Running slots live in a single semaphore
+    document updated in transactions, queued requests are one document each in a queue collection. Queued
+    requests that keep failing to launch are moved to a dead letter collection.
+    """
+
+    def __init__(self, firestore_client, collection):
+        from google.cloud import firestore
+        self.firestore = firestore
+        self.client = firestore_client
+        self.semaphore_ref = firestore_client.collection(collection).document("semaphore")
+        self.queue_collection = firestore_client.collection(f"{collection}_queue")
+        self.dead_letter_collection = firestore_client.collection(f"{collection}_dead_letter")
+
+    def try_acquire(self, workflow_name, global_limit, workflow_limit):
+        from google.api_core import exceptions
+
+        @self.firestore.transactional
+        def acquire(transaction):
+            snapshot = self.semaphore_ref.get(transaction=transaction)
+            slots = (snapshot.to_dict() or {}).get("slots", {}) if snapshot.exists else {}
+            if not has_capacity(slots, workflow_name, global_limit, workflow_limit):
+                return None
+            slot_id, slot = new_slot(workflow_name)
+            transaction.set(self.semaphore_ref, {"slots": {slot_id: slot}}, merge=True)
+            return slot_id
+        try:
+            return acquire(self.client.transaction())
+        except (ValueError, exceptions.Aborted, exceptions.Conflict) as ex:
+            # the client gives up with a ValueError once its commit attempts on the semaphore are exhausted
+            raise AdmissionContention(f"Semaphore contended, no slot acquired: {ex!r}") from ex
+
+    def assign(self, slot_id, execution_name):
+        self.semaphore_ref.update({f"slots.`{slot_id}`.execution_name": execution_name})
+
+    def release(self, slot_id):
+        self.semaphore_ref.update({f"slots.`{slot_id}`": self.firestore.DELETE_FIELD})
+
+    def slots(self):
+        snapshot = self.semaphore_ref.get()
+        return (snapshot.to_dict() or {}).get("slots", {}) if snapshot.exists else {}
+
+    def enqueue(self, event, priority):
+        entry_id, entry = new_queue_entry(event, priority)
+        self.queue_collection.document(entry_id).set(entry)
+        return entry_id
+
+    def queued(self):
+        query = self.queue_collection.order_by("priority").order_by("enqueued_at")
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def head(self):
+        query = self.queue_collection.order_by("priority").order_by("enqueued_at").limit(1)
+        return next(((doc.id, doc.to_dict()) for doc in query.stream()), None)
+
+    def dequeue(self, entry_id):
+        self.queue_collection.document(entry_id).delete()
+
+    def record_failure(self, entry_id, attempts, error):
+        self.queue_collection.document(entry_id).update({"attempts": attempts, "last_error": error})
+
+    def dead_letter(self, entry_id, entry):
+        batch = self.client.batch()
+        batch.set(self.dead_letter_collection.document(entry_id), {**entry, "dead_lettered_at": time.time()})
+        batch.delete(self.queue_collection.document(entry_id))
+        batch.commit()
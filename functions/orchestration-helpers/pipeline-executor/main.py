@@ -13,16 +13,26 @@
 # limitations under the License.
 
 import os
+import contextvars
+import hashlib
+import time
+import uuid
 from google.cloud import bigquery
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta, datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import json
-import logging
 import functions_framework
 import google.oauth2.id_token
 from google.cloud import error_reporting
 from google.cloud import workflows_v1
 from google.cloud.workflows import executions_v1
 from google.cloud.workflows.executions_v1.types.executions import Execution
+from google.cloud import firestore
+from admission import (AdmissionContention, FirestoreAdmissionStore, UNASSIGNED_SLOT_TIMEOUT_SECONDS, has_capacity,
+                       priority_rank)
+from structured_log import bind, get_logger
+from tracing import TRACE_CONTEXT_FIELD, inject_trace_context, setup_tracing, traced, traced_request
+from profiling import phase, profiled
 
 # Access environment variables
 WORKFLOW_CONTROL_PROJECT_ID = os.environ.get('WORKFLOW_CONTROL_PROJECT_ID')
@@ -30,21 +40,49 @@ WORKFLOW_CONTROL_DATASET_ID = os.environ.get('WORKFLOW_CONTROL_DATASET_ID')
 WORKFLOW_CONTROL_TABLE_ID = os.environ.get('WORKFLOW_CONTROL_TABLE_ID')
 WORKFLOWS_LOCATION = os.environ.get('WORKFLOWS_LOCATION')
 DEFAULT_TIME_FORMAT = '%Y-%m-%d'
+CONTROL_SCHEMA_VERSION = 2
+# days of control table partitions scanned when looking for previous runs of a workflow
+CONTROL_LOOKBACK_DAYS = int(os.environ.get('CONTROL_LOOKBACK_DAYS', 400))
+DEFAULT_BACKFILL_PARALLELISM = int(os.environ.get('DEFAULT_BACKFILL_PARALLELISM', 10))
+# upper bound of the requested backfill parallelism, one thread per execution created at the same time
+MAX_BACKFILL_PARALLELISM = int(os.environ.get('MAX_BACKFILL_PARALLELISM', 50))
+# admission control, disabled when the global limit is 0
+ADMISSION_GLOBAL_LIMIT = int(os.environ.get('ADMISSION_GLOBAL_LIMIT', 0))
+ADMISSION_WORKFLOW_LIMIT = int(os.environ.get('ADMISSION_WORKFLOW_LIMIT', 1))
+ADMISSION_FIRESTORE_COLLECTION = os.environ.get('ADMISSION_FIRESTORE_COLLECTION', 'workflows_admission')
+# drains a queued request may fail to launch in, before it is moved out of the queue to the dead letters
+ADMISSION_MAX_LAUNCH_ATTEMPTS = int(os.environ.get('ADMISSION_MAX_LAUNCH_ATTEMPTS', 5))
+# last execution launched per (workflow, window), one document each
+WINDOW_FIRESTORE_COLLECTION = os.environ.get('WINDOW_FIRESTORE_COLLECTION', 'workflows_windows')
+# a window reserved by a request longer ago than this is considered abandoned (e.g. the instance crashed)
+WINDOW_RESERVATION_SECONDS = int(os.environ.get('WINDOW_RESERVATION_SECONDS', 300))
+# seconds a request waits for the execution of a window reserved by a concurrent request
+WINDOW_RESERVATION_WAIT_SECONDS = int(os.environ.get('WINDOW_RESERVATION_WAIT_SECONDS', 30))
+# header of the pipeline executor responses carrying the decision taken on the request
+DECISION_HEADER = 'X-AEF-Decision'
 
 # Logs
 error_client = error_reporting.Client()
 client = google.cloud.logging.Client()
 client.setup_logging()
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger = get_logger('pipeline-executor')
+
+# traces
+setup_tracing(os.environ.get('K_SERVICE', 'pipeline-executor'))
 
 # clients
 bq_client = bigquery.Client(project=WORKFLOW_CONTROL_PROJECT_ID)
 execution_client = executions_v1.ExecutionsClient()
 workflows_client = workflows_v1.WorkflowsClient()
+firestore_client = firestore.Client()
+admission_store = None
+if ADMISSION_GLOBAL_LIMIT > 0:
+    admission_store = FirestoreAdmissionStore(firestore_client, ADMISSION_FIRESTORE_COLLECTION)
 
 
 @functions_framework.http
+@profiled("pipeline-executor")
+@traced_request("pipeline-executor")
 def main(request):
     """
     Main function, likely triggered by an HTTP request
@@ -54,9 +92,14 @@ def main(request):
     Args:
         request: The incoming HTTP request object.
 
+    Returns:
+        the execution id, with the decision (launched, attached, skipped, queued or disabled) in the
+        X-AEF-Decision header
+
     """
     event = request.get_json()
-    print("event: " + str(event))
+    bind({'workflow_name': event.get('workflows_name')})
+    logger.debug("event: %s", event)
     start_date = event.get('start_date')
     end_date = event.get('end_date')
     workflows_name = event.get('workflows_name')
@@ -64,26 +107,41 @@ def main(request):
     same_day_execution = event.get('same_day_execution', 'YESTERDAY')
     workflow_status = event.get('workflow_status')
     workflow_properties = event.get('workflow_properties')
+    backfill = event.get('backfill')
+    granularity = event.get('granularity')
+    range_safe = event.get('range_safe', False)
+    force = event.get('force', False)
     execution_id = 0
+    decision = 'disabled'
     try:
-        if workflow_status == "ENABLED":
-            execution_id = call_workflows(workflows_name, start_date, end_date,
-                                          validation_date_pattern, workflow_properties,
-                                          same_day_execution)
+        if backfill:
+            try:
+                return backfill_workflows(workflows_name, backfill, validation_date_pattern, workflow_properties)
+            except ValueError as ex:
+                # invalid dates or parallelism of the request, nothing was launched
+                logger.warning("Invalid backfill request: %s", ex)
+                return f"Invalid backfill request : {ex}", 400
+        if workflow_status == "ENABLED" and admission_store is not None:
+            execution_id, decision = admit_workflow(admission_store, event)
+        elif workflow_status == "ENABLED":
+            execution_id, decision = call_workflows(workflows_name, start_date, end_date,
+                                                    validation_date_pattern, workflow_properties,
+                                                    same_day_execution, granularity, range_safe, force)
         else:
-            print('Workflow Disabled')
-        return execution_id
+            logger.info('Workflow Disabled')
+        logger.info("Execution %s %s", execution_id, decision,
+                    extra={"fields": {"execution_id": execution_id, "decision": decision}})
+        return str(execution_id), 200, {DECISION_HEADER: decision}
     except Exception as ex:
         exception_message = "Exception : " + repr(ex)
         error_client.report_exception()
-        logger.error(exception_message)
-        print(RuntimeError(repr(ex)))
+        logger.error(exception_message, exc_info=True)
         return exception_message, 500
 
 
 def call_workflows(workflows_name, start_date, end_date,
                    validation_date_pattern, workflow_properties,
-                   same_day_execution):
+                   same_day_execution, granularity=None, range_safe=False, force=False):
     """
     calls a cloud workflows pipeline passed by parameter
 
@@ -95,16 +153,214 @@ def call_workflows(workflows_name, start_date, end_date,
         workflow_properties: custom properties passed to the cloud workflows.
         same_day_execution: can be YESTERDAY, TODAY or YESTERDAY_TODAY indicating dates that should be passed in
         start and end dates, if not received by parameter.
+        granularity: HOUR, DAY, WEEK or MONTH, see process_dates
+        range_safe: if True, windows missed since the last successful run are coalesced into the scheduled one,
+        widening its start date
+        force: if True, launches a new execution even if the same window is already running or succeeded
 
     Returns:
-        execution_id: cloud workflows unique execution identifier
+        execution_id: cloud workflows unique execution identifier (the existing one if not launched)
+        decision: "launched", "attached" to a running execution of the same window, or "skipped" because the
+        window already succeeded
     """
-    print("Launching Custom Workflow.....")
+    logger.debug("Launching Custom Workflow.....")
 
     if start_date is None:  # it means is not done manually
-        start_date, end_date = process_dates(validation_date_pattern, same_day_execution)
+        start_date, end_date = process_dates(validation_date_pattern, same_day_execution, granularity)
+        start_date = widen_start_date(workflows_name, start_date, validation_date_pattern, granularity, range_safe)
     if end_date is None:
         end_date = start_date
+    if force:
+        return create_execution(workflows_name, start_date, end_date, workflow_properties), 'launched'
+    reservation_id, window = reserve_window(workflows_name, start_date, end_date)
+    if reservation_id is None:
+        duplicate = wait_for_window_execution(workflows_name, start_date, end_date, window)
+    else:
+        try:
+            duplicate = find_duplicate_execution(workflows_name, start_date, end_date, window)
+            if duplicate is None:
+                # recording the execution of the window also ends the reservation
+                return create_execution(workflows_name, start_date, end_date, workflow_properties), 'launched'
+        except Exception:
+            release_window(workflows_name, start_date, end_date, reservation_id)
+            raise
+        release_window(workflows_name, start_date, end_date, reservation_id)
+    logger.info("Window %s - %s of %s %s to execution %s", start_date, end_date, workflows_name,
+                duplicate[1], duplicate[0])
+    return duplicate
+
+
+def window_ref(workflows_name, start_date, end_date):
+    """returns the firestore document recording the last execution of a workflow window"""
+    key = hashlib.sha256(json.dumps([workflows_name, start_date, end_date]).encode("utf-8")).hexdigest()[:32]
+    return firestore_client.collection(WINDOW_FIRESTORE_COLLECTION).document(key)
+
+
+@traced("dedup.reserve_window", "workflows_name", "start_date", "end_date")
+def reserve_window(workflows_name, start_date, end_date):
+    """
+    reserves a workflow window before looking for its duplicates and creating its execution, so that
+    concurrent requests of the same window (e.g. a manual re-trigger and a scheduler retry) are serialized:
+    the second one waits for the execution created by the first one.
+
+    Args:
+        workflows_name: name of the cloud workflows
+        start_date: start date of the window (formatted)
+        end_date: end date of the window (formatted)
+
+    Returns:
+        (reservation id, or None if a concurrent request holds the window, window document as read)
+    """
+    ref = window_ref(workflows_name, start_date, end_date)
+    reservation_id = uuid.uuid4().hex
+
+    @firestore.transactional
+    def reserve(transaction):
+        snapshot = ref.get(transaction=transaction)
+        window = snapshot.to_dict() if snapshot.exists else {}
+        if window.get("reservation_id") and time.time() - window["reserved_at"] < WINDOW_RESERVATION_SECONDS:
+            return None, window
+        transaction.set(ref, {"workflows_name": workflows_name, "start_date": start_date, "end_date": end_date,
+                              "reservation_id": reservation_id, "reserved_at": time.time()}, merge=True)
+        return reservation_id, window
+
+    return reserve(firestore_client.transaction())
+
+
+def release_window(workflows_name, start_date, end_date, reservation_id):
+    """ends the reservation of a window that was not launched, unless another request took it over"""
+    ref = window_ref(workflows_name, start_date, end_date)
+    try:
+        snapshot = ref.get()
+        if snapshot.exists and snapshot.to_dict().get("reservation_id") == reservation_id:
+            ref.update({"reservation_id": firestore.DELETE_FIELD, "reserved_at": firestore.DELETE_FIELD})
+    except Exception as ex:
+        # the reservation expires after WINDOW_RESERVATION_SECONDS
+        logger.warning("Could not release the reservation of window %s - %s of %s: %r", start_date, end_date,
+                       workflows_name, ex)
+
+
+def wait_for_window_execution(workflows_name, start_date, end_date, reserved_window):
+    """
+    waits for a concurrent request holding the reservation of a window to launch it, or to find its duplicate
+
+    Args:
+        workflows_name: name of the cloud workflows
+        start_date: start date of the window (formatted)
+        end_date: end date of the window (formatted)
+        reserved_window: window document holding the concurrent reservation
+
+    Returns:
+        (execution_id, "attached" or "skipped"), the execution launched or found by the concurrent request.
+        Raises an exception if the window is still reserved after WINDOW_RESERVATION_WAIT_SECONDS or was
+        released without execution.
+    """
+    ref = window_ref(workflows_name, start_date, end_date)
+    deadline = time.time() + WINDOW_RESERVATION_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(1)
+        snapshot = ref.get()
+        window = snapshot.to_dict() if snapshot.exists else {}
+        if window.get("reservation_id") == reserved_window["reservation_id"]:
+            continue
+        duplicate = find_duplicate_execution(workflows_name, start_date, end_date, window)
+        if duplicate:
+            return duplicate
+        break
+    raise Exception(f"Window {start_date} - {end_date} of {workflows_name} was reserved by a concurrent request "
+                    f"that did not launch it")
+
+
+@traced("dedup.find_duplicate_execution", "workflows_name", "start_date", "end_date")
+@phase("find_duplicate_execution")
+def find_duplicate_execution(workflows_name, start_date, end_date, window):
+    """
+    looks for an execution of the same workflow and window that makes a new one unnecessary: an active
+    execution to attach to, or an execution that already succeeded. The last execution of each window is
+    recorded by create_execution. Windows without a recorded execution (launched from the console, before
+    the window documents existed or whose document write failed) are looked up in the control table.
+    The state of the executions is read from the workflows API.
+
+    Args:
+        workflows_name: name of the cloud workflows
+        start_date: start date of the window (formatted)
+        end_date: end date of the window (formatted)
+        window: window document, as read when reserving the window
+
+    Returns:
+        (execution_id, "attached" or "skipped"), or None if the window has to be launched
+    """
+    if window.get("execution_name"):
+        execution_names = [window["execution_name"]]
+    else:
+        parent = workflows_client.workflow_path(WORKFLOW_CONTROL_PROJECT_ID, WORKFLOWS_LOCATION, workflows_name)
+        execution_names = [f"{parent}/executions/{execution_id}"
+                           for execution_id in get_window_execution_ids(workflows_name, start_date, end_date)]
+    for execution_name in execution_names:
+        try:
+            execution = execution_client.get_execution(name=execution_name)
+        except Exception as ex:
+            logger.warning("Could not read execution %s: %r", execution_name, ex)
+            continue
+        if execution.state == Execution.State.ACTIVE:
+            return execution_name.split("/")[-1], 'attached'
+        if execution.state == Execution.State.SUCCEEDED:
+            return execution_name.split("/")[-1], 'skipped'
+    return None
+
+
+@phase("window_execution_ids")
+def get_window_execution_ids(workflows_name, start_date, end_date):
+    """
+    reads the executions of a workflow window logged in the control table, the latest first
+
+    Args:
+        workflows_name: name of the cloud workflows
+        start_date: start date of the window (formatted)
+        end_date: end date of the window (formatted)
+
+    Returns:
+        list of at most 5 execution ids, empty if the control table could not be read
+    """
+    query = f"""
+        SELECT workflow_execution_id
+        FROM `{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_CONTROL_TABLE_ID}`
+        WHERE workflow_name = @workflow_name AND workflow_execution_id IS NOT NULL
+          AND JSON_VALUE(query_variables, '$.start_date') = @start_date
+          AND JSON_VALUE(query_variables, '$.end_date') = @end_date
+          AND timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {CONTROL_LOOKBACK_DAYS} DAY)
+        GROUP BY workflow_execution_id
+        ORDER BY MAX(timestamp) DESC
+        LIMIT 5
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("workflow_name", "STRING", workflows_name),
+        bigquery.ScalarQueryParameter("start_date", "STRING", start_date),
+        bigquery.ScalarQueryParameter("end_date", "STRING", end_date)
+    ])
+    try:
+        return [row.workflow_execution_id for row in bq_client.query(query, job_config=job_config).result()]
+    except Exception as ex:
+        logger.warning("Could not read the executions of window %s - %s of %s: %r", start_date, end_date,
+                       workflows_name, ex)
+        return []
+
+
+@traced("workflows.create_execution", "workflows_name", "start_date", "end_date")
+@phase("create_execution")
+def create_execution(workflows_name, start_date, end_date, workflow_properties):
+    """
+    creates a cloud workflows execution for a given window
+
+    Args:
+        workflows_name: name of te cloud workflows to execute
+        start_date: start date passed by parameter to the workflows pipeline
+        end_date: end date passed by parameter to the workflows pipeline
+        workflow_properties: custom properties passed to the cloud workflows.
+
+    Returns:
+        execution_id: cloud workflows unique execution identifier
+    """
     if isinstance(workflow_properties, str):
         workflow_properties = json.loads(workflow_properties)
     arguments = {
@@ -113,9 +369,11 @@ def call_workflows(workflows_name, start_date, end_date,
             "start_date": start_date,
             "end_date": end_date,
         },
-        "workflow_properties": workflow_properties
+        "workflow_properties": workflow_properties,
+        # steps pass it to the intermediate function to continue the trace
+        TRACE_CONTEXT_FIELD: inject_trace_context()
     }
-    print('Cloud Workflows input params: %s ', arguments)
+    logger.debug('Cloud Workflows input params: %s', arguments)
     execution = Execution(argument=json.dumps(arguments))
     # Construct the fully qualified location path.
     parent = workflows_client.workflow_path(WORKFLOW_CONTROL_PROJECT_ID, WORKFLOWS_LOCATION, workflows_name)
@@ -123,25 +381,56 @@ def call_workflows(workflows_name, start_date, end_date,
     # Execute the workflow.
     response = execution_client.create_execution(parent=parent, execution=execution)
     execution_id = response.name.split("/")[-1]
-    print(f"Created execution: {execution_id}")
+    logger.info("Created execution: %s", execution_id, extra={"fields": {"execution_id": execution_id}})
+    try:
+        window_ref(workflows_name, start_date, end_date).set({
+            "workflows_name": workflows_name,
+            "start_date": start_date,
+            "end_date": end_date,
+            "execution_name": response.name,
+            "created_at": time.time()
+        })
+    except Exception as ex:
+        logger.warning("Could not record the window of execution %s: %r", execution_id, ex)
     return execution_id
 
 
-def process_dates(validation_date_pattern, same_day_execution):
+def default_granularity(validation_date_pattern, granularity=None):
+    """returns the window granularity of a workflow: the given one, or DAY for the default daily pattern and
+    MONTH for any other pattern
+    """
+    if granularity:
+        return granularity
+    return 'DAY' if validation_date_pattern == DEFAULT_TIME_FORMAT else 'MONTH'
+
+
+def process_dates(validation_date_pattern, same_day_execution, granularity=None):
     """method to process start and end dates when no received by parameter
 
     Args:
         validation_date_pattern: python data pattern format to apply to start and end dates
         same_day_execution: can be YESTERDAY, TODAY or YESTERDAY_TODAY indicating dates that should be passed in
         start and end dates, if not received by parameter.
+        granularity: HOUR (last complete hour), DAY (yesterday and/or today), WEEK (last complete monday to
+        sunday week) or MONTH (last complete month). Defaults to DAY for the default daily pattern and to MONTH
+        for any other pattern.
 
     Returns:
         Start and end dates parsed
 
     """
     today = date.today()
+    granularity = default_granularity(validation_date_pattern, granularity)
+    if granularity == 'HOUR':
+        current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        hour = current_hour if same_day_execution == 'TODAY' else current_hour - timedelta(hours=1)
+        start_date = end_date = str(hour.strftime(validation_date_pattern))
+    elif granularity == 'WEEK':
+        this_monday = today - timedelta(days=today.weekday())
+        end_date = str((this_monday - timedelta(days=1)).strftime(validation_date_pattern))
+        start_date = str((this_monday - timedelta(days=7)).strftime(validation_date_pattern))
     # if is a daily pattern, execute the previous day
-    if validation_date_pattern == DEFAULT_TIME_FORMAT:
+    elif granularity == 'DAY':
         if same_day_execution == 'YESTERDAY':
             last_day = today - timedelta(days=1)
         else:  # TODAY, YESTERDAY_TODAY
@@ -161,3 +450,419 @@ def process_dates(validation_date_pattern, same_day_execution):
         end_date = str(last_month_last_day.strftime(validation_date_pattern))
         start_date = str(last_month_first_day.strftime(validation_date_pattern))
     return start_date, end_date
+
+
+def split_date_range(start_date, end_date, granularity):
+    """method to split a date range into consecutive windows
+
+    Args:
+        start_date: first date of the range (date)
+        end_date: last date of the range, included (date)
+        granularity: DAY, WEEK (monday to sunday) or MONTH. Windows are clipped to the range.
+
+    Returns:
+        list of (window start date, window end date) tuples
+    """
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        if granularity == 'DAY':
+            window_end = window_start
+        elif granularity == 'WEEK':
+            window_end = window_start + timedelta(days=6 - window_start.weekday())
+        elif granularity == 'MONTH':
+            next_month_first_day = (window_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+            window_end = next_month_first_day - timedelta(days=1)
+        else:
+            raise ValueError(f"Invalid backfill granularity: {granularity}")
+        window_end = min(window_end, end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
+def backfill_workflows(workflows_name, backfill, validation_date_pattern, workflow_properties):
+    """
+    launches one cloud workflows execution per window of a date range, concurrently, and records the batch
+    in the control table
+
+    Args:
+        workflows_name: name of te cloud workflows to execute
+        backfill: dictionary with "start_date" and "end_date" (formatted with validation_date_pattern),
+                  "granularity" (DAY, WEEK or MONTH, DAY by default) and optionally "parallelism", the maximum
+                  number of executions created at the same time. With admission control, every window goes
+                  through the admission store with the backfill "priority" (LOW by default), in date order.
+        validation_date_pattern: python data pattern format to apply to start and end dates
+        workflow_properties: custom properties passed to the cloud workflows.
+
+    Returns:
+        dictionary with the batch id and the execution id and decision (or the error) of every window
+    """
+    date_pattern = validation_date_pattern or DEFAULT_TIME_FORMAT
+    start_date = datetime.strptime(backfill['start_date'], date_pattern).date()
+    end_date = datetime.strptime(backfill.get('end_date') or backfill['start_date'], date_pattern).date()
+    windows = split_date_range(start_date, end_date, backfill.get('granularity', 'DAY'))
+    parallelism = backfill_parallelism(backfill.get('parallelism', DEFAULT_BACKFILL_PARALLELISM))
+    batch_id = f"backfill_{uuid.uuid4()}"
+    logger.info("Backfill %s of %s: %d windows, parallelism %d", batch_id, workflows_name, len(windows), parallelism)
+
+    formatted_windows = [(window_start.strftime(date_pattern), window_end.strftime(date_pattern))
+                         for window_start, window_end in windows]
+
+    def launch_window(window_start, window_end):
+        if admission_store is None:
+            return create_execution(workflows_name, window_start, window_end, workflow_properties), 'launched'
+        return admit_workflow(admission_store, {
+            'workflows_name': workflows_name,
+            'start_date': window_start,
+            'end_date': window_end,
+            'validation_date_pattern': validation_date_pattern,
+            'workflow_properties': workflow_properties,
+            'priority': backfill.get('priority', 'LOW'),
+            'force': True
+        })
+
+    # admitted windows are queued one after the other, so that the drain releases them in date order
+    with ThreadPoolExecutor(max_workers=1 if admission_store is not None else parallelism) as executor:
+        # each window runs in a copy of the request context, keeping its span under the request one
+        futures = [executor.submit(contextvars.copy_context().run, launch_window, window_start, window_end)
+                   for window_start, window_end in formatted_windows]
+    executions = []
+    for (window_start, window_end), future in zip(formatted_windows, futures):
+        execution = {"start_date": window_start, "end_date": window_end}
+        if future.exception():
+            execution["error"] = repr(future.exception())
+        else:
+            execution["execution_id"], execution["decision"] = future.result()
+        executions.append(execution)
+
+    log_backfill_bigquery(batch_id, workflows_name, executions)
+    return {"batch_id": batch_id, "executions": executions}
+
+
+def backfill_parallelism(parallelism):
+    """returns the number of backfill executions created at the same time, capped at MAX_BACKFILL_PARALLELISM
+
+    Args:
+        parallelism: requested parallelism, a positive integer
+
+    Returns:
+        the parallelism to use, raises an exception for an invalid value
+    """
+    try:
+        value = int(parallelism)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise ValueError(f"Invalid backfill parallelism: {parallelism!r}, expected a positive integer")
+    if value > MAX_BACKFILL_PARALLELISM:
+        logger.warning("Backfill parallelism %d capped at %d", value, MAX_BACKFILL_PARALLELISM)
+    return min(value, MAX_BACKFILL_PARALLELISM)
+
+
+@phase("bigquery_log")
+def log_backfill_bigquery(batch_id, workflows_name, executions):
+    """
+    Logs one row per backfill window in the workflows control table, with the batch id as job name
+
+    Args:
+        batch_id: unique identifier of the backfill batch
+        workflows_name: name of the backfilled cloud workflows
+        executions: list of windows with their execution id or error
+    """
+    current_datetime = datetime.now(timezone.utc).isoformat()
+    rows = [{
+        # queued windows have no execution yet, their queue entry is kept in the query variables
+        'workflow_execution_id': None if execution.get('decision') == 'queued' else execution.get('execution_id'),
+        'workflow_name': workflows_name,
+        'job_name': batch_id,
+        'job_status': 'backfill_failed_start' if 'error' in execution
+        else 'backfill_queued' if execution.get('decision') == 'queued' else 'backfill_started',
+        'timestamp': current_datetime,
+        'error_code': '1' if 'error' in execution else '0',
+        'params_hash': None,
+        'query_variables': json.dumps(execution),
+        'async_job_id': None,
+        'log_path': None,
+        'retry_count': 0,
+        'schema_version': CONTROL_SCHEMA_VERSION
+    } for execution in executions]
+
+    workflows_control_table = bq_client.dataset(WORKFLOW_CONTROL_DATASET_ID).table(WORKFLOW_CONTROL_TABLE_ID)
+    errors = bq_client.insert_rows_json(workflows_control_table, rows)
+    if errors:
+        raise Exception("Encountered errors while inserting rows: {}".format(errors))
+    logger.debug("%d backfill rows have been added.", len(rows))
+
+
+def next_window_start(window_end, granularity):
+    """method to compute the start of the window following the one ending at a given date
+
+    Args:
+        window_end: end of a window (datetime)
+        granularity: HOUR, DAY, WEEK or MONTH
+
+    Returns:
+        datetime starting the next window
+    """
+    if granularity == 'HOUR':
+        return window_end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    window_day = window_end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'WEEK':
+        return window_day + timedelta(days=7 - window_day.weekday())
+    if granularity == 'MONTH':
+        return (window_day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return window_day + timedelta(days=1)
+
+
+@phase("last_successful_end_date")
+def get_last_successful_end_date(workflows_name, validation_date_pattern):
+    """
+    reads the latest end date among the successful steps of a workflow in the control table
+
+    Args:
+        workflows_name: name of the cloud workflows
+        validation_date_pattern: python data pattern format of the logged end dates
+
+    Returns:
+        datetime of the last successful end date, or None if the workflow never succeeded
+    """
+    query = f"""
+        SELECT JSON_VALUE(query_variables, '$.end_date') AS end_date
+        FROM `{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_CONTROL_TABLE_ID}`
+        WHERE workflow_name = @workflow_name AND job_status = 'success'
+          AND timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {CONTROL_LOOKBACK_DAYS} DAY)
+        ORDER BY timestamp DESC
+        LIMIT 100
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("workflow_name", "STRING", workflows_name)
+    ])
+    end_dates = []
+    for row in bq_client.query(query, job_config=job_config).result():
+        try:
+            end_dates.append(datetime.strptime(row.end_date, validation_date_pattern))
+        except (TypeError, ValueError):
+            continue
+    return max(end_dates) if end_dates else None
+
+
+def widen_start_date(workflows_name, start_date, validation_date_pattern, granularity, range_safe):
+    """
+    detects the windows missed between the last successful run of a workflow and the scheduled window.
+    For range safe workflows the start date is moved back so that a single execution covers the whole gap,
+    for other workflows the gap is only reported.
+
+    Args:
+        workflows_name: name of the cloud workflows
+        start_date: start date of the scheduled window (formatted)
+        validation_date_pattern: python data pattern format to apply to start and end dates
+        granularity: HOUR, DAY, WEEK or MONTH, see process_dates
+        range_safe: whether the workflow accepts a start and end date range spanning several windows
+
+    Returns:
+        start date to use (formatted)
+    """
+    granularity = default_granularity(validation_date_pattern, granularity)
+    try:
+        last_end_date = get_last_successful_end_date(workflows_name, validation_date_pattern)
+    except Exception as ex:
+        logger.warning("Could not read last successful window of %s, no gap detection: %r", workflows_name, ex)
+        return start_date
+    if last_end_date is None:
+        return start_date
+    gap_start = next_window_start(last_end_date, granularity)
+    if gap_start >= datetime.strptime(start_date, validation_date_pattern):
+        return start_date
+    gap_start = str(gap_start.strftime(validation_date_pattern))
+    if not range_safe:
+        logger.warning("Windows missed since %s for %s, not range safe: use a backfill to recover",
+                       gap_start, workflows_name)
+        return start_date
+    logger.info("Windows missed since %s for %s, widening start date from %s", gap_start, workflows_name, start_date)
+    return gap_start
+
+
+def launch_event(event):
+    """
+    launches the cloud workflows execution requested by a pipeline executor event
+
+    Args:
+        event: pipeline executor request, as received by main
+
+    Returns:
+        execution_id and decision, see call_workflows
+    """
+    return call_workflows(event.get('workflows_name'), event.get('start_date'), event.get('end_date'),
+                          event.get('validation_date_pattern'), event.get('workflow_properties'),
+                          event.get('same_day_execution', 'YESTERDAY'), event.get('granularity'),
+                          event.get('range_safe', False), event.get('force', False))
+
+
+def workflow_limit_of(event):
+    """
+    returns the per workflow concurrency limit of an event: "max_concurrency" in its workflow properties, or
+    the ADMISSION_WORKFLOW_LIMIT default
+    """
+    workflow_properties = event.get('workflow_properties') or {}
+    if isinstance(workflow_properties, str):
+        workflow_properties = json.loads(workflow_properties)
+    return int(workflow_properties.get('max_concurrency', ADMISSION_WORKFLOW_LIMIT))
+
+
+def resolve_event_window(event):
+    """
+    fills the start and end dates of a scheduled event as they are at reception time, so that a queued
+    request keeps its window whenever it is released
+
+    Args:
+        event: pipeline executor request
+
+    Returns:
+        copy of the event with start_date and end_date set
+    """
+    event = dict(event)
+    if event.get('start_date') is None:
+        validation_date_pattern = event.get('validation_date_pattern')
+        start_date, end_date = process_dates(validation_date_pattern, event.get('same_day_execution', 'YESTERDAY'),
+                                             event.get('granularity'))
+        event['start_date'] = widen_start_date(event.get('workflows_name'), start_date, validation_date_pattern,
+                                               event.get('granularity'), event.get('range_safe', False))
+        event['end_date'] = end_date
+    return event
+
+
+@traced("admission.admit_workflow")
+@phase("admission")
+def admit_workflow(store, event):
+    """
+    launches a workflow execution if a concurrency slot is available and no queued request ranks before it,
+    otherwise queues the request until the drain function releases it
+
+    Args:
+        store: admission store (FirestoreAdmissionStore or InMemoryAdmissionStore)
+        event: pipeline executor request. "priority" (HIGH, NORMAL or LOW) orders the queue.
+
+    Returns:
+        execution_id and decision, see call_workflows. Queued requests return "queued_<entry id>" and "queued".
+    """
+    workflows_name = event.get('workflows_name')
+    priority = event.get('priority', 'NORMAL')
+    head = store.head()
+    # queued requests of the same or a higher priority are released first, by the drain function
+    slot_id = None
+    if head is None or priority_rank(priority) < head[1]["priority"]:
+        try:
+            slot_id = store.try_acquire(workflows_name, ADMISSION_GLOBAL_LIMIT, workflow_limit_of(event))
+        except AdmissionContention as ex:
+            # a burst of requests conflicting on the slots, the request is queued rather than lost
+            logger.warning("%s, queuing %s", ex, workflows_name)
+    if slot_id is None:
+        entry_id = store.enqueue(resolve_event_window(event), priority)
+        logger.info("Concurrency limit reached or requests queued before it, %s queued as %s", workflows_name,
+                    entry_id)
+        return f"queued_{entry_id}", 'queued'
+    try:
+        execution_id, decision = launch_event(event)
+    except Exception:
+        store.release(slot_id)
+        raise
+    if decision == 'launched':
+        parent = workflows_client.workflow_path(WORKFLOW_CONTROL_PROJECT_ID, WORKFLOWS_LOCATION, workflows_name)
+        store.assign(slot_id, f"{parent}/executions/{execution_id}")
+    else:
+        store.release(slot_id)
+    return execution_id, decision
+
+
+@functions_framework.http
+@profiled("pipeline-executor.drain")
+@traced_request("pipeline-executor.drain")
+def drain(request):
+    """
+    Drain entry point, triggered periodically by cloud scheduler when admission control is enabled.
+    Releases the slots of finished executions and launches queued requests, by priority and age, while
+    there is capacity.
+
+    Args:
+        request: The incoming HTTP request object.
+
+    Returns:
+        dictionary with the released slots and the launched queue entries
+    """
+    try:
+        return drain_queue(admission_store)
+    except Exception as ex:
+        exception_message = "Exception : " + repr(ex)
+        error_client.report_exception()
+        logger.error(exception_message, exc_info=True)
+        return exception_message, 500
+
+
+def drain_queue(store, get_execution_state=None):
+    """
+    releases finished executions and admits queued requests
+
+    Args:
+        store: admission store (FirestoreAdmissionStore or InMemoryAdmissionStore)
+        get_execution_state: function returning the state name of an execution, defaults to the workflows
+        executions API
+
+    Returns:
+        dictionary with the released slots, the launched queue entries and the entries moved to the dead
+        letters after ADMISSION_MAX_LAUNCH_ATTEMPTS failed launches
+    """
+    get_execution_state = get_execution_state or (
+        lambda execution_name: execution_client.get_execution(name=execution_name).state.name)
+    released = []
+    for slot_id, slot in store.slots().items():
+        if slot["execution_name"] is None:
+            finished = time.time() - slot["acquired_at"] > UNASSIGNED_SLOT_TIMEOUT_SECONDS
+        else:
+            finished = get_execution_state(slot["execution_name"]) != "ACTIVE"
+        if finished:
+            store.release(slot_id)
+            released.append(slot_id)
+
+    launched = {}
+    dead_lettered = []
+    for entry_id, entry in store.queued():
+        event = entry["event"]
+        try:
+            slot_id = store.try_acquire(event.get('workflows_name'), ADMISSION_GLOBAL_LIMIT,
+                                        workflow_limit_of(event))
+        except AdmissionContention as ex:
+            logger.warning("%s, queued requests are released by the next drain", ex)
+            break
+        if slot_id is None:
+            if not has_capacity(store.slots(), None, ADMISSION_GLOBAL_LIMIT, 0):
+                break
+            continue
+        try:
+            execution_id, decision = launch_event(event)
+        except Exception as ex:
+            store.release(slot_id)
+            attempts = entry.get("attempts", 0) + 1
+            if attempts >= ADMISSION_MAX_LAUNCH_ATTEMPTS:
+                # a request that never launches (e.g. a deleted workflow) would hold the queue head forever
+                store.dead_letter(entry_id, {**entry, "attempts": attempts, "last_error": repr(ex)})
+                dead_lettered.append(entry_id)
+                logger.error("Queued request %s failed to launch %d times, moved to the dead letters: %r",
+                             entry_id, attempts, ex)
+                continue
+            # the request stays queued and is retried by the next drain
+            store.record_failure(entry_id, attempts, repr(ex))
+            logger.warning("Queued request %s failed to launch (attempt %d of %d): %r", entry_id, attempts,
+                           ADMISSION_MAX_LAUNCH_ATTEMPTS, ex)
+            continue
+        store.dequeue(entry_id)
+        launched[entry_id] = execution_id
+        if decision != 'launched':
+            store.release(slot_id)
+            continue
+        parent = workflows_client.workflow_path(WORKFLOW_CONTROL_PROJECT_ID, WORKFLOWS_LOCATION,
+                                                event.get('workflows_name'))
+        store.assign(slot_id, f"{parent}/executions/{execution_id}")
+    logger.info("Drain released %d slots, launched %d queued requests and dead lettered %d", len(released),
+                len(launched), len(dead_lettered))
+    return {"released": released, "launched": launched, "dead_lettered": dead_lettered}
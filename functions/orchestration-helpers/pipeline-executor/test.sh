@@ -36,4 +36,26 @@ async_job_id=$(curl -m 70 -X POST https://$location-$project.cloudfunctions.net/
 }')
 
 echo "Workflow Execution ID: "
-echo $async_job_id
\ No newline at end of file
+echo $async_job_id
+
+backfill_start_date="2019-01-01"
+backfill_end_date="2019-01-31"
+
+backfill_executions=$(curl -m 70 -X POST https://$location-$project.cloudfunctions.net/orch-framework-pipeline-executor-function \
+-H "Authorization: bearer $(gcloud auth print-identity-token)" \
+-H "Content-Type: application/json" \
+-d '{
+    "workflows_name": "'$workflow_name'",
+    "validation_date_pattern": "'$validation_date_pattern'",
+    "workflow_status": "'$workflow_status'",
+    "workflow_properties": '$workflow_properties',
+    "backfill": {
+        "start_date" : "'$backfill_start_date'",
+        "end_date" : "'$backfill_end_date'",
+        "granularity" : "DAY",
+        "parallelism" : 5
+    }
+}')
+
+echo "Backfill Executions: "
+echo $backfill_executions
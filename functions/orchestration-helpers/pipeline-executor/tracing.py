@@ -0,0 +1,142 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import functools
+import inspect
+import os
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+# gcp (cloud trace), otlp (collector at OTEL_EXPORTER_OTLP_ENDPOINT), console or none
+TRACES_EXPORTER = os.environ.get('OTEL_TRACES_EXPORTER', 'gcp')
+# key of the trace context passed along the cloud workflows arguments and the intermediate requests
+TRACE_CONTEXT_FIELD = 'trace_context'
+
+tracer_provider = None
+tracer = trace.get_tracer(__name__)
+
+
+def setup_tracing(service_name):
+    """
+    Configures the tracer provider of the function once per instance, exporting to the backend selected by
+    OTEL_TRACES_EXPORTER. Spans are created but not exported with 'none'.
+
+    Args:
+        service_name: name of the function, reported as the service.name of its spans
+    """
+    global tracer_provider, tracer
+    if tracer_provider is not None:
+        return
+    tracer_provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if TRACES_EXPORTER == 'gcp':
+        from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+        tracer_provider.add_span_processor(BatchSpanProcessor(CloudTraceSpanExporter()))
+    elif TRACES_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    elif TRACES_EXPORTER == 'console':
+        tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    tracer = trace.get_tracer(service_name)
+
+
+def traced_request(name):
+    """
+    Decorator of the function entry points: runs each invocation in a server span, child of the trace context
+    received in the W3C traceparent header or in the trace_context field of the JSON payload (cloud workflows
+    steps). Spans are flushed before returning, as the instance CPU is throttled once the response is sent.
+
+    Args:
+        name: span name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(request):
+            carrier = dict(request.headers)
+            payload = request.get_json(silent=True)
+            if isinstance(payload, dict) and isinstance(payload.get(TRACE_CONTEXT_FIELD), dict):
+                carrier.update(payload[TRACE_CONTEXT_FIELD])
+            try:
+                with tracer.start_as_current_span(name, context=propagate.extract(carrier),
+                                                  kind=trace.SpanKind.SERVER):
+                    return function(request)
+            finally:
+                if tracer_provider is not None:
+                    tracer_provider.force_flush()
+        return wrapper
+    return decorator
+
+
+def traced(name, *argument_names):
+    """
+    Decorator running a function, or a coroutine function, in a child span of the current one
+
+    Args:
+        name: span name
+        argument_names: arguments of the function recorded as span attributes
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        def attributes_of(args, kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            return {argument_name: str(arguments[argument_name]) for argument_name in argument_names
+                    if arguments.get(argument_name) is not None}
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(name, attributes=attributes_of(args, kwargs)):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name, attributes=attributes_of(args, kwargs)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def span(name, **attributes):
+    """
+    Child span of the current one, to be used as a context manager
+    """
+    return tracer.start_as_current_span(name, attributes=span_attributes(attributes))
+
+
+def span_attributes(attributes):
+    # opentelemetry drops None values with a warning
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def inject_trace_context(carrier=None):
+    """
+    Writes the current trace context in carrier (HTTP headers or a payload field)
+
+    Returns:
+        the carrier, a new dictionary if none was given
+    """
+    carrier = {} if carrier is None else carrier
+    propagate.inject(carrier)
+    return carrier
+
+
+def set_span_attributes(**attributes):
+    """
+    Adds attributes to the current span, known only once the request is parsed
+    """
+    trace.get_current_span().set_attributes(span_attributes(attributes))
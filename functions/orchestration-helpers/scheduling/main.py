@@ -14,6 +14,10 @@
 import os
 import json
 import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import google.cloud.logging
 import functions_framework
 import google.oauth2.id_token
@@ -22,6 +26,7 @@ from cloudevents.http import CloudEvent
 from google.cloud import firestore
 from google.events.cloud import firestore as firestoredata
 from google.cloud import scheduler_v1
+from profiling import profiled
 
 
 # Access environment variables
@@ -30,6 +35,8 @@ WORKFLOW_SCHEDULING_PROJECT_NUMBER = os.environ.get('WORKFLOW_SCHEDULING_PROJECT
 WORKFLOW_SCHEDULING_PROJECT_REGION = os.environ.get('WORKFLOW_SCHEDULING_PROJECT_REGION')
 WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION = os.environ.get('WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION')
 PIPELINE_EXECUTION_FUNCTION_NAME = os.environ.get('PIPELINE_EXECUTION_FUNCTION_NAME')
+# CLOUD_SCHEDULER: one cloud scheduler rule per workflow, DISPATCHER: schedules evaluated by the dispatcher function
+SCHEDULING_MODE = os.environ.get('SCHEDULING_MODE', 'CLOUD_SCHEDULER')
 
 # define clients
 error_client = error_reporting.Client()
@@ -40,7 +47,18 @@ logger.setLevel(logging.DEBUG)
 firestore_client = firestore.Client()
 scheduler_client = scheduler_v1.CloudSchedulerClient()
 
+# optional firestore fields forwarded to the pipeline executor as they are
+OPTIONAL_WORKFLOW_PARAMETERS = {"granularity", "range_safe"}
+# firestore fields that are part of the scheduler job definition (schedule, time zone or body)
+SCHEDULER_JOB_FIELDS = {"crond_expression", "time_zone", "date_format", "workflow_status",
+                        "workflow_properties"} | OPTIONAL_WORKFLOW_PARAMETERS
+
+# reconciler defaults
+RECONCILER_MAX_WORKERS = 16
+RECONCILER_CALLS_PER_SECOND = 5
+
 @functions_framework.cloud_event
+@profiled("scheduling")
 def main(cloud_event: CloudEvent) -> None:
     """
     Main function, likely triggered by an eventarc event coming from firestore.
@@ -52,6 +70,9 @@ def main(cloud_event: CloudEvent) -> None:
 
     """
     print(f"EVENT::: path: {cloud_event}")
+    if SCHEDULING_MODE == 'DISPATCHER':
+        print("Schedules are evaluated by the dispatcher function, no cloud scheduler rule managed")
+        return
     firestore_payload = firestoredata.DocumentEventData()
     firestore_payload._pb.ParseFromString(cloud_event.data)
 
@@ -69,7 +90,12 @@ def main(cloud_event: CloudEvent) -> None:
     print(f"Collection path: {collection_path}")
     print(f"Document path: {document_path}")
 
-    if determine_job_type(firestore_payload.old_value, firestore_payload.value) in ('CREATE','UPDATE'):
+    job_type = determine_job_type(firestore_payload.old_value, firestore_payload.value)
+    changed_fields = determine_changed_fields(firestore_payload.old_value, firestore_payload.value)
+    print(f"Job type: {job_type}, changed fields: {sorted(changed_fields)}")
+    scheduler_calls = 0
+
+    if job_type in ('CREATE','UPDATE'):
         crond_expression = firestore_payload.value.fields["crond_expression"].string_value
         validation_date_pattern = firestore_payload.value.fields["date_format"].string_value
         time_zone = firestore_payload.value.fields["time_zone"].string_value
@@ -82,14 +108,76 @@ def main(cloud_event: CloudEvent) -> None:
             "workflow_status" : workflow_status,
             "workflow_properties" : workflow_properties
         }
-        if determine_job_type(firestore_payload.old_value, firestore_payload.value) == 'CREATE':
+        add_optional_parameters(workflow_parameters, {
+            field: (value.boolean_value if field == "range_safe" else value.string_value)
+            for field, value in firestore_payload.value.fields.items() if field in OPTIONAL_WORKFLOW_PARAMETERS})
+        if job_type == 'CREATE':
             create_job(job_name, crond_expression, time_zone, workflow_parameters)
-        if determine_job_type(firestore_payload.old_value, firestore_payload.value) == 'UPDATE':
-            update_job(job_name, crond_expression, time_zone, workflow_parameters)
-    if determine_job_type(firestore_payload.old_value, firestore_payload.value) in ('CREATE','UPDATE'):
-        change_status(job_name, firestore_payload.value)
-    if determine_job_type(firestore_payload.old_value, firestore_payload.value) == 'DELETE':
+            scheduler_calls += 1
+            # new scheduler jobs are enabled, they only need to be paused
+            if workflow_status == 'DISABLED':
+                scheduler_calls += change_status(job_name, firestore_payload.value)
+        if job_type == 'UPDATE':
+            if changed_fields & SCHEDULER_JOB_FIELDS:
+                update_job(job_name, crond_expression, time_zone, workflow_parameters)
+                scheduler_calls += 1
+            if 'workflow_status' in changed_fields:
+                scheduler_calls += change_status(job_name, firestore_payload.value)
+    if job_type == 'DELETE':
         delete_job(job_name)
+        scheduler_calls += 1
+
+    report_scheduler_calls_avoided(job_name, job_type, scheduler_calls)
+
+
+def add_optional_parameters(workflow_parameters, document):
+    """
+    Adds the optional firestore fields present in a document to the parameters sent to the pipeline executor
+
+    Args:
+        workflow_parameters: parameters sent to the cloud workflows invocation, updated in place
+        document: dictionary of firestore field names to values
+    """
+    for field in OPTIONAL_WORKFLOW_PARAMETERS:
+        if field in document:
+            workflow_parameters[field] = document[field]
+
+
+def determine_changed_fields(old_value, new_value):
+    """
+    Compares the old and new firestore documents field by field
+
+    Args:
+        old value: old firestore value coming in trigger info
+        new value:  new firestore value coming in trigger info
+
+    Returns:
+        set with the names of the fields added, removed or modified
+    """
+    old_fields = old_value.fields if old_value else {}
+    new_fields = new_value.fields if new_value else {}
+    return {field for field in set(old_fields.keys()) | set(new_fields.keys())
+            if field not in old_fields or field not in new_fields or old_fields[field] != new_fields[field]}
+
+
+def report_scheduler_calls_avoided(job_name, job_type, scheduler_calls):
+    """
+    Logs how many scheduler API calls were saved compared to always updating and pausing or resuming the job,
+    as a structured entry read by the scheduler_calls_avoided log based metric.
+
+    Args:
+        job_name: name for the scheduler job, should be the same as cloud workflows name
+        job_type: type of event, CREATE, UPDATE or DELETE
+        scheduler_calls: number of scheduler API calls issued for the event
+    """
+    baseline_calls = {'CREATE': 2, 'UPDATE': 2, 'DELETE': 1}.get(job_type, 0)
+    logger.info(f"Scheduler calls issued: {scheduler_calls}, avoided: {baseline_calls - scheduler_calls}",
+                extra={"json_fields": {
+                    "job_name": job_name,
+                    "job_type": job_type,
+                    "scheduler_calls": scheduler_calls,
+                    "scheduler_calls_avoided": baseline_calls - scheduler_calls
+                }})
 
 
 def determine_job_type(old_value ,new_value):
@@ -112,24 +200,26 @@ def determine_job_type(old_value ,new_value):
 
 
 
-def create_job(job_name, crond_expression, time_zone, workflow_parameters):
+def build_job(job_name, crond_expression, time_zone, workflow_parameters, description):
     """
-    creates a scheduler job , using given parameters.
+    builds the definition of a scheduler job triggering the pipeline executor function.
 
     Args:
         job_name: name for the scheduler job, should be the same as cloud workflows name
         crond_expression:  crond linux expression used to trigger the cloud scheduler rule
         time_zone: timezone associated with scheduler execution.
         workflow_parameters: parameters sent to the cloud workflows invocation
+        description: description of the scheduler job
 
+    Returns:
+        scheduler job definition
     """
-    parent= scheduler_client.common_location_path(WORKFLOW_SCHEDULING_PROJECT_ID,WORKFLOW_SCHEDULING_PROJECT_REGION)
-    job={
-        "name":"projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name,
-        "description":"workflows scheduler job create",
+    return {
+        "name": job_full_name(job_name),
+        "description": description,
         "http_target": {
             "http_method": "POST",
-            "uri": f"https://{WORKFLOW_SCHEDULING_PROJECT_REGION}-{WORKFLOW_SCHEDULING_PROJECT_ID}.cloudfunctions.net/{PIPELINE_EXECUTION_FUNCTION_NAME}" ,
+            "uri": pipeline_executor_uri(),
             "headers": {"Content-Type": "application/json"},
             "oidc_token": {"service_account_email": WORKFLOW_SCHEDULING_PROJECT_NUMBER + "-compute@developer.gserviceaccount.com"},
             "body": json.dumps(workflow_parameters).encode("utf-8"),
@@ -137,6 +227,35 @@ def create_job(job_name, crond_expression, time_zone, workflow_parameters):
         "schedule":crond_expression,
         "time_zone":time_zone,
     }
+
+
+def job_full_name(job_name):
+    """
+    returns the fully qualified scheduler job name for a workflow
+    """
+    return "projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name
+
+
+def pipeline_executor_uri():
+    """
+    returns the pipeline executor function uri called by every scheduler job
+    """
+    return f"https://{WORKFLOW_SCHEDULING_PROJECT_REGION}-{WORKFLOW_SCHEDULING_PROJECT_ID}.cloudfunctions.net/{PIPELINE_EXECUTION_FUNCTION_NAME}"
+
+
+def create_job(job_name, crond_expression, time_zone, workflow_parameters):
+    """
+    creates a scheduler job , using given parameters.
+
+    Args:
+        job_name: name for the scheduler job, should be the same as cloud workflows name
+        crond_expression:  crond linux expression used to trigger the cloud scheduler rule
+        time_zone: timezone associated with scheduler execution.
+        workflow_parameters: parameters sent to the cloud workflows invocation
+
+    """
+    parent= scheduler_client.common_location_path(WORKFLOW_SCHEDULING_PROJECT_ID,WORKFLOW_SCHEDULING_PROJECT_REGION)
+    job = build_job(job_name, crond_expression, time_zone, workflow_parameters, "workflows scheduler job create")
     scheduler_client.create_job(parent=parent,job=job)
     print("JOB CREATED...........")
 
@@ -152,19 +271,7 @@ def update_job(job_name, crond_expression, time_zone, workflow_parameters):
         workflow_parameters: parameters sent to the cloud workflows invocation
 
     """
-    job={
-        "name":"projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name,
-        "description":"workflows scheduler job update",
-        "http_target": {
-            "http_method": "POST",
-            "uri": f"https://{WORKFLOW_SCHEDULING_PROJECT_REGION}-{WORKFLOW_SCHEDULING_PROJECT_ID}.cloudfunctions.net/{PIPELINE_EXECUTION_FUNCTION_NAME}" ,
-            "headers": {"Content-Type": "application/json"},
-            "oidc_token": {"service_account_email": WORKFLOW_SCHEDULING_PROJECT_NUMBER + "-compute@developer.gserviceaccount.com"},
-            "body": json.dumps(workflow_parameters).encode("utf-8"),
-        },
-        "schedule":crond_expression,
-        "time_zone":time_zone,
-    }
+    job = build_job(job_name, crond_expression, time_zone, workflow_parameters, "workflows scheduler job update")
     scheduler_client.update_job(job=job)
     print("JOB UPDATED...........")
 
@@ -177,7 +284,7 @@ def delete_job(job_name):
         job_name: name for the scheduler job, should be the same as cloud workflows name
 
     """
-    final_job_name = "projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name
+    final_job_name = job_full_name(job_name)
     scheduler_client.delete_job(name=final_job_name)
     print("JOB DELETED...........")
 
@@ -190,13 +297,19 @@ def change_status(job_name, new_value):
         job_name: name for the scheduler job, should be the same as cloud workflows name
         new value:  new firestore value coming in trigger info
 
+    Returns:
+        number of scheduler API calls issued
+
     """
     workflow_status = new_value.fields["workflow_status"].string_value
     print(f"workflow_status: {workflow_status} ")
     if workflow_status == 'DISABLED':
         pause_job(job_name)
+        return 1
     if workflow_status == 'ENABLED':
         resume_job(job_name)
+        return 1
+    return 0
 
 
 def pause_job(job_name):
@@ -207,7 +320,7 @@ def pause_job(job_name):
         job_name: name for the scheduler job, should be the same as cloud workflows name
 
     """
-    final_job_name = "projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name
+    final_job_name = job_full_name(job_name)
     scheduler_client.pause_job(name=final_job_name)
     print("JOB PAUSED...........")
 
@@ -219,6 +332,201 @@ def resume_job(job_name):
         job_name: name for the scheduler job, should be the same as cloud workflows name
 
     """
-    final_job_name = "projects/"+ WORKFLOW_SCHEDULING_PROJECT_ID+ "/locations/"+WORKFLOW_SCHEDULING_PROJECT_REGION+"/jobs/" + job_name
+    final_job_name = job_full_name(job_name)
     scheduler_client.resume_job(name=final_job_name)
-    print("JOB RESUMED...........")
\ No newline at end of file
+    print("JOB RESUMED...........")
+
+
+@functions_framework.http
+@profiled("scheduling.reconcile")
+def reconcile(request):
+    """
+    Reconciler entry point, triggered by an HTTP request.
+    Brings all cloud scheduler rules in line with the whole firestore scheduling collection at once, creating,
+    updating, pausing, resuming and deleting rules concurrently. Used to repair drift or to bulk load schedules
+    without one eventarc invocation per document.
+
+    Args:
+        request: The incoming HTTP request object, optionally containing "dry_run", "max_workers" and
+                 "calls_per_second".
+
+    Returns:
+        reconciliation report with the planned (or applied) operations per scheduler job
+    """
+    request_json = request.get_json(silent=True) or {}
+    logger.info(f"Reconcile requested with options {sorted(request_json)}")
+    logger.debug(f"Reconcile request: {request_json}")
+    if SCHEDULING_MODE == 'DISPATCHER':
+        return "Schedules are evaluated by the dispatcher function, nothing to reconcile"
+    try:
+        return reconcile_schedules(firestore_client, scheduler_client,
+                                   dry_run=request_json.get('dry_run', True),
+                                   max_workers=request_json.get('max_workers', RECONCILER_MAX_WORKERS),
+                                   calls_per_second=request_json.get('calls_per_second', RECONCILER_CALLS_PER_SECOND))
+    except Exception as ex:
+        exception_message = "Exception : " + repr(ex)
+        error_client.report_exception()
+        logger.error(exception_message)
+        return exception_message, 500
+
+
+def reconcile_schedules(firestore_db, scheduler, dry_run=True, max_workers=RECONCILER_MAX_WORKERS,
+                        calls_per_second=RECONCILER_CALLS_PER_SECOND):
+    """
+    streams the firestore scheduling collection, lists the scheduler jobs once, computes the difference and
+    applies it unless dry_run is set.
+
+    Args:
+        firestore_db: firestore client (or a fake exposing collection(name).stream())
+        scheduler: cloud scheduler client (or a fake exposing list_jobs, create_job, update_job,
+                   pause_job, resume_job and delete_job)
+        dry_run: if True only the report is computed, no scheduler call is made
+        max_workers: number of scheduler jobs reconciled concurrently
+        calls_per_second: maximum number of scheduler mutations per second
+
+    Returns:
+        report dictionary with the operations per scheduler job, and the errors if any
+    """
+    desired = {doc.id: desired_job_state(doc.id, doc.to_dict())
+               for doc in firestore_db.collection(WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION).stream()}
+    parent = f"projects/{WORKFLOW_SCHEDULING_PROJECT_ID}/locations/{WORKFLOW_SCHEDULING_PROJECT_REGION}"
+    actual = {job.name.split("/")[-1]: job for job in scheduler.list_jobs(parent=parent)
+              if job.http_target.uri == pipeline_executor_uri()}
+
+    plan = compute_reconciliation_plan(desired, actual)
+    report = {
+        "dry_run": dry_run,
+        "schedules": len(desired),
+        "scheduler_jobs": len(actual),
+        "operations": {job_name: operations for job_name, operations in plan.items()},
+        "errors": {}
+    }
+    operation_counts = Counter(operation for operations in plan.values() for operation in operations)
+    logger.info(f"Reconciliation plan: {len(plan)} scheduler jobs to change, operations {dict(operation_counts)}")
+    logger.debug(f"Reconciliation plan: {plan}")
+    if dry_run or not plan:
+        return report
+
+    throttle = rate_limiter(calls_per_second)
+
+    def apply(job_name):
+        for operation in plan[job_name]:
+            throttle()
+            if operation == 'CREATE':
+                scheduler.create_job(parent=parent, job=desired[job_name]["job"])
+            elif operation == 'UPDATE':
+                scheduler.update_job(job=desired[job_name]["job"])
+            elif operation == 'PAUSE':
+                scheduler.pause_job(name=job_full_name(job_name))
+            elif operation == 'RESUME':
+                scheduler.resume_job(name=job_full_name(job_name))
+            elif operation == 'DELETE':
+                scheduler.delete_job(name=job_full_name(job_name))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {job_name: executor.submit(apply, job_name) for job_name in plan}
+    for job_name, future in futures.items():
+        if future.exception():
+            report["errors"][job_name] = repr(future.exception())
+    if report["errors"]:
+        logger.warning(f"Reconciliation finished with {len(report['errors'])} errors: {report['errors']}")
+    else:
+        logger.info("Reconciliation finished without errors")
+    return report
+
+
+def desired_job_state(job_name, document):
+    """
+    translates a firestore scheduling document into the scheduler job that should exist for it
+
+    Args:
+        job_name: firestore document id, same as cloud workflows name
+        document: firestore document as a dictionary
+
+    Returns:
+        dictionary with the scheduler job definition and whether it should be enabled
+    """
+    workflow_properties = document.get("workflow_properties", "")
+    if not isinstance(workflow_properties, str):
+        workflow_properties = json.dumps(workflow_properties)
+    workflow_parameters = {
+        "workflows_name" : job_name,
+        "validation_date_pattern" : document.get("date_format"),
+        "same_day_execution" : "YESTERDAY",
+        "workflow_status" : document.get("workflow_status"),
+        "workflow_properties" : workflow_properties
+    }
+    add_optional_parameters(workflow_parameters, document)
+    return {
+        "job": build_job(job_name, document.get("crond_expression"), document.get("time_zone"),
+                         workflow_parameters, "workflows scheduler job reconcile"),
+        "enabled": document.get("workflow_status") != 'DISABLED'
+    }
+
+
+def compute_reconciliation_plan(desired, actual):
+    """
+    computes the ordered scheduler operations needed per job to turn the actual state into the desired one
+
+    Args:
+        desired: dictionary of job name to desired_job_state
+        actual: dictionary of job name to existing scheduler job
+
+    Returns:
+        dictionary of job name to list of operations (CREATE, UPDATE, PAUSE, RESUME, DELETE), only for jobs
+        needing at least one operation
+    """
+    plan = {}
+    for job_name, state in desired.items():
+        operations = []
+        job = actual.get(job_name)
+        if job is None:
+            operations.append('CREATE')
+            if not state["enabled"]:
+                operations.append('PAUSE')
+        else:
+            if job_definition_changed(state["job"], job):
+                operations.append('UPDATE')
+            paused = job.state == scheduler_v1.Job.State.PAUSED
+            if state["enabled"] and paused:
+                operations.append('RESUME')
+            elif not state["enabled"] and not paused:
+                operations.append('PAUSE')
+        if operations:
+            plan[job_name] = operations
+    for job_name in actual:
+        if job_name not in desired:
+            plan[job_name] = ['DELETE']
+    return plan
+
+
+def job_definition_changed(desired_job, job):
+    """
+    compares the fields of a scheduler job managed by this function with their desired values
+    """
+    try:
+        body = json.loads(job.http_target.body.decode("utf-8")) if job.http_target.body else None
+    except (ValueError, UnicodeDecodeError):
+        body = None
+    return (job.schedule != desired_job["schedule"]
+            or job.time_zone != desired_job["time_zone"]
+            or body != json.loads(desired_job["http_target"]["body"].decode("utf-8")))
+
+
+def rate_limiter(calls_per_second):
+    """
+    returns a thread safe function that blocks its callers so that they proceed at most calls_per_second
+    times per second overall
+    """
+    lock = threading.Lock()
+    interval = 1.0 / calls_per_second
+    next_call = [time.monotonic()]
+
+    def wait():
+        with lock:
+            now = time.monotonic()
+            sleep_for = next_call[0] - now
+            next_call[0] = max(now, next_call[0]) + interval
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+    return wait
@@ -0,0 +1,202 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+# share of the invocations profiled, 0 disables profiling and leaves the entry points unwrapped
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+# cprofile (deterministic, every call) or sampling (stack sampled every PROFILING_SAMPLING_INTERVAL_MS)
+PROFILING_MODE = os.environ.get('PROFILING_MODE', 'cprofile')
+PROFILING_SAMPLING_INTERVAL_MS = float(os.environ.get('PROFILING_SAMPLING_INTERVAL_MS', 5))
+# log, a local directory path, or a gs://bucket/prefix uri
+PROFILING_SINK = os.environ.get('PROFILING_SINK', 'log')
+PROFILING_TOP_FUNCTIONS = 30
+
+# phase timings of the invocation being profiled, None when it is not sampled
+current_phases = contextvars.ContextVar('current_phases', default=None)
+
+
+def profiled(name):
+    """
+    Decorator of the function entry points: profiles a sample of the invocations and writes the profile with the
+    wall-clock time of their named phases to PROFILING_SINK. Returns the entry point untouched when profiling is
+    disabled.
+
+    Args:
+        name: function name used in the profile records
+    """
+    def decorator(function):
+        if PROFILING_SAMPLE_RATE <= 0:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # invocations nested in a profiled one (co-located executors) are part of its profile
+            if current_phases.get() is not None or random.random() >= PROFILING_SAMPLE_RATE:
+                return function(*args, **kwargs)
+            phases = {}
+            token = current_phases.set(phases)
+            profiler = StackSampler() if PROFILING_MODE == 'sampling' else cProfile.Profile()
+            started_at = datetime.now(timezone.utc)
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                wall_seconds = time.perf_counter() - start
+                current_phases.reset(token)
+                try:
+                    write_profile(name, started_at, wall_seconds, phases, profiler)
+                except Exception as ex:
+                    print(f"Could not write profile of {name}: {repr(ex)}")
+        return wrapper
+    return decorator
+
+
+class phase(contextlib.ContextDecorator):
+    """
+    Wall-clock timer of a named phase of the invocation, as a context manager or a decorator of functions and
+    coroutine functions. Durations of the same phase add up. Only a context variable lookup when the invocation
+    is not profiled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def _recreate_cm(self):
+        # a new timer per decorated call, calls may overlap in threads
+        return phase(self.name)
+
+    def __call__(self, function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self._recreate_cm():
+                    return await function(*args, **kwargs)
+            return wrapper
+        return super().__call__(function)
+
+    def __enter__(self):
+        self.start = time.perf_counter() if current_phases.get() is not None else None
+        return self
+
+    def __exit__(self, *exc_info):
+        phases = current_phases.get()
+        if self.start is not None and phases is not None:
+            phases[self.name] = phases.get(self.name, 0) + time.perf_counter() - self.start
+        return False
+
+
+class StackSampler:
+    """
+    Low overhead alternative to cProfile: a daemon thread records the stack of the profiled thread every
+    PROFILING_SAMPLING_INTERVAL_MS, counted as folded stacks (flame graph input format).
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.running = False
+        self.thread_id = None
+        self.sampler = None
+
+    def enable(self):
+        self.thread_id = threading.get_ident()
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def disable(self):
+        self.running = False
+        self.sampler.join()
+
+    def sample(self):
+        interval = PROFILING_SAMPLING_INTERVAL_MS / 1000
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)
+                self.stacks[";".join(f"{os.path.basename(entry.filename)}:{entry.name}" for entry in stack)] += 1
+            time.sleep(interval)
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def write_profile(name, started_at, wall_seconds, phases, profiler):
+    """
+    Writes one profile record to PROFILING_SINK: a log entry with the top functions, or a JSON summary plus the raw
+    profile (pstats dump or folded stacks) in a local directory or a GCS prefix.
+    """
+    record = {
+        "profile": name,
+        "started_at": started_at.isoformat(),
+        "wall_seconds": round(wall_seconds, 6),
+        "phases": {phase_name: round(seconds, 6) for phase_name, seconds in phases.items()},
+        "mode": PROFILING_MODE
+    }
+    if isinstance(profiler, StackSampler):
+        record["samples"] = sum(profiler.stacks.values())
+        top_text = "\n".join(profiler.folded().split("\n")[:PROFILING_TOP_FUNCTIONS])
+        raw_profile, extension = profiler.folded().encode("utf-8"), "folded"
+    else:
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_text)
+        stats.sort_stats("cumulative").print_stats(PROFILING_TOP_FUNCTIONS)
+        top_text = stats_text.getvalue()
+        raw_profile, extension = None, "prof"
+
+    if PROFILING_SINK == 'log':
+        record["top"] = top_text
+        print(json.dumps(record))
+        return
+
+    object_name = f"{name}/{started_at.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    if raw_profile is None:
+        dump_path = f"/tmp/{uuid.uuid4().hex}.prof"
+        stats.dump_stats(dump_path)
+        with open(dump_path, "rb") as dump_file:
+            raw_profile = dump_file.read()
+        os.remove(dump_path)
+    files = {f"{object_name}.json": json.dumps(record).encode("utf-8"), f"{object_name}.{extension}": raw_profile}
+
+    if PROFILING_SINK.startswith("gs://"):
+        from google.cloud import storage
+        bucket_name, _, prefix = PROFILING_SINK[len("gs://"):].partition("/")
+        bucket = storage.Client().bucket(bucket_name)
+        for file_name, content in files.items():
+            bucket.blob("/".join(part for part in (prefix.strip("/"), file_name) if part)).upload_from_string(content)
+    else:
+        for file_name, content in files.items():
+            path = os.path.join(PROFILING_SINK, file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as profile_file:
+                profile_file.write(content)
+    print(f"Profile of {name} written to {PROFILING_SINK}/{object_name}, {record['wall_seconds']}s")
@@ -0,0 +1,252 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import urllib.request
+import functions_framework
+import google.auth.transport.requests
+import google.oauth2.id_token
+from google.cloud import bigquery
+from google.cloud import error_reporting
+from structured_log import bind, get_logger
+from tracing import inject_trace_context, setup_tracing, traced, traced_request
+from profiling import phase, profiled
+
+# Access environment variables
+WORKFLOW_CONTROL_PROJECT_ID = os.environ.get('WORKFLOW_CONTROL_PROJECT_ID')
+WORKFLOW_CONTROL_DATASET_ID = os.environ.get('WORKFLOW_CONTROL_DATASET_ID')
+WORKFLOW_CONTROL_TABLE_ID = os.environ.get('WORKFLOW_CONTROL_TABLE_ID')
+WORKFLOW_JOB_PARAMS_TABLE_ID = os.environ.get('WORKFLOW_JOB_PARAMS_TABLE_ID', 'workflows_job_params')
+INTERMEDIATE_FUNCTION_URL = os.environ.get('INTERMEDIATE_FUNCTION_URL')
+# steps started within this many hours and not finished are checked
+WATCHDOG_LOOKBACK_HOURS = int(os.environ.get('WATCHDOG_LOOKBACK_HOURS', 72))
+# successful runs of the last days making the duration distribution of each job
+WATCHDOG_HISTORY_DAYS = int(os.environ.get('WATCHDOG_HISTORY_DAYS', 30))
+# jobs with fewer successful runs have no expected duration, only their hard limit applies
+WATCHDOG_MIN_HISTORY_RUNS = int(os.environ.get('WATCHDOG_MIN_HISTORY_RUNS', 5))
+# a step is an outlier once running longer than this percentile of its past durations times the factor
+WATCHDOG_PERCENTILE = int(os.environ.get('WATCHDOG_PERCENTILE', 95))
+WATCHDOG_OUTLIER_FACTOR = float(os.environ.get('WATCHDOG_OUTLIER_FACTOR', 2))
+# short jobs are never flagged before this many seconds, their distribution is too narrow to be meaningful
+WATCHDOG_MIN_ELAPSED_SECONDS = int(os.environ.get('WATCHDOG_MIN_ELAPSED_SECONDS', 900))
+# steps running longer than the max_runtime_seconds of their step or workflow properties are cancelled
+WATCHDOG_CANCEL_ENABLED = os.environ.get('WATCHDOG_CANCEL_ENABLED', 'false').lower() == 'true'
+
+# Logs
+error_client = error_reporting.Client()
+logger = get_logger('watchdog')
+
+# traces
+setup_tracing(os.environ.get('K_SERVICE', 'watchdog'))
+
+# clients
+bq_client = bigquery.Client(project=WORKFLOW_CONTROL_PROJECT_ID)
+
+
+@functions_framework.http
+@profiled("watchdog")
+@traced_request("watchdog")
+def main(request):
+    """
+    Main function, triggered periodically by cloud scheduler.
+    Compares the elapsed time of every open step of the control table with the durations of the past runs of its
+    job, and flags the outliers with a "stuck_step" log entry counted by the aef/stuck_steps log-based metric.
+    Steps past the hard limit of their job are cancelled through the intermediate function when enabled.
+
+    Args:
+        request: The incoming HTTP request object.
+
+    Returns:
+        dictionary with the number of checked steps, and the flagged and cancelled steps
+    """
+    try:
+        steps = get_open_steps()
+        flagged, cancelled = [], []
+        for step in steps:
+            bind({'execution_id': step['workflow_execution_id'], 'workflow_name': step['workflow_name'],
+                  'job_name': step['job_name'], 'async_job_id': step['async_job_id']})
+            verdict = evaluate_step(step)
+            if not verdict['stuck']:
+                continue
+            step_name = f"{step['workflow_name']}.{step['job_name']}:{step['workflow_execution_id']}"
+            flagged.append(step_name)
+            action = 'flagged'
+            if verdict['over_hard_limit'] and WATCHDOG_CANCEL_ENABLED:
+                action = cancel_step(step)
+                if action == 'cancelled':
+                    cancelled.append(step_name)
+            logger.warning("Step running for %ds, expected at most %ds", step['elapsed_seconds'],
+                           verdict['limit_seconds'], extra={"fields": {
+                               "stuck_step": True,
+                               "action": action,
+                               "elapsed_seconds": step['elapsed_seconds'],
+                               "expected_seconds": step['expected_seconds'],
+                               "history_runs": step['history_runs'],
+                               "max_runtime_seconds": verdict['max_runtime_seconds']}})
+        bind({})
+        logger.info("Checked %s open steps, %s flagged, %s cancelled", len(steps), len(flagged), len(cancelled))
+        return {"checked": len(steps), "flagged": flagged, "cancelled": cancelled}
+    except Exception as ex:
+        exception_message = "Exception : " + repr(ex)
+        error_client.report_exception()
+        logger.error(exception_message, exc_info=True)
+        return exception_message, 500
+
+
+@traced("bigquery.get_open_steps")
+@phase("bigquery_open_steps")
+def get_open_steps():
+    """
+    reads the steps whose last control table row is 'started', with their elapsed time, the duration percentile of
+    the successful runs of their job and their job params
+
+    Returns:
+        list of dictionaries, one per open step
+    """
+    control_table = f"{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_CONTROL_TABLE_ID}"
+    job_params_table = f"{WORKFLOW_CONTROL_PROJECT_ID}.{WORKFLOW_CONTROL_DATASET_ID}.{WORKFLOW_JOB_PARAMS_TABLE_ID}"
+    query = f"""
+        WITH runs AS (
+          SELECT
+            workflow_execution_id,
+            workflow_name,
+            job_name,
+            MAX(IF(job_status = 'started', timestamp, NULL)) AS started_at,
+            ARRAY_AGG(STRUCT(job_status, timestamp, async_job_id, params_hash, query_variables)
+                      ORDER BY timestamp DESC LIMIT 1)[OFFSET(0)] AS latest
+          FROM `{control_table}`
+          WHERE timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {WATCHDOG_HISTORY_DAYS} DAY)
+          GROUP BY workflow_execution_id, workflow_name, job_name
+        ),
+        history AS (
+          SELECT
+            workflow_name,
+            job_name,
+            COUNT(*) AS history_runs,
+            APPROX_QUANTILES(TIMESTAMP_DIFF(latest.timestamp, started_at, SECOND), 100)[OFFSET(@percentile)]
+              AS expected_seconds
+          FROM runs
+          WHERE latest.job_status = 'success' AND started_at IS NOT NULL
+          GROUP BY workflow_name, job_name
+        )
+        SELECT
+          runs.workflow_execution_id,
+          runs.workflow_name,
+          runs.job_name,
+          runs.latest.async_job_id,
+          TIMESTAMP_DIFF(CURRENT_TIMESTAMP(), runs.started_at, SECOND) AS elapsed_seconds,
+          history.history_runs,
+          history.expected_seconds,
+          TO_JSON_STRING(runs.latest.query_variables) AS query_variables,
+          TO_JSON_STRING(params.job_params) AS job_params
+        FROM runs
+        LEFT JOIN history USING (workflow_name, job_name)
+        LEFT JOIN (
+          SELECT params_hash, ANY_VALUE(job_params) AS job_params
+          FROM `{job_params_table}`
+          GROUP BY params_hash
+        ) AS params ON params.params_hash = runs.latest.params_hash
+        WHERE runs.latest.job_status = 'started'
+          AND runs.started_at > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @lookback_hours HOUR)
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("percentile", "INT64", WATCHDOG_PERCENTILE),
+        bigquery.ScalarQueryParameter("lookback_hours", "INT64", WATCHDOG_LOOKBACK_HOURS)
+    ])
+    steps = []
+    for row in bq_client.query(query, job_config=job_config).result():
+        step = dict(row.items())
+        # execution id and query variables are not part of the hashed job params, they come from the control row
+        query_variables = json.loads(step.pop('query_variables') or 'null')
+        step['job_params'] = {**json.loads(step['job_params']), 'execution_id': step['workflow_execution_id'],
+                              'query_variables': query_variables} if step['job_params'] else None
+        steps.append(step)
+    return steps
+
+
+def evaluate_step(step):
+    """
+    compares the elapsed time of an open step with the expected duration of its job and with its hard limit
+
+    Args:
+        step: open step, as returned by get_open_steps
+
+    Returns:
+        dictionary with stuck (the step is an outlier or past its hard limit), over_hard_limit, the
+        limit_seconds it exceeds (None if not known) and the max_runtime_seconds of the job (None if not set)
+    """
+    threshold_seconds = None
+    if (step['history_runs'] or 0) >= WATCHDOG_MIN_HISTORY_RUNS and step['expected_seconds'] is not None:
+        threshold_seconds = max(WATCHDOG_MIN_ELAPSED_SECONDS, step['expected_seconds'] * WATCHDOG_OUTLIER_FACTOR)
+    max_runtime_seconds = max_runtime_of(step['job_params'])
+    over_hard_limit = max_runtime_seconds is not None and step['elapsed_seconds'] > max_runtime_seconds
+    outlier = threshold_seconds is not None and step['elapsed_seconds'] > threshold_seconds
+    limits = [limit for limit in (threshold_seconds, max_runtime_seconds) if limit is not None]
+    return {
+        "stuck": outlier or over_hard_limit,
+        "over_hard_limit": over_hard_limit,
+        "limit_seconds": min(limits) if limits else None,
+        "max_runtime_seconds": max_runtime_seconds
+    }
+
+
+def max_runtime_of(job_params):
+    """
+    reads the hard limit of a step, max_runtime_seconds of its step properties overriding its workflow properties
+
+    Args:
+        job_params: stored request of the step, None if not found
+
+    Returns:
+        int seconds, or None if no limit is set
+    """
+    if not job_params:
+        return None
+    max_runtime_seconds = None
+    for field in ('workflow_properties', 'step_properties'):
+        properties = job_params.get(field) or {}
+        if isinstance(properties, str):
+            properties = json.loads(properties)
+        max_runtime_seconds = properties.get('max_runtime_seconds', max_runtime_seconds)
+    return int(max_runtime_seconds) if max_runtime_seconds else None
+
+
+@traced("intermediate.cancel_step", "job_name")
+@phase("cancel_step")
+def cancel_step(step):
+    """
+    cancels a step past its hard limit with the cancel call type of the intermediate function, which stops the
+    engine job and records the step as cancelled in the control table
+
+    Args:
+        step: open step, as returned by get_open_steps
+
+    Returns:
+        str: the status recorded by the intermediate function, or cancel_failed
+    """
+    if not step['job_params'] or not INTERMEDIATE_FUNCTION_URL:
+        logger.warning("Step can not be cancelled: %s", "job params not found" if INTERMEDIATE_FUNCTION_URL
+                       else "INTERMEDIATE_FUNCTION_URL not set")
+        return 'cancel_failed'
+    payload = {**step['job_params'], 'call_type': 'cancel', 'async_job_id': step['async_job_id']}
+    try:
+        auth_req = google.auth.transport.requests.Request()
+        id_token = google.oauth2.id_token.fetch_id_token(auth_req, INTERMEDIATE_FUNCTION_URL)
+        req = urllib.request.Request(INTERMEDIATE_FUNCTION_URL, data=json.dumps(payload).encode("utf-8"),
+                                     headers=inject_trace_context({"Content-Type": "application/json"}))
+        req.add_header("Authorization", f"Bearer {id_token}")
+        return urllib.request.urlopen(req).read().decode("utf-8")
+    except Exception as ex:
+        logger.warning("Step could not be cancelled: %r", ex)
+        return 'cancel_failed'
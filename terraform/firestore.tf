@@ -22,3 +22,28 @@ resource "google_firestore_database" "database" {
 }
 
 
+
+# step contexts of the intermediate function are deleted once expired
+resource "google_firestore_field" "step_contexts_ttl" {
+  project    = var.project
+  database   = google_firestore_database.database.name
+  collection = "workflows_step_contexts"
+  field      = "expire_at"
+  ttl_config {}
+  index_config {}
+}
+
+# admission queue of the pipeline executor, released by priority then age
+resource "google_firestore_index" "admission_queue" {
+  project    = var.project
+  database   = google_firestore_database.database.name
+  collection = "workflows_admission_queue"
+  fields {
+    field_path = "priority"
+    order      = "ASCENDING"
+  }
+  fields {
+    field_path = "enqueued_at"
+    order      = "ASCENDING"
+  }
+}
@@ -25,15 +25,44 @@ locals {
     { name = "retry_count", type = "INTEGER" }
   ])
 
+  workflows_control_v2 = jsonencode([
+    { name = "workflow_execution_id", type = "STRING" },
+    { name = "workflow_name", type = "STRING" },
+    { name = "job_name", type = "STRING" },
+    { name = "job_status", type = "STRING" },
+    { name = "timestamp", type = "TIMESTAMP" },
+    { name = "error_code", type = "STRING" },
+    { name = "params_hash", type = "STRING" },
+    { name = "query_variables", type = "JSON" },
+    { name = "async_job_id", type = "STRING" },
+    { name = "log_path", type = "STRING" },
+    { name = "retry_count", type = "INTEGER" },
+    { name = "schema_version", type = "INTEGER" }
+  ])
+
+  workflows_job_params = jsonencode([
+    { name = "params_hash", type = "STRING" },
+    { name = "job_params", type = "JSON" },
+    { name = "created_at", type = "TIMESTAMP" }
+  ])
+
+  # upstream API rate limits of the executors, also set on the intermediate function for co-located executors
+  processing_functions_environment = {
+    RATE_LIMIT_STORE = var.rate_limit_store
+    RATE_LIMITS      = jsonencode(var.rate_limits)
+  }
+
   compute_sa_roles = toset([
     "roles/cloudfunctions.admin",
     "roles/logging.logWriter",
+    "roles/cloudtrace.agent",
     "roles/cloudbuild.builds.builder",
     "roles/workflows.admin",
     "roles/bigquery.dataEditor",
     "roles/bigquery.admin",
     "roles/dataproc.worker",
     "roles/dataflow.admin",
-    "roles/dataflow.worker"
+    "roles/dataflow.worker",
+    "roles/datastore.user"
   ])
 }
\ No newline at end of file
@@ -31,10 +31,64 @@ module "pipeline-executor-function" {
     instance_count = 200
   }
   environment_variables = {
+    OTEL_TRACES_EXPORTER = var.traces_exporter
+    PROFILING_SAMPLE_RATE = var.profiling_sample_rate
+    PROFILING_SINK = var.profiling_sink
+    LOG_LEVEL = var.log_level
     WORKFLOW_CONTROL_PROJECT_ID = var.project
     WORKFLOW_CONTROL_DATASET_ID = module.bigquery-dataset.dataset_id
-    WORKFLOW_CONTROL_TABLE_ID = "workflows_control"
+    WORKFLOW_CONTROL_TABLE_ID = "workflows_control_v2"
     WORKFLOWS_LOCATION = var.region
+    ADMISSION_GLOBAL_LIMIT = var.admission_global_limit
+    ADMISSION_WORKFLOW_LIMIT = var.admission_workflow_limit
+  }
+}
+
+module "pipeline-drain-function" {
+  count       = var.admission_global_limit > 0 ? 1 : 0
+  source      = "github.com/GoogleCloudPlatform/cloud-foundation-fabric/modules/cloud-function-v2"
+  project_id  = var.project
+  region      = var.region
+  name        = "orch-framework-pipeline-drain"
+  bucket_name = "${var.project}-pipeline-drain-function-bucket"
+  bucket_config = {
+    force_destroy = true
+  }
+  bundle_config = {
+    path  = "../functions/orchestration-helpers/pipeline-executor"
+  }
+  function_config = {
+    entry_point = "drain",
+    runtime = "python39",
+    instance_count = 1
+  }
+  environment_variables = {
+    OTEL_TRACES_EXPORTER = var.traces_exporter
+    PROFILING_SAMPLE_RATE = var.profiling_sample_rate
+    PROFILING_SINK = var.profiling_sink
+    LOG_LEVEL = var.log_level
+    WORKFLOW_CONTROL_PROJECT_ID = var.project
+    WORKFLOW_CONTROL_DATASET_ID = module.bigquery-dataset.dataset_id
+    WORKFLOW_CONTROL_TABLE_ID = "workflows_control_v2"
+    WORKFLOWS_LOCATION = var.region
+    ADMISSION_GLOBAL_LIMIT = var.admission_global_limit
+    ADMISSION_WORKFLOW_LIMIT = var.admission_workflow_limit
+  }
+}
+
+resource "google_cloud_scheduler_job" "pipeline-drain-tick" {
+  count     = var.admission_global_limit > 0 ? 1 : 0
+  project   = var.project
+  region    = var.region
+  name      = "orch-framework-pipeline-drain-tick"
+  schedule  = "* * * * *"
+  time_zone = "UTC"
+  http_target {
+    http_method = "POST"
+    uri         = module.pipeline-drain-function[0].uri
+    oidc_token {
+      service_account_email = "${data.google_project.project.number}-compute@developer.gserviceaccount.com"
+    }
   }
 }
 
@@ -48,16 +102,30 @@ module "intermediate-function" {
     force_destroy = true
   }
   bundle_config = {
-    path  = "../functions/orchestration-helpers/intermediate"
+    # bundle built by colocate_executors.sh when executors are co-located
+    path  = length(var.co_located_executors) > 0 ? "../build/intermediate" : "../functions/orchestration-helpers/intermediate"
   }
   function_config = {
     runtime = "python39",
     instance_count = 200
   }
+  # co-located executors run with the identity of the intermediate function
+  service_account = length(var.co_located_executors) > 0 ? module.aef-processing-function-sa.email : null
   environment_variables = {
+    OTEL_TRACES_EXPORTER = var.traces_exporter
+    PROFILING_SAMPLE_RATE = var.profiling_sample_rate
+    PROFILING_SINK = var.profiling_sink
+    LOG_LEVEL = var.log_level
+    CO_LOCATED_EXECUTORS = join(",", [for executor in var.co_located_executors : "${executor}=executors.${replace(executor, "-", "_")}.main"])
+    THREADS = var.intermediate_threads
+    CONTEXT_HANDLES = var.context_handles
+    CONTEXT_FIRESTORE_COLLECTION = "workflows_step_contexts"
+    RATE_LIMIT_STORE = var.rate_limit_store
+    RATE_LIMITS = jsonencode(var.rate_limits)
     WORKFLOW_CONTROL_PROJECT_ID = var.project
     WORKFLOW_CONTROL_DATASET_ID = module.bigquery-dataset.dataset_id
-    WORKFLOW_CONTROL_TABLE_ID = "workflows_control"
+    WORKFLOW_CONTROL_TABLE_ID = "workflows_control_v2"
+    WORKFLOW_JOB_PARAMS_TABLE_ID = "workflows_job_params"
   }
 }
 
@@ -105,6 +173,7 @@ module "scheduling-function" {
     WORKFLOW_SCHEDULING_PROJECT_NUMBER = data.google_project.project.number
     WORKFLOW_SCHEDULING_PROJECT_REGION = var.region
     PIPELINE_EXECUTION_FUNCTION_NAME = module.pipeline-executor-function.function_name
+    SCHEDULING_MODE = var.scheduling_mode
   }
   trigger_config = {
     event_type = "google.cloud.firestore.document.v1.written"
@@ -119,6 +188,124 @@ module "scheduling-function" {
   depends_on = [google_firestore_database.database, google_project_iam_member.compute_default_sa_roles]
 }
 
+module "scheduling-reconciler-function" {
+  source      = "github.com/GoogleCloudPlatform/cloud-foundation-fabric/modules/cloud-function-v2"
+  project_id  = var.project
+  region      = var.region
+  name        = "orch-framework-scheduling-reconciler"
+  bucket_name = "${var.project}-scheduling-reconciler-function-bucket"
+  bucket_config = {
+    force_destroy = true
+  }
+  bundle_config = {
+    path  = "../functions/orchestration-helpers/scheduling"
+  }
+  function_config = {
+    entry_point = "reconcile",
+    runtime = "python39",
+    instance_count = 1,
+    timeout_seconds = 3600
+  }
+  environment_variables = {
+    WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION = var.workflows_scheduling_table_name
+    WORKFLOW_SCHEDULING_PROJECT_ID = var.project
+    WORKFLOW_SCHEDULING_PROJECT_NUMBER = data.google_project.project.number
+    WORKFLOW_SCHEDULING_PROJECT_REGION = var.region
+    PIPELINE_EXECUTION_FUNCTION_NAME = module.pipeline-executor-function.function_name
+    SCHEDULING_MODE = var.scheduling_mode
+  }
+  service_account = module.aef-scheduling-function-sa.email
+  depends_on = [google_firestore_database.database, google_project_iam_member.compute_default_sa_roles]
+}
+
+module "dispatcher-function" {
+  count       = var.scheduling_mode == "DISPATCHER" ? 1 : 0
+  source      = "github.com/GoogleCloudPlatform/cloud-foundation-fabric/modules/cloud-function-v2"
+  project_id  = var.project
+  region      = var.region
+  name        = "orch-framework-dispatcher"
+  bucket_name = "${var.project}-dispatcher-function-bucket"
+  bucket_config = {
+    force_destroy = true
+  }
+  bundle_config = {
+    path  = "../functions/orchestration-helpers/dispatcher"
+  }
+  function_config = {
+    runtime = "python39",
+    instance_count = 1
+  }
+  environment_variables = {
+    WORKFLOW_SCHEDULING_FIRESTORE_COLLECTION = var.workflows_scheduling_table_name
+    WORKFLOW_SCHEDULING_PROJECT_ID = var.project
+    WORKFLOW_SCHEDULING_PROJECT_REGION = var.region
+    PIPELINE_EXECUTION_FUNCTION_NAME = module.pipeline-executor-function.function_name
+  }
+  depends_on = [google_firestore_database.database, google_project_iam_member.compute_default_sa_roles]
+}
+
+resource "google_cloud_scheduler_job" "dispatcher-tick" {
+  count     = var.scheduling_mode == "DISPATCHER" ? 1 : 0
+  project   = var.project
+  region    = var.region
+  name      = "orch-framework-dispatcher-tick"
+  schedule  = "* * * * *"
+  time_zone = "UTC"
+  http_target {
+    http_method = "POST"
+    uri         = module.dispatcher-function[0].uri
+    oidc_token {
+      service_account_email = "${data.google_project.project.number}-compute@developer.gserviceaccount.com"
+    }
+  }
+}
+
+module "watchdog-function" {
+  source      = "github.com/GoogleCloudPlatform/cloud-foundation-fabric/modules/cloud-function-v2"
+  project_id  = var.project
+  region      = var.region
+  name        = "orch-framework-watchdog"
+  bucket_name = "${var.project}-watchdog-function-bucket"
+  bucket_config = {
+    force_destroy = true
+  }
+  bundle_config = {
+    path  = "../functions/orchestration-helpers/watchdog"
+  }
+  function_config = {
+    runtime = "python39",
+    instance_count = 1
+  }
+  environment_variables = {
+    OTEL_TRACES_EXPORTER = var.traces_exporter
+    PROFILING_SAMPLE_RATE = var.profiling_sample_rate
+    PROFILING_SINK = var.profiling_sink
+    LOG_LEVEL = var.log_level
+    WORKFLOW_CONTROL_PROJECT_ID = var.project
+    WORKFLOW_CONTROL_DATASET_ID = module.bigquery-dataset.dataset_id
+    WORKFLOW_CONTROL_TABLE_ID = "workflows_control_v2"
+    WORKFLOW_JOB_PARAMS_TABLE_ID = "workflows_job_params"
+    INTERMEDIATE_FUNCTION_URL = module.intermediate-function.uri
+    WATCHDOG_CANCEL_ENABLED = var.watchdog_cancel_enabled
+  }
+  depends_on = [google_project_iam_member.compute_default_sa_roles]
+}
+
+resource "google_cloud_scheduler_job" "watchdog-tick" {
+  project   = var.project
+  region    = var.region
+  name      = "orch-framework-watchdog-tick"
+  schedule  = var.watchdog_schedule
+  time_zone = "UTC"
+  http_target {
+    http_method = "POST"
+    uri         = module.watchdog-function.uri
+    oidc_token {
+      service_account_email = "${data.google_project.project.number}-compute@developer.gserviceaccount.com"
+    }
+  }
+}
+
 resource "google_project_iam_member" "compute_default_sa_roles" {
   for_each = local.compute_sa_roles
   project = var.project
@@ -136,6 +323,46 @@ module "bigquery-dataset" {
       schema              = local.workflows_control
       deletion_protection = false
     }
+    workflows_control_v2 = {
+      friendly_name       = "workflows_control_v2"
+      schema              = local.workflows_control_v2
+      deletion_protection = false
+      partitioning = {
+        time = { type = "DAY", field = "timestamp" }
+      }
+      options = {
+        clustering = ["workflow_name", "job_name", "workflow_execution_id"]
+      }
+    }
+    workflows_job_params = {
+      friendly_name       = "workflows_job_params"
+      schema              = local.workflows_job_params
+      deletion_protection = false
+    }
   }
 }
 
+# latest status per job of each workflow execution, read by dashboards and by the scheduling of reruns
+resource "google_bigquery_table" "workflows_control_latest" {
+  project             = var.project
+  dataset_id          = module.bigquery-dataset.dataset_id
+  table_id            = "workflows_control_latest"
+  deletion_protection = false
+  max_staleness       = "0-0 0 0:5:0"
+  materialized_view {
+    enable_refresh                   = true
+    refresh_interval_ms              = 300000
+    allow_non_incremental_definition = true
+    query                            = <<-EOT
+      SELECT
+        workflow_execution_id,
+        workflow_name,
+        job_name,
+        ARRAY_AGG(STRUCT(job_status, timestamp, error_code, params_hash, async_job_id, retry_count)
+                  ORDER BY timestamp DESC LIMIT 1)[OFFSET(0)] AS latest
+      FROM `${var.project}.${module.bigquery-dataset.dataset_id}.workflows_control_v2`
+      GROUP BY workflow_execution_id, workflow_name, job_name
+    EOT
+  }
+  depends_on = [module.bigquery-dataset]
+}
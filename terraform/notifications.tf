@@ -41,4 +41,84 @@ resource "google_monitoring_alert_policy" "alert-intermediate-function" {
       period = "300s"
     }
   }
-}
\ No newline at end of file
+}
+resource "google_logging_metric" "scheduler-calls-avoided" {
+  name    = "aef/scheduler_calls_avoided"
+  project = var.project
+  filter  = "resource.type=\"cloud_run_revision\" resource.labels.service_name=\"${module.scheduling-function.function_name}\" jsonPayload.scheduler_calls_avoided:*"
+  metric_descriptor {
+    metric_kind = "DELTA"
+    value_type  = "DISTRIBUTION"
+    unit        = "1"
+    labels {
+      key        = "job_type"
+      value_type = "STRING"
+    }
+  }
+  value_extractor = "EXTRACT(jsonPayload.scheduler_calls_avoided)"
+  label_extractors = {
+    "job_type" = "EXTRACT(jsonPayload.job_type)"
+  }
+  bucket_options {
+    linear_buckets {
+      num_finite_buckets = 3
+      width              = 1
+      offset             = 0
+    }
+  }
+}
+
+# open steps running far longer than the past runs of their job, or past their hard limit, flagged by the watchdog
+resource "google_logging_metric" "stuck-steps" {
+  name    = "aef/stuck_steps"
+  project = var.project
+  filter  = "resource.type=\"cloud_run_revision\" resource.labels.service_name=\"${module.watchdog-function.function_name}\" jsonPayload.stuck_step=true"
+  metric_descriptor {
+    metric_kind = "DELTA"
+    value_type  = "INT64"
+    unit        = "1"
+    labels {
+      key        = "workflow_name"
+      value_type = "STRING"
+    }
+    labels {
+      key        = "job_name"
+      value_type = "STRING"
+    }
+    labels {
+      key        = "action"
+      value_type = "STRING"
+    }
+  }
+  label_extractors = {
+    "workflow_name" = "EXTRACT(jsonPayload.workflow_name)"
+    "job_name"      = "EXTRACT(jsonPayload.job_name)"
+    "action"        = "EXTRACT(jsonPayload.action)"
+  }
+}
+
+resource "google_monitoring_alert_policy" "alert-stuck-steps" {
+  display_name = "workflow steps stuck alert policy"
+  project      = var.project
+  combiner     = "OR"
+  conditions {
+    display_name = "Stuck step condition"
+    condition_threshold {
+      filter          = "resource.type=\"cloud_run_revision\" AND metric.type=\"logging.googleapis.com/user/${google_logging_metric.stuck-steps.name}\""
+      comparison      = "COMPARISON_GT"
+      threshold_value = 0
+      duration        = "0s"
+      aggregations {
+        alignment_period     = "600s"
+        per_series_aligner   = "ALIGN_SUM"
+        cross_series_reducer = "REDUCE_SUM"
+        group_by_fields      = ["metric.label.workflow_name", "metric.label.job_name"]
+      }
+    }
+  }
+
+  notification_channels = [ google_monitoring_notification_channel.email-error-channel.name ]
+  alert_strategy {
+    auto_close = "3600s"
+  }
+}
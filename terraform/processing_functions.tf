@@ -44,6 +44,7 @@ module "bq-saved-query-executor" {
     runtime = "python39",
     instance_count = 200
   }
+  environment_variables = local.processing_functions_environment
   service_account = module.aef-processing-function-sa.email
 }
 
@@ -63,6 +64,7 @@ module "dataform-tag-executor" {
     runtime = "python39",
     instance_count = 200
   }
+  environment_variables = local.processing_functions_environment
   service_account = module.aef-processing-function-sa.email
 }
 
@@ -82,6 +84,7 @@ module "dataflow-flextemplate-job-executor" {
     runtime = "python39",
     instance_count = 200
   }
+  environment_variables = local.processing_functions_environment
   service_account = module.aef-processing-function-sa.email
 }
 
@@ -101,5 +104,6 @@ module "dataproc-serverless-job-executor" {
     runtime = "python39",
     instance_count = 200
   }
+  environment_variables = local.processing_functions_environment
   service_account = module.aef-processing-function-sa.email
 }
\ No newline at end of file
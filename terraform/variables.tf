@@ -39,3 +39,119 @@ variable "workflows_scheduling_table_name" {
   default     = "workflows_scheduling"
 }
 
+variable "scheduling_mode" {
+  description = "CLOUD_SCHEDULER to create one Cloud Scheduler job per workflow, DISPATCHER to evaluate every schedule from a single minutely dispatcher function"
+  type        = string
+  nullable    = false
+  default     = "CLOUD_SCHEDULER"
+  validation {
+    condition     = contains(["CLOUD_SCHEDULER", "DISPATCHER"], var.scheduling_mode)
+    error_message = "scheduling_mode must be CLOUD_SCHEDULER or DISPATCHER."
+  }
+}
+
+variable "admission_global_limit" {
+  description = "Maximum number of concurrent workflow executions launched by the pipeline executor, excess requests are queued. 0 disables admission control"
+  type        = number
+  nullable    = false
+  default     = 0
+}
+
+variable "admission_workflow_limit" {
+  description = "Default maximum number of concurrent executions of the same workflow when admission control is enabled, overridable with the max_concurrency workflow property"
+  type        = number
+  nullable    = false
+  default     = 1
+}
+
+variable "traces_exporter" {
+  description = "OpenTelemetry traces exporter of the orchestration functions: gcp (Cloud Trace), otlp, console or none"
+  type        = string
+  nullable    = false
+  default     = "gcp"
+  validation {
+    condition     = contains(["gcp", "otlp", "console", "none"], var.traces_exporter)
+    error_message = "traces_exporter must be gcp, otlp, console or none."
+  }
+}
+
+variable "profiling_sample_rate" {
+  description = "Share of the pipeline executor and intermediate function invocations profiled, between 0 (disabled) and 1"
+  type        = number
+  nullable    = false
+  default     = 0
+}
+
+variable "profiling_sink" {
+  description = "Destination of the profiles: log, or a gs://bucket/prefix uri"
+  type        = string
+  nullable    = false
+  default     = "log"
+}
+
+variable "log_level" {
+  description = "Level of the structured logs of the orchestration functions: DEBUG logs the request payloads"
+  type        = string
+  nullable    = false
+  default     = "INFO"
+  validation {
+    condition     = contains(["DEBUG", "INFO", "WARNING", "ERROR"], var.log_level)
+    error_message = "log_level must be DEBUG, INFO, WARNING or ERROR."
+  }
+}
+
+variable "co_located_executors" {
+  description = "Executors bundled with the intermediate function and called in-process, see functions/orchestration-helpers/intermediate/utilities/colocate_executors.sh"
+  type        = list(string)
+  nullable    = false
+  default     = []
+}
+
+variable "intermediate_threads" {
+  description = "Request threads of each intermediate function instance, their I/O shares one event loop. Raise the Cloud Run concurrency of the function to match"
+  type        = number
+  nullable    = false
+  default     = 250
+}
+
+variable "context_handles" {
+  description = "Return a context handle from the intermediate function get_id calls, status polls then only send the handle as async_job_id"
+  type        = bool
+  nullable    = false
+  default     = false
+}
+
+variable "rate_limit_store" {
+  description = "Store of the upstream API token buckets of the executors: local (per instance), firestore or redis (shared by every instance)"
+  type        = string
+  nullable    = false
+  default     = "local"
+  validation {
+    condition     = contains(["local", "firestore", "redis"], var.rate_limit_store)
+    error_message = "rate_limit_store must be local, firestore or redis."
+  }
+}
+
+variable "rate_limits" {
+  description = "Overrides of the default upstream API rate limits of the executors, by API method (eg. dataproc.batches.create)"
+  type = map(object({
+    rate_per_second = optional(number)
+    burst           = optional(number)
+  }))
+  nullable = false
+  default  = {}
+}
+
+variable "watchdog_schedule" {
+  description = "Cloud scheduler crond expression of the watchdog function flagging the steps running far longer than usual"
+  type        = string
+  nullable    = false
+  default     = "*/10 * * * *"
+}
+
+variable "watchdog_cancel_enabled" {
+  description = "Let the watchdog function cancel the steps running longer than the max_runtime_seconds of their step or workflow properties"
+  type        = bool
+  nullable    = false
+  default     = false
+}
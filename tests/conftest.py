@@ -0,0 +1,63 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import importlib.util
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "functions")
+# cloud clients are created at import time by the functions, their modules are replaced by mocks
+MOCKED_MODULES = [
+    "functions_framework", "cloudevents", "cloudevents.http",
+    "google", "google.auth", "google.auth.transport", "google.auth.transport.requests", "google.oauth2",
+    "google.oauth2.id_token", "google.cloud", "google.cloud.logging", "google.cloud.error_reporting",
+    "google.cloud.firestore", "google.cloud.scheduler_v1", "google.events", "google.events.cloud",
+    "google.events.cloud.firestore", "google.cloud.workflows", "google.cloud.workflows.executions_v1",
+    "google.cloud.workflows.executions_v1.types", "google.cloud.workflows.executions_v1.types.executions",
+    "google.api_core", "google.api_core.exceptions",
+]
+# helper modules duplicated in every function bundle
+BUNDLE_MODULES = ["main", "cron", "profiling", "admission", "structured_log", "tracing"]
+
+
+@pytest.fixture
+def load_function():
+    """
+    returns a loader of a function module from its bundle directory under functions/, the cloud client
+    libraries being mocked and the entry point decorators left out
+    """
+    def load(bundle, module="main"):
+        bundle_dir = os.path.join(FUNCTIONS_DIR, bundle)
+        modules = {name: mock.MagicMock() for name in MOCKED_MODULES}
+        modules["functions_framework"].http = lambda function: function
+        modules["functions_framework"].cloud_event = lambda function: function
+        # only the mocked and bundle modules are restored, standard modules imported meanwhile are kept
+        saved_modules = {name: sys.modules.pop(name, None) for name in MOCKED_MODULES + BUNDLE_MODULES}
+        sys.modules.update(modules)
+        sys.path.insert(0, bundle_dir)
+        try:
+            spec = importlib.util.spec_from_file_location(f"{bundle.replace('/', '_')}_{module}",
+                                                          os.path.join(bundle_dir, f"{module}.py"))
+            loaded = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(loaded)
+        finally:
+            sys.path.remove(bundle_dir)
+            for name, saved_module in saved_modules.items():
+                sys.modules.pop(name, None)
+                if saved_module is not None:
+                    sys.modules[name] = saved_module
+        return loaded
+    return load
@@ -0,0 +1,75 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+
+import pytest
+
+UTC = datetime.timezone.utc
+
+
+@pytest.fixture
+def cron(load_function):
+    return load_function("orchestration-helpers/dispatcher", "cron")
+
+
+def fire_times(cron, crond_expression, time_zone, after, count):
+    schedule = cron.CronSchedule(crond_expression, time_zone)
+    times = []
+    for _ in range(count):
+        after = schedule.next_fire_time(after)
+        times.append(after)
+    return times
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+def test_skipped_local_time_fires_at_the_change(cron):
+    # 2024-03-10 02:00 EST jumps to 03:00 EDT, 02:30 does not exist that day
+    assert fire_times(cron, "30 2 * * *", "America/New_York", utc(2024, 3, 10), 2) == [
+        utc(2024, 3, 10, 7, 0), utc(2024, 3, 11, 6, 30)]
+
+
+def test_skipped_local_times_fire_once(cron):
+    # 02:00 and 02:30 EST are both skipped, they fire once at 03:00 EDT
+    assert fire_times(cron, "*/30 * * * *", "America/New_York", utc(2024, 3, 10, 6, 0), 3) == [
+        utc(2024, 3, 10, 6, 30), utc(2024, 3, 10, 7, 0), utc(2024, 3, 10, 7, 30)]
+
+
+def test_repeated_local_time_fires_once(cron):
+    # 2024-11-03 02:00 EDT falls back to 01:00 EST, 01:30 happens twice
+    assert fire_times(cron, "30 1 * * *", "America/New_York", utc(2024, 11, 3), 2) == [
+        utc(2024, 11, 3, 5, 30), utc(2024, 11, 4, 6, 30)]
+
+
+def test_repeated_hour_is_not_fired_again(cron):
+    # 01:00 and 01:30 fire in EDT only, then 02:00 EST
+    assert fire_times(cron, "*/30 * * * *", "America/New_York", utc(2024, 11, 3, 4, 45), 4) == [
+        utc(2024, 11, 3, 5, 0), utc(2024, 11, 3, 5, 30), utc(2024, 11, 3, 7, 0), utc(2024, 11, 3, 7, 30)]
+
+
+def test_restricted_day_of_month_and_week_match_with_or(cron):
+    assert fire_times(cron, "0 0 13 * FRI", "UTC", utc(2024, 9, 1), 3) == [
+        utc(2024, 9, 6), utc(2024, 9, 13), utc(2024, 9, 20)]
+
+
+def test_schedule_never_firing(cron):
+    assert cron.CronSchedule("0 0 30 2 *").next_fire_time(utc(2024, 1, 1)) is None
+
+
+@pytest.mark.parametrize("crond_expression", ["* * * *", "60 * * * *", "0 0 0 * *", "0 0 * 13 *", "5-1 * * * *"])
+def test_invalid_expressions(cron, crond_expression):
+    with pytest.raises(ValueError):
+        cron.CronSchedule(crond_expression)
@@ -0,0 +1,134 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import time
+from types import SimpleNamespace
+
+import pytest
+
+UTC = datetime.timezone.utc
+TIME_ZONES = ["UTC", "America/New_York", "Europe/London", "Asia/Kolkata", "Australia/Sydney"]
+
+
+def schedule(crond_expression, time_zone="UTC", workflow_status="ENABLED"):
+    return {"crond_expression": crond_expression, "time_zone": time_zone, "date_format": "%Y-%m-%d",
+            "workflow_status": workflow_status, "workflow_properties": "{}"}
+
+
+class FakeFirestore:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def collection(self, name):
+        return self
+
+    def stream(self):
+        return [SimpleNamespace(id=doc_id, to_dict=lambda document=document: document)
+                for doc_id, document in self.documents.items()]
+
+
+def new_index():
+    return {"loaded_at": 0, "schedules": {}, "heap": [], "evaluated_until": None}
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+@pytest.fixture
+def dispatcher(load_function):
+    return load_function("orchestration-helpers/dispatcher")
+
+
+def due_names(dispatcher, window_end, firestore_db, index):
+    return sorted(workflow["workflows_name"]
+                  for workflow in dispatcher.get_due_workflows(window_end, firestore_db, index))
+
+
+def test_fires_the_schedules_due_in_the_minute(dispatcher):
+    firestore_db = FakeFirestore({
+        "hourly": schedule("0 * * * *"),
+        "daily": schedule("0 7 * * *"),
+        "new_york": schedule("0 3 * * *", "America/New_York"),
+        "disabled": schedule("0 * * * *", workflow_status="DISABLED"),
+    })
+    index = new_index()
+
+    assert due_names(dispatcher, utc(2024, 6, 1, 6, 59), firestore_db, index) == []
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 0), firestore_db, index) == ["daily", "hourly", "new_york"]
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 1), firestore_db, index) == []
+    assert due_names(dispatcher, utc(2024, 6, 1, 8, 0), firestore_db, index) == ["hourly"]
+
+
+def test_same_tick_does_not_fire_twice(dispatcher):
+    firestore_db = FakeFirestore({"hourly": schedule("0 * * * *")})
+    index = new_index()
+
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 0), firestore_db, index) == ["hourly"]
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 0), firestore_db, index) == []
+
+
+def test_late_tick_fires_the_missed_schedules_once(dispatcher):
+    firestore_db = FakeFirestore({"every_minute": schedule("* * * * *"), "quarter": schedule("15 * * * *")})
+    index = new_index()
+    due_names(dispatcher, utc(2024, 6, 1, 7, 10), firestore_db, index)
+
+    # ticks of 07:11 to 07:19 were missed
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 20), firestore_db, index) == ["every_minute", "quarter"]
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 21), firestore_db, index) == ["every_minute"]
+
+
+def test_missed_fire_times_older_than_the_catch_up_bound_are_skipped(dispatcher, monkeypatch):
+    monkeypatch.setattr(dispatcher, "DISPATCH_CATCH_UP_MINUTES", 30)
+    firestore_db = FakeFirestore({"quarter": schedule("15 * * * *"), "half": schedule("50 * * * *")})
+    index = new_index()
+    due_names(dispatcher, utc(2024, 6, 1, 7, 10), firestore_db, index)
+
+    assert due_names(dispatcher, utc(2024, 6, 1, 8, 0), firestore_db, index) == ["half"]
+    assert due_names(dispatcher, utc(2024, 6, 1, 8, 15), firestore_db, index) == ["quarter"]
+
+
+def test_index_refresh_keeps_the_window(dispatcher, monkeypatch):
+    firestore_db = FakeFirestore({"quarter": schedule("15 * * * *")})
+    index = new_index()
+    due_names(dispatcher, utc(2024, 6, 1, 7, 10), firestore_db, index)
+    firestore_db.documents["added"] = schedule("12 * * * *")
+    index["loaded_at"] = 0
+
+    # the rebuilt index starts at the last evaluated minute, missed fire times of new schedules included
+    assert due_names(dispatcher, utc(2024, 6, 1, 7, 15), firestore_db, index) == ["added", "quarter"]
+
+
+def test_tens_of_thousands_of_schedules(dispatcher):
+    documents = {f"workflow_{number}": schedule(f"{number % 60} {number % 24} * * *",
+                                                TIME_ZONES[number % len(TIME_ZONES)])
+                 for number in range(20000)}
+    firestore_db = FakeFirestore(documents)
+    index = new_index()
+    window_end = utc(2024, 6, 1, 0, 0)
+    due_names(dispatcher, window_end, firestore_db, index)
+
+    fired = []
+    started = time.monotonic()
+    for minute in range(1, 61):
+        fired += due_names(dispatcher, window_end + datetime.timedelta(minutes=minute), firestore_db, index)
+    elapsed = time.monotonic() - started
+
+    expected = sorted(name for name, document in documents.items()
+                      if dispatcher.CronSchedule(document["crond_expression"], document["time_zone"])
+                      .next_fire_time(window_end) <= window_end + datetime.timedelta(minutes=60))
+    assert sorted(fired) == expected
+    assert len(set(fired)) == len(fired)
+    # an hour of ticks only touches the due schedules of the heap
+    assert elapsed < 5
@@ -0,0 +1,189 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+BUNDLE = "orchestration-helpers/pipeline-executor"
+
+
+@pytest.fixture
+def admission(load_function):
+    return load_function(BUNDLE, "admission")
+
+
+@pytest.fixture
+def pipeline_executor(load_function, monkeypatch):
+    # the function traces its launches, the tracing dependencies are only needed by these tests
+    pytest.importorskip("opentelemetry.sdk")
+    module = load_function(BUNDLE)
+    monkeypatch.setattr(module, "ADMISSION_GLOBAL_LIMIT", 2)
+    monkeypatch.setattr(module, "ADMISSION_WORKFLOW_LIMIT", 1)
+    monkeypatch.setattr(module, "launch_event", FakeLauncher())
+    monkeypatch.setattr(module.workflows_client, "workflow_path",
+                        lambda project, location, workflow_name: f"workflows/{workflow_name}")
+    return module
+
+
+class FakeLauncher:
+    """launches every event as a new execution, or fails for the workflows in failing"""
+
+    def __init__(self):
+        self.launched = []
+        self.failing = set()
+
+    def __call__(self, event):
+        if event["workflows_name"] in self.failing:
+            raise RuntimeError(f"Workflow {event['workflows_name']} not found")
+        self.launched.append(event["workflows_name"])
+        return f"execution-{len(self.launched)}", "launched"
+
+
+def event(workflows_name, priority="NORMAL"):
+    return {"workflows_name": workflows_name, "start_date": "2024-01-01", "end_date": "2024-01-01",
+            "priority": priority, "workflow_properties": "{}"}
+
+
+def queued_names(store):
+    return [entry["event"]["workflows_name"] for _, entry in store.queued()]
+
+
+def slot(workflow_name):
+    return {"workflow_name": workflow_name, "execution_name": None, "acquired_at": 0}
+
+
+def test_global_limit_counts_every_running_execution(admission):
+    slots = {"1": slot("a"), "2": slot("b")}
+    assert not admission.has_capacity(slots, "c", 2, 0)
+    assert admission.has_capacity(slots, "c", 3, 0)
+
+
+def test_workflow_limit_counts_the_executions_of_the_same_workflow(admission):
+    slots = {"1": slot("a"), "2": slot("a"), "3": slot("b")}
+    assert not admission.has_capacity(slots, "a", 10, 2)
+    assert admission.has_capacity(slots, "b", 10, 2)
+    assert admission.has_capacity(slots, "a", 10, 3)
+
+
+def test_zero_limits_do_not_limit(admission):
+    slots = {str(index): slot("a") for index in range(100)}
+    assert admission.has_capacity(slots, "a", 0, 0)
+
+
+def test_store_queues_by_priority_then_age(admission):
+    store = admission.InMemoryAdmissionStore()
+    for workflows_name, priority in [("low", "LOW"), ("normal", "NORMAL"), ("high", "HIGH"), ("normal2", "NORMAL")]:
+        store.enqueue(event(workflows_name), priority)
+    assert queued_names(store) == ["high", "normal", "normal2", "low"]
+    assert store.head()[1]["event"]["workflows_name"] == "high"
+
+
+def test_requests_within_the_limits_are_launched(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    assert pipeline_executor.admit_workflow(store, event("a")) == ("execution-1", "launched")
+    assert pipeline_executor.admit_workflow(store, event("b")) == ("execution-2", "launched")
+    assert sorted(slot["execution_name"] for slot in store.slots().values()) == [
+        "workflows/a/executions/execution-1", "workflows/b/executions/execution-2"]
+
+
+def test_requests_over_the_limits_are_queued(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    pipeline_executor.admit_workflow(store, event("a"))
+    pipeline_executor.admit_workflow(store, event("b"))
+    execution_id, decision = pipeline_executor.admit_workflow(store, event("c"))
+    assert decision == "queued" and execution_id.startswith("queued_")
+    assert queued_names(store) == ["c"]
+
+
+def test_drain_skips_queued_requests_held_by_their_workflow_limit(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    pipeline_executor.admit_workflow(store, event("a"))
+    assert pipeline_executor.admit_workflow(store, event("a"))[1] == "queued"
+    # queued behind the second "a", although a global slot is free
+    assert pipeline_executor.admit_workflow(store, event("b"))[1] == "queued"
+
+    report = pipeline_executor.drain_queue(store, lambda execution_name: "ACTIVE")
+
+    assert list(report["launched"].values()) == ["execution-2"]
+    assert pipeline_executor.launch_event.launched == ["a", "b"]
+    assert queued_names(store) == ["a"]
+
+
+def test_new_requests_do_not_overtake_queued_ones(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    store.enqueue(event("queued"), "NORMAL")
+    assert pipeline_executor.admit_workflow(store, event("new"))[1] == "queued"
+    assert pipeline_executor.admit_workflow(store, event("low", "LOW"))[1] == "queued"
+    assert store.slots() == {}
+    assert queued_names(store) == ["queued", "new", "low"]
+
+
+def test_higher_priority_requests_are_launched_before_the_queue_head(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    store.enqueue(event("queued"), "NORMAL")
+    assert pipeline_executor.admit_workflow(store, event("urgent", "HIGH")) == ("execution-1", "launched")
+    assert queued_names(store) == ["queued"]
+
+
+def test_contended_requests_are_queued(pipeline_executor, admission):
+    class ContendedStore(admission.InMemoryAdmissionStore):
+        def try_acquire(self, workflow_name, global_limit, workflow_limit):
+            raise pipeline_executor.AdmissionContention("Semaphore contended")
+
+    store = ContendedStore()
+    assert pipeline_executor.admit_workflow(store, event("a"))[1] == "queued"
+    assert queued_names(store) == ["a"]
+
+
+def test_drain_releases_finished_executions_and_launches_queued_requests(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    pipeline_executor.admit_workflow(store, event("a"))
+    pipeline_executor.admit_workflow(store, event("b"))
+    pipeline_executor.admit_workflow(store, event("low", "LOW"))
+    pipeline_executor.admit_workflow(store, event("high", "HIGH"))
+    states = {"workflows/a/executions/execution-1": "SUCCEEDED", "workflows/b/executions/execution-2": "ACTIVE"}
+
+    report = pipeline_executor.drain_queue(store, lambda execution_name: states[execution_name])
+
+    assert len(report["released"]) == 1
+    assert list(report["launched"].values()) == ["execution-3"]
+    assert pipeline_executor.launch_event.launched == ["a", "b", "high"]
+    assert queued_names(store) == ["low"]
+    assert sorted(slot["workflow_name"] for slot in store.slots().values()) == ["b", "high"]
+
+
+def test_drain_keeps_queued_requests_while_executions_run(pipeline_executor, admission):
+    store = admission.InMemoryAdmissionStore()
+    for workflows_name in ["a", "b", "c"]:
+        pipeline_executor.admit_workflow(store, event(workflows_name))
+
+    report = pipeline_executor.drain_queue(store, lambda execution_name: "ACTIVE")
+
+    assert report["released"] == [] and report["launched"] == {}
+    assert queued_names(store) == ["c"]
+
+
+def test_drain_dead_letters_requests_that_keep_failing_to_launch(pipeline_executor, admission, monkeypatch):
+    monkeypatch.setattr(pipeline_executor, "ADMISSION_MAX_LAUNCH_ATTEMPTS", 2)
+    store = admission.InMemoryAdmissionStore()
+    pipeline_executor.launch_event.failing.add("deleted")
+    store.enqueue(event("deleted"), "NORMAL")
+    store.enqueue(event("b"), "NORMAL")
+
+    first = pipeline_executor.drain_queue(store, lambda execution_name: "SUCCEEDED")
+    assert first["dead_lettered"] == [] and queued_names(store) == ["deleted"]
+    second = pipeline_executor.drain_queue(store, lambda execution_name: "SUCCEEDED")
+
+    assert len(second["dead_lettered"]) == 1 and queued_names(store) == []
+    dead_letter = store.dead_letters[second["dead_lettered"][0]]
+    assert dead_letter["attempts"] == 2 and "not found" in dead_letter["last_error"]
+    assert pipeline_executor.admit_workflow(store, event("c"))[1] == "launched"
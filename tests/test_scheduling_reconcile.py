@@ -0,0 +1,158 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from types import SimpleNamespace
+
+import pytest
+
+PAUSED = "PAUSED"
+ENABLED = "ENABLED"
+
+
+def schedule(crond_expression="0 7 * * *", workflow_status="ENABLED"):
+    return {"crond_expression": crond_expression, "time_zone": "UTC", "date_format": "%Y-%m-%d",
+            "workflow_status": workflow_status, "workflow_properties": "{}"}
+
+
+class FakeFirestore:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def collection(self, name):
+        return self
+
+    def stream(self):
+        return [SimpleNamespace(id=doc_id, to_dict=lambda document=document: document)
+                for doc_id, document in self.documents.items()]
+
+
+class FakeScheduler:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.calls = []
+
+    def list_jobs(self, parent):
+        return list(self.jobs)
+
+    def create_job(self, parent, job):
+        self.calls.append(("create_job", job["name"].split("/")[-1]))
+
+    def update_job(self, job):
+        self.calls.append(("update_job", job["name"].split("/")[-1]))
+
+    def pause_job(self, name):
+        self.calls.append(("pause_job", name.split("/")[-1]))
+
+    def resume_job(self, name):
+        self.calls.append(("resume_job", name.split("/")[-1]))
+
+    def delete_job(self, name):
+        self.calls.append(("delete_job", name.split("/")[-1]))
+
+
+@pytest.fixture
+def scheduling(load_function, monkeypatch):
+    scheduling = load_function("orchestration-helpers/scheduling")
+    monkeypatch.setattr(scheduling, "WORKFLOW_SCHEDULING_PROJECT_ID", "project")
+    monkeypatch.setattr(scheduling, "WORKFLOW_SCHEDULING_PROJECT_REGION", "region")
+    monkeypatch.setattr(scheduling, "WORKFLOW_SCHEDULING_PROJECT_NUMBER", "1234")
+    monkeypatch.setattr(scheduling, "PIPELINE_EXECUTION_FUNCTION_NAME", "pipeline-executor")
+    monkeypatch.setattr(scheduling.scheduler_v1.Job.State, "PAUSED", PAUSED)
+    return scheduling
+
+
+def existing_job(scheduling, job_name, document, state=ENABLED):
+    """scheduler job as listed by cloud scheduler for a firestore document"""
+    job = scheduling.desired_job_state(job_name, document)["job"]
+    return SimpleNamespace(name=job["name"], schedule=job["schedule"], time_zone=job["time_zone"], state=state,
+                           http_target=SimpleNamespace(uri=job["http_target"]["uri"], body=job["http_target"]["body"]))
+
+
+def test_plan_covers_create_update_delete_and_unchanged(scheduling):
+    documents = {
+        "unchanged": schedule(),
+        "new": schedule(),
+        "new_disabled": schedule(workflow_status="DISABLED"),
+        "rescheduled": schedule(crond_expression="0 9 * * *"),
+        "disabled": schedule(workflow_status="DISABLED"),
+        "enabled": schedule(),
+    }
+    jobs = [
+        existing_job(scheduling, "unchanged", documents["unchanged"]),
+        existing_job(scheduling, "rescheduled", schedule()),
+        existing_job(scheduling, "disabled", documents["disabled"]),
+        existing_job(scheduling, "enabled", documents["enabled"], state=PAUSED),
+        existing_job(scheduling, "removed", schedule()),
+    ]
+
+    report = scheduling.reconcile_schedules(FakeFirestore(documents), FakeScheduler(jobs), dry_run=True)
+
+    assert report["operations"] == {
+        "new": ["CREATE"],
+        "new_disabled": ["CREATE", "PAUSE"],
+        "rescheduled": ["UPDATE"],
+        "disabled": ["PAUSE"],
+        "enabled": ["RESUME"],
+        "removed": ["DELETE"],
+    }
+    assert report["schedules"] == 6
+    assert report["scheduler_jobs"] == 5
+
+
+def test_dry_run_makes_no_scheduler_call(scheduling):
+    scheduler = FakeScheduler([existing_job(scheduling, "removed", schedule())])
+
+    scheduling.reconcile_schedules(FakeFirestore({"new": schedule()}), scheduler, dry_run=True)
+
+    assert scheduler.calls == []
+
+
+def test_apply_runs_the_planned_operations(scheduling):
+    documents = {"unchanged": schedule(), "new": schedule(workflow_status="DISABLED"),
+                 "rescheduled": schedule(crond_expression="0 9 * * *")}
+    scheduler = FakeScheduler([
+        existing_job(scheduling, "unchanged", documents["unchanged"]),
+        existing_job(scheduling, "rescheduled", schedule()),
+        existing_job(scheduling, "removed", schedule()),
+    ])
+
+    report = scheduling.reconcile_schedules(FakeFirestore(documents), scheduler, dry_run=False,
+                                            calls_per_second=1000)
+
+    assert report["errors"] == {}
+    assert sorted(scheduler.calls) == [("create_job", "new"), ("delete_job", "removed"), ("pause_job", "new"),
+                                       ("update_job", "rescheduled")]
+    # the operations of a job are applied in order
+    assert scheduler.calls.index(("create_job", "new")) < scheduler.calls.index(("pause_job", "new"))
+
+
+def test_jobs_of_other_targets_are_left_alone(scheduling):
+    foreign_job = existing_job(scheduling, "foreign", schedule())
+    foreign_job.http_target.uri = "https://example.com/other"
+
+    report = scheduling.reconcile_schedules(FakeFirestore({}), FakeScheduler([foreign_job]), dry_run=True)
+
+    assert report["operations"] == {}
+
+
+def test_failed_operations_are_reported(scheduling):
+    scheduler = FakeScheduler([])
+
+    def failing_create_job(parent, job):
+        raise RuntimeError("quota exceeded")
+    scheduler.create_job = failing_create_job
+
+    report = scheduling.reconcile_schedules(FakeFirestore({"new": schedule()}), scheduler, dry_run=False,
+                                            calls_per_second=1000)
+
+    assert report["errors"] == {"new": "RuntimeError('quota exceeded')"}